@@ -1,27 +1,163 @@
 import pyntelope
+import gc
 import json
 import os
-import nltk
-import torch
-import numpy as np
-from nltk.translate.meteor_score import single_meteor_score
-from rouge import Rouge 
-from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
-from nltk.lm.preprocessing import padded_everygram_pipeline
-from nltk.lm import Laplace
-from nltk.tokenize import word_tokenize, sent_tokenize
-from nltk.lm import Lidstone
-from transformers import BertTokenizer, BertModel
-from scipy.spatial.distance import cityblock  # Manhattan Distance
-from scipy.spatial.distance import jaccard
-from scipy.stats import spearmanr, pearsonr
-
-from flask import Flask, request, jsonify
+import sys
+import time
+
+from flask import Flask, g, request, jsonify
 from flask_cors import CORS
 
+from corpus_lm import corpus_perplexity, get_corpus_lm
+from corpus_scoring import score_corpus
+from dataset_cache import get_compiled_datasets
+from encoder_registry import get_registry
+from grounding_index import DEFAULT_TOP_K as GROUNDING_TOP_K, get_grounding_index
+from metric_families import DEFAULT_PROFILE, PROFILES, SKIPPED_VALUE, PairContext, bertscore_values, encodings_for_families, families_for_profile, json_values, run_families
+from metric_families import families_warmed, family_status, warm_families_async
+from reference_cache import get_reference_cache
+from text_analysis import TextAnalysis
+from result_cache import get_result_cache, result_key
+from job_queue import JobQueue
+from memory_monitor import DEFAULT_TOP_N as MEMORY_TOP_N, get_memory_monitor
+from near_duplicates import DEFAULT_THRESHOLD as DEDUPE_THRESHOLD, collapse_pairs
+from scoring_scheduler import BULK, INTERACTIVE, Overloaded, get_scheduler
+
 app = Flask(__name__)
 CORS(app)
 
+# Development server settings; in production run `gunicorn backEnd:app` from this
+# directory, which picks up gunicorn.conf.py (pre-forked workers, same variables)
+HOST = os.environ.get('PASSER_HOST', '127.0.0.1')
+PORT = int(os.environ.get('PASSER_PORT', 8088))
+DEBUG = os.environ.get('PASSER_DEBUG', '0') == '1'
+
+# GET /debug/memory answers 404 unless this is set (it lists code paths and may take
+# a tracemalloc snapshot); per-request memory records are logged either way
+MEMORY_DEBUG = os.environ.get('PASSER_MEMORY_DEBUG', '0') == '1'
+
+# With PASSER_STORE_RESULTS=0 results are not written to MongoDB or the llmtest
+# contract, e.g. for benchmarks such as memory_soak.py
+STORE_RESULTS = os.environ.get('PASSER_STORE_RESULTS', '1') == '1'
+
+# Set by gunicorn.conf.py: the pre-fork master loads everything, the workers start the job queue
+PREFORK = os.environ.get('PASSER_PREFORK', '0') == '1'
+
+# Number of texts per padded BERT forward pass in /metrics/batch
+BATCH_SIZE = int(os.environ.get('PASSER_BATCH_SIZE', 16))
+
+# Accepted /jobs requests are persisted here and scored by a worker pool
+JOB_DB = os.environ.get('PASSER_JOB_DB', 'scoring_jobs.db')
+JOB_WORKERS = int(os.environ.get('PASSER_JOB_WORKERS', 2))
+JOB_MAX_WAIT = 60.0
+# Running jobs not renewed for this long (their worker was killed or recycled) are requeued
+JOB_LEASE = float(os.environ.get('PASSER_JOB_LEASE', 60))
+# Queued jobs (across all processes) beyond which /jobs answers 429
+JOB_QUEUE_LIMIT = int(os.environ.get('PASSER_JOB_QUEUE_LIMIT', 200))
+
+# Items of a batch scored per bulk scheduling slot; between chunks the slot goes to
+# waiting /metrics requests and to the other users' runs (see scoring_scheduler)
+BULK_CHUNK = int(os.environ.get('PASSER_BULK_CHUNK', BATCH_SIZE))
+
+# 'sequential' runs the metric families one after the other, 'concurrent' overlaps
+# the lexical families with BERT inference on a thread pool
+METRICS_MODE = os.environ.get('PASSER_METRICS_MODE', 'sequential')
+METRIC_THREADS = int(os.environ.get('PASSER_METRIC_THREADS', 4))
+
+# Latency budget in seconds of a /metrics or /metrics/batch request that does not set
+# 'deadline'; 0 scores everything. Over budget, the expensive families are left out.
+DEADLINE = float(os.environ.get('PASSER_DEADLINE', 0))
+
+# Metric profile used when a request does not name one ('full', 'cps' or 'lexical-only')
+METRICS_PROFILE = os.environ.get('PASSER_METRICS_PROFILE', DEFAULT_PROFILE)
+
+# Families of the default profile; only these are loaded and warmed at startup,
+# the others are imported on first use
+STARTUP_FAMILIES = families_for_profile(METRICS_PROFILE)
+
+# Load the BERT encoder once per process, in the background, so /ready can report
+# progress; profiles without neural metrics never import torch or transformers
+encoder_registry = get_registry()
+NEEDS_ENCODER = bool(encodings_for_families(STARTUP_FAMILIES))
+if NEEDS_ENCODER:
+    encoder_registry.load_async()
+
+# Reference-side tokenizations, n-gram models and embeddings, shared across requests
+reference_cache = get_reference_cache()
+
+# Results vectors of pairs that were already scored with the same metrics
+result_cache = get_result_cache()
+
+# Scoring slots shared by interactive /metrics checks and bulk batches and jobs
+scheduler = get_scheduler()
+
+# RSS (and, with PASSER_TRACEMALLOC, traced allocation) deltas of the scoring requests
+memory_monitor = get_memory_monitor()
+MEMORY_ENDPOINTS = {'metrics', 'metrics_batch', 'metrics_corpus', 'grounding_scores', 'submit_job'}
+
+# QA datasets (.json) or text files whose vocabulary warms the METEOR stem and synonym
+# memos during the warm-up, separated by os.pathsep, e.g. ../../../EUDataset.json
+METEOR_VOCAB = [path for path in os.environ.get('PASSER_METEOR_VOCAB', '').split(os.pathsep) if path]
+
+# Import and run each startup family once in the background; /ready answers 503 until
+# they are warmed. With PASSER_WARM_UP=0 families load on the first request instead.
+WARM_UP = os.environ.get('PASSER_WARM_UP', '1') == '1'
+if WARM_UP:
+    warm_families_async(STARTUP_FAMILIES, METEOR_VOCAB)
+
+@app.before_request
+def start_memory_record():
+    if request.endpoint in MEMORY_ENDPOINTS:
+        g.memory_token = memory_monitor.start()
+
+@app.after_request
+def finish_memory_record(response):
+    token = g.pop('memory_token', None)
+    if token is not None:
+        record = memory_monitor.finish(token, request.endpoint)
+        print(f"Memory {request.endpoint}: RSS {record['rss_mb']} MB ({record['rss_delta_mb']:+} MB),"
+              f" peak +{record['peak_rss_delta_mb']} MB" +
+              (f", traced peak {record['traced_peak_mb']} MB" if 'traced_peak_mb' in record else ''))
+    return response
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # Liveness only: the process is up and serving requests
+    return jsonify({'status': 'ok'}), 200
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    is_ready = (not NEEDS_ENCODER or encoder_registry.is_ready()) and (not WARM_UP or families_warmed(STARTUP_FAMILIES))
+    status = {
+        'ready': is_ready,
+        'profile': METRICS_PROFILE,
+        'encoder': encoder_registry.status(),
+        'families': family_status(),
+    }
+    return jsonify(status), (200 if is_ready else 503)
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify({'result_cache': result_cache.stats(), 'reference_cache': reference_cache.stats(),
+                    'compiled_datasets': [dataset.stats() for dataset in get_compiled_datasets()],
+                    'scheduler': scheduler.stats()}), 200
+
+@app.route('/debug/memory', methods=['GET'])
+def debug_memory():
+    # ?gc=1 collects garbage first, ?top=<n> sizes the tracemalloc top lists (PASSER_TRACEMALLOC)
+    if not MEMORY_DEBUG:
+        return jsonify({'error': 'Memory debugging is disabled (PASSER_MEMORY_DEBUG).'}), 404
+    collected = gc.collect() if request.args.get('gc') == '1' else None
+    report = memory_monitor.report()
+    report['collected'] = collected
+    report['caches'] = {'result_cache': result_cache.stats(), 'reference_cache': reference_cache.stats(),
+                        'scheduler': scheduler.stats()}
+    # Process-wide memos that grow with the vocabulary seen; only reported once loaded
+    if 'meteor_engine' in sys.modules:
+        report['caches']['meteor'] = sys.modules['meteor_engine'].get_meteor_engine().stats()
+    report['allocations'] = memory_monitor.top(int(request.args.get('top', MEMORY_TOP_N)))
+    return jsonify(report), 200
+
 @app.route('/getnames', methods=['GET'])
 def get_test_names():
     # Connect to MongoDB
@@ -50,6 +186,9 @@ def metrics():
     data = request.json
     if not data:
         return jsonify({'error': 'JSON data is missing.'}), 400
+    deadline, error = request_deadline(data.get('deadline'))
+    if error:
+        return jsonify({'error': error}), 400
 
     reference = data.get('reference')
     if not reference:
@@ -66,278 +205,488 @@ def metrics():
     description = data.get('description')
     if not testID:
         return jsonify({'error': 'Description parameter is missing.'}), 400
+    profile = data.get('profile', METRICS_PROFILE)
+    if profile not in PROFILES:
+        return jsonify({'error': f'Unknown metric profile: {profile}.'}), 400
+    grounding = bool(data.get('grounding'))
+    if grounding:
+        error = check_grounding()
+        if error:
+            return jsonify({'error': error}), 503
+    corpus_lm = bool(data.get('corpus_perplexity'))
+    if corpus_lm:
+        error = check_corpus_lm()
+        if error:
+            return jsonify({'error': error}), 503
     
     print("reference ---> ", reference)
     print("candidate ---> ", candidate)
     print("userID ---> ", userID)
     print("testID ---> ", testID)
     print("description ---> ", description)
+    print("profile ---> ", profile)
 
-    calc_metrics(reference, candidate, userID, testID, description)
-    return jsonify({'message': 'Metrics calculated successfully.'})
-
-def calc_metrics (reference:str, candidate:str, userID:str, testID:str, description:str)->str:
+    try:
+        return calc_metrics(reference, candidate, userID, testID, description, profile, grounding, corpus_lm, deadline)
+    except Overloaded as e:
+        return too_busy(str(e), e.retry_after)
 
-    meteor_score = single_meteor_score(reference.split(), candidate.split())
-    print("METEOR", meteor_score)
-
-    hypothesis = reference
-    ref = candidate
+@app.route('/metrics/batch', methods=['POST'])
+def metrics_batch():
+    data = request.json
+    if not data:
+        return jsonify({'error': 'JSON data is missing.'}), 400
+    deadline, error = request_deadline(data.get('deadline'))
+    if error:
+        return jsonify({'error': error}), 400
 
-    rouge = Rouge()
-    rouge_scores = rouge.get_scores(hypothesis, ref)
+    userID = data.get('userID')
+    if not userID:
+        return jsonify({'error': 'userID parameter is missing.'}), 400
+    error = check_items(data.get('items'))
+    if error:
+        return jsonify({'error': error}), 400
+    items = data['items']
+    profile = data.get('profile', METRICS_PROFILE)
+    if profile not in PROFILES:
+        return jsonify({'error': f'Unknown metric profile: {profile}.'}), 400
+    grounding = bool(data.get('grounding'))
+    if grounding:
+        error = check_grounding()
+        if error:
+            return jsonify({'error': error}), 503
+    corpus_lm = bool(data.get('corpus_perplexity'))
+    if corpus_lm:
+        error = check_corpus_lm()
+        if error:
+            return jsonify({'error': error}), 503
+    dedupe, error = dedupe_threshold(data.get('dedupe'))
+    if error:
+        return jsonify({'error': error}), 400
+    # Turned away before any item is scored or stored, so a retry does not store twice
+    try:
+        scheduler.admit(BULK)
+    except Overloaded as e:
+        return too_busy(str(e), e.retry_after)
+
+    print(f"batch of {len(items)} items ({profile}) from userID ---> ", userID)
+
+    flow = scoring_flow(data)
+    results = calc_metrics_batch(items, userID, profile, dedupe, deadline, flow)
+    if grounding:
+        with scheduler.slot(BULK, flow, admit=False):
+            grounded = ground_candidates([item['candidate'] for item in items])
+        for result, grounded_item in zip(results, grounded):
+            result['grounding'] = grounded_item
+    if corpus_lm:
+        for result, item in zip(results, items):
+            result['corpus_perplexity'] = corpus_perplexity(TextAnalysis(item['candidate']))
+    return jsonify({'message': 'Metrics calculated successfully.', 'profile': profile, 'results': results})
+
+@app.route('/metrics/corpus', methods=['POST'])
+def metrics_corpus():
+    # Run-level BLEU/ROUGE/F1 of a whole test run, with the per-question values of the same pass
+    data = request.json
+    if not data:
+        return jsonify({'error': 'JSON data is missing.'}), 400
 
-    print("ROUGE", rouge_scores)
-    
-   # Reference and candidate sentences should be tokenized
-    reference_blue = reference.split()
-    candidate_blue = candidate.split()
-
-    # Create a smoothing function
-    smoothie = SmoothingFunction().method4
-
-    # Calculate BLEU score with smoothing
-    blue_score = sentence_bleu([reference_blue], candidate_blue, smoothing_function=smoothie)
-
-    print("BLEU", blue_score)
-
-    # Example text paragraph
-    text_paragraph = reference
-    # Tokenize the text into sentences
-    tokenized_text = [list(map(str.lower, word_tokenize(sent))) for sent in nltk.sent_tokenize(text_paragraph)]
-
-    # Train-test split (in a real scenario, you should use separate training and testing sets)
-    train_data, vocab = padded_everygram_pipeline(2, tokenized_text)  # Example uses a bigram model
-
-    # Train an n-gram model with Laplace smoothing (add-one smoothing)
-    model = Laplace(2)  # Using a bigram model for this example
-    model.fit(train_data, vocab)
-
-    # Function to calculate perplexity
-    def calculate_perplexity(model, text):
-        test_data, _ = padded_everygram_pipeline(2, [word_tokenize(text.lower())])
-        return model.perplexity(next(test_data))
-
-    # Example text to evaluate
-    test_text = candidate
-
-    # Calculate perplexity
-    laplace_perplexity = calculate_perplexity(model, test_text)
-    print(f"Laplace Perplexity: {laplace_perplexity}")
-
-    # Sample training text
-    training_text = reference
-    # Tokenizing the training text into sentences and then into words
-    tokenized_text = [list(map(str.lower, word_tokenize(sent))) for sent in sent_tokenize(training_text)]
-
-    # Preparing the training data for a trigram model
-    n = 3  # Order of the n-gram model
-    train_data, padded_sents = padded_everygram_pipeline(n, tokenized_text)
-
-    # Creating and training the language model with Lidstone smoothing
-    # gamma is the Lidstone smoothing parameter, typically a small fraction
-    gamma = 0.1
-    model = Lidstone(order=n, gamma=gamma)
-    model.fit(train_data, padded_sents)
-
-    # Sample text paragraph to calculate perplexity
-    test_text = candidate
-    # Tokenizing the test text
-    tokenized_test_text = [list(map(str.lower, word_tokenize(sent))) for sent in sent_tokenize(test_text)]
-    # Preparing the test data
-    test_data, _ = padded_everygram_pipeline(n, tokenized_test_text)
-
-    # Calculating and printing the perplexity of the test text
-    # Perplexity is calculated as the exponentiated negative average log-likelihood of the test set
-    lidstone_perplexity = model.perplexity(next(test_data))
-    print(f"Lidstone Perplexity of the test text: {lidstone_perplexity}")
-
-    # Function to encode text to BERT embeddings
-    def get_bert_embedding(text, tokenizer, model):
-        # Tokenize and convert to tensor
-        inputs = tokenizer(text, return_tensors="pt", padding=True, truncation=True, max_length=512)
-        # Get embeddings
-        with torch.no_grad():
-            outputs = model(**inputs)
-        # Use the [CLS] token embedding for representing the sentence
-        return outputs.last_hidden_state[:, 0, :].numpy()
-
-    # Initialize the tokenizer and model for BERT
-    tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
-    model = BertModel.from_pretrained('bert-base-uncased')
-
-    # Sample text paragraphs
-    text_1 = reference
-    text_2 = candidate
-
-    # Tokenize the text paragraphs
-    inputs_1 = tokenizer(text_1, return_tensors='pt', padding=True, truncation=True, max_length=512)
-    inputs_2 = tokenizer(text_2, return_tensors='pt', padding=True, truncation=True, max_length=512)
-
-    # Generate embeddings
-    with torch.no_grad():
-        outputs_1 = model(**inputs_1)
-        outputs_2 = model(**inputs_2)
-
-    # Get the embeddings for the [CLS] token (used as the aggregate representation for classification tasks)
-    embeddings_1 = outputs_1.last_hidden_state[:, 0, :]
-    embeddings_2 = outputs_2.last_hidden_state[:, 0, :]
-
-    # Calculate cosine similarity between the two embeddings
-    cosine_similarity = torch.nn.functional.cosine_similarity(embeddings_1, embeddings_2)
-
-    # Function to encode text to BERT embeddings
-    def get_bert_embedding_manhatan(text, tokenizer, model):
-        inputs = tokenizer(text, return_tensors="pt", padding=True, truncation=True, max_length=512)
-        with torch.no_grad():
-            outputs = model(**inputs)
-        # Aggregate embedding representation
-        return outputs.last_hidden_state.mean(dim=1).numpy()
-
-    embedding1M = get_bert_embedding_manhatan(text_1, tokenizer, model)
-    embedding2M = get_bert_embedding_manhatan(text_2, tokenizer, model)
-
-    # Calculate Pearson Correlation Coefficient
-    pearson_corr, _ = pearsonr(embedding1M.flatten(), embedding2M.flatten())
-
-    print(f"Cosine similarity: {cosine_similarity.item()}")
-    print(f"Pearson Correlation Coefficient: {pearson_corr}")
-
-    from collections import Counter
-
-    def f1_score(prediction, truth):
-        prediction_tokens = prediction.strip().lower().split()
-        truth_tokens = truth.strip().lower().split()
-        common_tokens = Counter(prediction_tokens) & Counter(truth_tokens)
-        num_same = sum(common_tokens.values())
-
-        if num_same == 0:
-            return 0
-
-        precision = 1.0 * num_same / len(prediction_tokens)
-        recall = 1.0 * num_same / len(truth_tokens)
-        f1 = (2 * precision * recall) / (precision + recall)
-
-        return f1
-
-    # Example
-    prediction = candidate
-    truth = reference
-
-    f1 = f1_score(prediction, truth)
-
-    print(f"F1 Score: {f1:.3f}")
-
-    def compute_bertscore_alternative(predictions, references):
-        # You already have BERT model and tokenizer loaded in your code
-        tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
-        model = BertModel.from_pretrained('bert-base-uncased')
-        
-        # Get embeddings for predictions and references
-        pred_embeddings = []
-        ref_embeddings = []
-        
-        # Process each prediction and reference
-        for pred, ref in zip([predictions], [references]):
-            # Get embeddings
-            pred_inputs = tokenizer(pred, return_tensors='pt', padding=True, truncation=True, max_length=512)
-            ref_inputs = tokenizer(ref, return_tensors='pt', padding=True, truncation=True, max_length=512)
-            
-            with torch.no_grad():
-                pred_outputs = model(**pred_inputs)
-                ref_outputs = model(**ref_inputs)
-            
-            # Get token-level embeddings
-            pred_emb = pred_outputs.last_hidden_state
-            ref_emb = ref_outputs.last_hidden_state
-            
-            # Calculate F1 using cosine similarity
-            similarities = torch.nn.functional.cosine_similarity(
-                pred_emb.unsqueeze(2), 
-                ref_emb.unsqueeze(1), 
-                dim=3
-            )
-            
-            # Calculate precision, recall, F1
-            precision = similarities.max(dim=2)[0].mean().item()
-            recall = similarities.max(dim=1)[0].mean().item()
-            f1 = 2 * precision * recall / (precision + recall) if precision + recall > 0 else 0
-            
-            return {'precision': precision, 'recall': recall, 'f1': f1}
-        
-    bert1_score = compute_bertscore_alternative(reference, candidate)
-    print("BERT Score", bert1_score)
+    userID = data.get('userID')
+    if not userID:
+        return jsonify({'error': 'userID parameter is missing.'}), 400
+    error = check_items(data.get('items'))
+    if error:
+        return jsonify({'error': error}), 400
+    items = data['items']
+
+    print(f"corpus of {len(items)} items from userID ---> ", userID)
+
+    try:
+        with scheduler.slot(BULK, scoring_flow(data)):
+            questions, corpus = score_corpus((item['reference'], item['candidate']) for item in items)
+    except Overloaded as e:
+        return too_busy(str(e), e.retry_after)
+    return jsonify({'message': 'Corpus metrics calculated successfully.', 'corpus': corpus,
+                    'results': [{'testID': item['testID'], 'values': values} for item, values in zip(items, questions)]})
+
+@app.route('/grounding', methods=['POST'])
+def grounding_scores():
+    # Best supporting source paragraphs of one candidate ('candidate') or many ('candidates')
+    data = request.json
+    if not data:
+        return jsonify({'error': 'JSON data is missing.'}), 400
 
-    def evaluate_bert_rt_score(reference, candidate, tokenizer, model):
-        # Create a combined input for quality assessment
-        combined_text = f"Reference: {reference} Candidate: {candidate}"
-        
-        # Tokenize and get embeddings
-        inputs = tokenizer(combined_text, return_tensors='pt', padding=True, truncation=True, max_length=512)
-        
-        with torch.no_grad():
-            outputs = model(**inputs)
-        
-        # Get the embeddings for the [CLS] token
-        cls_embedding = outputs.last_hidden_state[:, 0, :]
-        
-        # Simple scoring based on vector norms and similarities
-        # We'll use different projections of the embedding to simulate different aspects
-        
-        # Get base similarity
-        ref_inputs = tokenizer(reference, return_tensors='pt', padding=True, truncation=True, max_length=512)
-        cand_inputs = tokenizer(candidate, return_tensors='pt', padding=True, truncation=True, max_length=512)
-        
-        with torch.no_grad():
-            ref_outputs = model(**ref_inputs)
-            cand_outputs = model(**cand_inputs)
-        
-        ref_emb = ref_outputs.last_hidden_state[:, 0, :]
-        cand_emb = cand_outputs.last_hidden_state[:, 0, :]
-        
-        # Calculate base similarity
-        sim = torch.nn.functional.cosine_similarity(ref_emb, cand_emb).item()
-        
-        # Calculate different "aspect" scores using vector projections
-        
-        # Coherence: how well the text flows (use normalized embedding components)
-        coherence = (torch.norm(cls_embedding[:, :100]).item() / 10.0) * sim
-        coherence = min(max(coherence, 0.0), 5.0)  # Scale to 0-5
-        
-        # Consistency: semantic alignment (direct similarity)
-        consistency = sim * 5.0  # Scale similarity to 0-5
-        
-        # Fluency: language quality (use different embedding components)
-        fluency = (torch.norm(cls_embedding[:, 100:300]).item() / 15.0) * sim
-        fluency = min(max(fluency, 0.0), 5.0)  # Scale to 0-5
-        
-        # Relevance: how relevant the response is to the reference
-        relevance = sim * 5.0  # Scale similarity to 0-5
-        
-        # Average score
-        avg_score = (coherence + consistency + fluency + relevance) / 4.0
-        
-        return {
-            'coherence': coherence,
-            'consistency': consistency,
-            'fluency': fluency,
-            'relevance': relevance,
-            'avg_score': avg_score
-        }
+    candidates = data.get('candidates')
+    if candidates is None and data.get('candidate'):
+        candidates = [data['candidate']]
+    if not candidates or not isinstance(candidates, list) or not all(candidates) \
+            or not all(isinstance(candidate, str) for candidate in candidates):
+        return jsonify({'error': 'Candidate parameter is missing.'}), 400
+    k, error = grounding_top_k(data.get('k'))
+    if error:
+        return jsonify({'error': error}), 400
+    error = check_grounding()
+    if error:
+        return jsonify({'error': error}), 503
+
+    try:
+        # Encoding the candidates is neural scoring work like /metrics
+        with scheduler.slot(INTERACTIVE):
+            results = ground_candidates(candidates, k)
+    except Overloaded as e:
+        return too_busy(str(e), e.retry_after)
+    return jsonify({'message': 'Grounding calculated successfully.', 'index': get_grounding_index().stats(),
+                    'results': results}), 200
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    # Same body as /metrics, or as /metrics/batch when it carries 'items'
+    data = request.json
+    if not data:
+        return jsonify({'error': 'JSON data is missing.'}), 400
+    if not data.get('userID'):
+        return jsonify({'error': 'userID parameter is missing.'}), 400
 
-    # Use the function with your existing BERT model
-    bert_rt_score = evaluate_bert_rt_score(reference, candidate, tokenizer, model)
-    print("BERT-RT Score", bert_rt_score)
+    if 'items' in data:
+        kind = 'batch'
+        error = check_items(data.get('items'))
+    else:
+        kind = 'metrics'
+        error = check_items([data])
+    if error:
+        return jsonify({'error': error}), 400
+    if data.get('profile', METRICS_PROFILE) not in PROFILES:
+        return jsonify({'error': f"Unknown metric profile: {data['profile']}."}), 400
+    _, error = dedupe_threshold(data.get('dedupe'))
+    if error:
+        return jsonify({'error': error}), 400
+    queued = job_queue.counts().get('queued', 0)
+    if queued >= JOB_QUEUE_LIMIT:
+        return too_busy(f'{queued} scoring jobs are already queued.', job_queue.retry_after(queued))
+
+    job_id = job_queue.submit(kind, data)
+    print(f"{kind} job {job_id} queued for userID ---> ", data['userID'])
+    return jsonify({'jobID': job_id, 'status': 'queued'}), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found.'}), 404
+    job.pop('result')
+    return jsonify(job), 200
+
+@app.route('/jobs/<job_id>/result', methods=['GET'])
+def job_result(job_id):
+    # ?wait=<seconds> long-polls until the job finishes
+    wait, error = result_wait(request.args.get('wait'))
+    if error:
+        return jsonify({'error': error}), 400
+    job = job_queue.wait(job_id, wait) if wait > 0 else job_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found.'}), 404
+    if job['status'] == 'failed':
+        return jsonify(job), 500
+    if job['status'] != 'done':
+        return jsonify(job), 202
+    return jsonify(job), 200
+
+def check_items(items)->str:
+    """Returns an error message if a list of scoring items is malformed"""
+    if not items or not isinstance(items, list):
+        return 'Items parameter is missing.'
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            return f'Item {i} is not an object.'
+        for field in ('reference', 'candidate', 'testID'):
+            if not item.get(field):
+                return f'{field} parameter is missing in item {i}.'
+    return None
+
+def too_busy(message:str, retry_after:int):
+    """429 response asking the client to come back in retry_after seconds"""
+    response = jsonify({'error': message, 'retryAfter': retry_after})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429
+
+def scoring_flow(data:dict)->tuple:
+    """(userID, testID) a /metrics/batch, /metrics/corpus or /jobs body is scheduled fairly by"""
+    testID = data.get('testID')
+    if not testID and data.get('items'):
+        testID = data['items'][0].get('testID')
+    return (data.get('userID'), testID)
+
+def request_deadline(value)->tuple:
+    """(deadline, error) of a request's 'deadline' budget in seconds, as a time.perf_counter() value"""
+    if value is None:
+        value = DEADLINE
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0:
+        return None, 'deadline must be a number of seconds.'
+    if value == 0:
+        return None, None
+    return time.perf_counter() + value, None
+
+def result_wait(value)->tuple:
+    """(seconds, error) of a /jobs/<id>/result '?wait=' query value, clamped to [0, JOB_MAX_WAIT]"""
+    if value is None:
+        return 0.0, None
+    try:
+        seconds = float(value)
+    except ValueError:
+        return None, 'wait must be a number of seconds.'
+    if seconds != seconds:
+        return None, 'wait must be a number of seconds.'
+    return min(max(seconds, 0.0), JOB_MAX_WAIT), None
+
+def dedupe_threshold(value)->tuple:
+    """(threshold, error) of a request's 'dedupe' option: true for the default threshold or a similarity in (0, 1]"""
+    if value is None or value is False:
+        return None, None
+    if value is True:
+        return DEDUPE_THRESHOLD, None
+    if isinstance(value, (int, float)) and 0 < value <= 1:
+        return float(value), None
+    return None, 'dedupe must be true or a similarity threshold in (0, 1].'
+
+def grounding_top_k(value)->tuple:
+    """(k, error) of a /grounding request's 'k': a whole number of paragraphs, at least 1"""
+    if value is None:
+        return GROUNDING_TOP_K, None
+    if isinstance(value, bool) or not isinstance(value, int) or value < 1:
+        return None, 'k must be a whole number of at least 1.'
+    return value, None
+
+def check_grounding()->str:
+    """Returns an error message if grounding scores cannot be computed"""
+    try:
+        if get_grounding_index() is None:
+            return 'Grounding index is not configured (PASSER_GROUNDING_INDEX).'
+    except (OSError, ValueError, RuntimeError) as e:
+        return f'Grounding index is not available: {e}'
+    return None
+
+def check_corpus_lm()->str:
+    """Returns an error message if corpus perplexities cannot be computed"""
+    try:
+        if get_corpus_lm() is None:
+            return 'Corpus n-gram model is not configured (PASSER_CORPUS_LM).'
+    except (OSError, ValueError, KeyError) as e:
+        return f'Corpus n-gram model is not available: {e}'
+    return None
+
+def ground_candidates(candidates:list, k:int=GROUNDING_TOP_K)->list:
+    """Grounding score and top-k supporting paragraphs of each candidate, from one batched encoding and matmul"""
+    from embedding_store import encode_stored_batch
+
+    # Candidates scored before are read from the embedding store when it is enabled
+    return get_grounding_index().ground(encode_stored_batch(candidates, batch_size=BATCH_SIZE), k)
+
+def run_scoring_job(kind:str, payload:dict):
+    """Job queue handler: scores and stores a queued /jobs request, recording its memory like a request"""
+    token = memory_monitor.start()
+    try:
+        return score_job(kind, payload)
+    finally:
+        record = memory_monitor.finish(token, f'job_{kind}')
+        print(f"Memory job_{kind}: RSS {record['rss_mb']} MB ({record['rss_delta_mb']:+} MB)")
+
+def score_job(kind:str, payload:dict):
+    """Scores and stores one queued job"""
+    profile = payload.get('profile', METRICS_PROFILE)
+    if kind == 'batch':
+        dedupe, _ = dedupe_threshold(payload.get('dedupe'))
+        return calc_metrics_batch(payload['items'], payload['userID'], profile, dedupe, flow=scoring_flow(payload))
+    with scheduler.slot(BULK, scoring_flow(payload), admit=False):
+        res, _ = compute_metrics(payload['reference'], payload['candidate'], families=families_for_profile(profile))
+    store_results(res, payload['reference'], payload['candidate'], payload['userID'], payload['testID'], payload.get('description', ''))
+    return json_values(res)
+
+def calc_metrics (reference:str, candidate:str, userID:str, testID:str, description:str, profile:str=METRICS_PROFILE, grounding:bool=False, corpus_lm:bool=False, deadline:float=None)->str:
+    """
+    Scores one pair in an interactive scheduler slot (raising Overloaded when
+    none is free) and stores it after. Results the deadline cut short are
+    returned but not stored: MongoDB and the contract only hold the vector,
+    where a field left out would read like one the profile skips.
+    """
+
+    timings = {}
+    not_computed = []
+    response = {'message': 'Metrics calculated successfully.', 'profile': profile}
+    with scheduler.slot(INTERACTIVE):
+        res, cached = compute_metrics(reference, candidate, timings=timings, families=families_for_profile(profile),
+                                      deadline=deadline, not_computed=not_computed)
+        if grounding:
+            # Next to the results vector, whose 24-value layout is unchanged
+            response['grounding'] = ground_candidates([candidate])[0]
+        if corpus_lm:
+            # Next to the per-reference Laplace and Lidstone values, from the model trained once on the corpus
+            response['corpus_perplexity'] = corpus_perplexity(TextAnalysis(candidate))
+    # MongoDB and the contract are slow I/O, so the slot is free for the next request by now
+    if not not_computed:
+        store_results(res, reference, candidate, userID, testID, description)
+
+    # partial: the deadline left the not_computed fields out (null like skipped ones)
+    response.update({'results': json_values(res), 'cached': cached, 'partial': bool(not_computed),
+                     'not_computed': not_computed, 'timings': timings, 'result_cache': result_cache.stats()})
+    return jsonify(response)
+
+def calc_metrics_batch(items:list, userID:str, profile:str=METRICS_PROFILE, dedupe:float=None, deadline:float=None, flow:tuple=None)->list:
+    """
+    Scores a list of {reference, candidate, testID, description} items.
+
+    The references, candidates and combined B-RT inputs the profile needs are
+    pushed through BERT as padded batches; the remaining metrics run per item.
+    Returns one {testID, results, cached} entry per item with the same 24-value
+    results vector calc_metrics stores (skipped metrics are null).
+
+    With a dedupe threshold, items whose reference and candidate are both
+    near-duplicates (MinHash estimate, see near_duplicates) of an earlier
+    item's are not scored: they get that item's results, marked duplicateOf.
+    With a deadline (time.perf_counter() value), items finishing past it are
+    partial and not stored, like calc_metrics.
+
+    Uncached items are scored BULK_CHUNK at a time, each chunk in a bulk
+    scheduler slot of the flow (userID, testID) the batch belongs to, and
+    stored once the chunk has given its slot back.
+    """
+    if dedupe:
+        representatives = collapse_pairs([(item['reference'], item['candidate']) for item in items], dedupe)
+        unique = [i for i, representative in enumerate(representatives) if representative == i]
+        if len(unique) < len(items):
+            print(f"{len(items) - len(unique)} near-duplicate items collapsed into {len(unique)}")
+            scored = dict(zip(unique, calc_metrics_batch([items[i] for i in unique], userID, profile, deadline=deadline, flow=flow)))
+            results = []
+            for i, item in enumerate(items):
+                representative = representatives[i]
+                if representative == i:
+                    results.append(scored[i])
+                    continue
+                result = scored[representative]
+                res = [SKIPPED_VALUE if x is None else x for x in result['results']]
+                if not result['partial']:
+                    store_results(res, item['reference'], item['candidate'], userID, item['testID'], item.get('description', ''))
+                results.append(dict(result, testID=item['testID'], cached=True, timings={'total': 0.0},
+                                    duplicateOf=items[representative]['testID']))
+            return results
+
+    families = families_for_profile(profile)
+    results = [None] * len(items)
+
+    # Pairs scored before are answered from the result cache and skip BERT entirely
+    for i, item in enumerate(items):
+        res = result_cache.get(result_key(item['reference'], item['candidate'], families))
+        if res is not None:
+            store_results(res, item['reference'], item['candidate'], userID, item['testID'], item.get('description', ''))
+            results[i] = {'testID': item['testID'], 'results': json_values(res), 'cached': True, 'partial': False,
+                          'not_computed': [], 'timings': {'total': 0.0}}
+    misses = [i for i in range(len(items)) if results[i] is None]
+    for start in range(0, len(misses), BULK_CHUNK):
+        chunk = misses[start:start + BULK_CHUNK]
+        with scheduler.slot(BULK, flow, admit=False):
+            scored, vectors = score_batch([items[i] for i in chunk], families, deadline)
+        for i, result, res in zip(chunk, scored, vectors):
+            item = items[i]
+            if not result['partial']:
+                store_results(res, item['reference'], item['candidate'], userID, item['testID'], item.get('description', ''))
+            results[i] = result
+    return results
+
+def score_batch(items:list, families:list, deadline:float=None)->tuple:
+    """
+    Batched BERT encoding and per-item scoring of the items calc_metrics_batch
+    could not answer from cache. Returns (results, vectors): the response
+    entries and the results vectors the caller stores.
+    """
+    needed = encodings_for_families(families)
+    n = len(items)
+
+    # References that are already in the reference cache are not encoded again
+    reference_entries = [reference_cache.get(item['reference']) for item in items]
+    uncached = []
+    if 'reference' in needed:
+        uncached = list({entry.key: entry for entry in reference_entries if not entry.has_encoding()}.values())
+
+    texts = [entry.text for entry in uncached]
+    if 'candidate' in needed:
+        texts += [item['candidate'] for item in items]
+    if 'combined' in needed:
+        texts += [f"Reference: {item['reference']} Candidate: {item['candidate']}" for item in items]
+    encodings = []
+    if texts:
+        # torch is only imported once a profile needs BERT
+        from embedding_store import encode_stored_batch
+
+        # Texts already in the embedding store are read from it instead of being encoded
+        encodings = encode_stored_batch(texts, batch_size=BATCH_SIZE)
+    for entry, encoding in zip(uncached, encodings):
+        entry.set_encoding(encoding)
+    encodings = encodings[len(uncached):]
+    candidate_encodings = encodings[:n] if 'candidate' in needed else [None] * n
+    combined_encodings = encodings[n:] if 'combined' in needed else [None] * n
+    reference_encodings = [entry.encoding() for entry in reference_entries] if 'reference' in needed else [None] * n
+
+    # BERTScore of the whole batch in a few padded matmuls instead of one per item
+    precomputed = [{} for _ in items]
+    if 'bertscore' in families:
+        from bertscore_engine import get_bertscore_engine
+
+        scores = get_bertscore_engine().score_batch(list(zip(reference_encodings, candidate_encodings)))
+        for values, score in zip(precomputed, scores):
+            values['bertscore'] = bertscore_values(score)
+
+    results, vectors = [], []
+    for i, item in enumerate(items):
+        timings = {}
+        not_computed = []
+        res, cached = compute_metrics(item['reference'], item['candidate'], reference_encodings[i],
+                                      candidate_encodings[i], combined_encodings[i], timings=timings, families=families,
+                                      check_cache=False, precomputed=precomputed[i], deadline=deadline,
+                                      not_computed=not_computed)
+        vectors.append(res)
+        results.append({'testID': item['testID'], 'results': json_values(res), 'cached': cached,
+                        'partial': bool(not_computed), 'not_computed': not_computed, 'timings': timings})
+    return results, vectors
+
+def compute_metrics(reference:str, candidate:str, reference_encoding=None, candidate_encoding=None, combined_encoding=None, timings:dict=None, families:list=None, check_cache:bool=True, precomputed:dict=None, deadline:float=None, not_computed:list=None)->tuple:
+    """
+    Computes the 24-value results vector for one (reference, candidate) pair and
+    returns (results, cached). Pairs scored before with the same families come
+    from the result cache (unless check_cache is False because the caller
+    already looked). BERT encodings that were already computed (e.g. by a
+    batch) can be passed in, and per-family timings are copied into timings when
+    it is given. families limits the run to a profile's families (all of them by
+    default). precomputed holds values of families the caller already scored
+    for a whole batch. With a deadline (time.perf_counter() value) the
+    families that did not fit are appended to not_computed, and such partial
+    results are not cached.
+    """
+    families = list(families) if families is not None else families_for_profile('full')
+    key = result_key(reference, candidate, families)
+    res = result_cache.get(key) if check_cache else None
+    if res is not None:
+        print("Result cache hit", result_cache.stats())
+        if timings is not None:
+            timings['total'] = 0.0
+        return res, True
+
+    ctx = PairContext(reference, candidate, reference_encoding, candidate_encoding, combined_encoding, precomputed)
+    missing = []
+    res, family_timings = run_families(ctx, mode=METRICS_MODE, threads=METRIC_THREADS, families=families,
+                                       deadline=deadline, not_computed=missing)
+    print("Metric family timings (s)", {name: round(t, 4) for name, t in family_timings.items()})
+    if timings is not None:
+        timings.update(family_timings)
+    if missing:
+        print("Deadline reached, not computed:", missing)
+        if not_computed is not None:
+            not_computed += missing
+    else:
+        result_cache.put(key, res)
+    return res, False
 
-    res = [meteor_score, blue_score, 
-        rouge_scores[0]['rouge-1']['r'], rouge_scores[0]['rouge-1']['p'], rouge_scores[0]['rouge-1']['f'],
-        rouge_scores[0]['rouge-2']['r'], rouge_scores[0]['rouge-2']['p'], rouge_scores[0]['rouge-2']['f'],
-        rouge_scores[0]['rouge-l']['r'], rouge_scores[0]['rouge-l']['p'], rouge_scores[0]['rouge-l']['f'],
-        laplace_perplexity, lidstone_perplexity, 
-        cosine_similarity.item(),
-        pearson_corr, f1, 
-        bert1_score['precision'], bert1_score['recall'], bert1_score['f1'], 
-        bert_rt_score['coherence'], bert_rt_score['consistency'], bert_rt_score['fluency'], bert_rt_score['relevance'], bert_rt_score['avg_score']]
+def store_results(res:list, reference:str, candidate:str, userID:str, testID:str, description:str):
+    """Stores a results vector in MongoDB and sends it to the llmtest contract"""
+    if not STORE_RESULTS:
+        return None
 
     from pymongo import MongoClient
     import datetime
@@ -439,9 +788,13 @@ def calc_metrics (reference:str, candidate:str, userID:str, testID:str, descript
     resp_fmt = json.dumps(resp, indent=4)
     print(f"Response:\n{resp_fmt}")
 
-    return jsonify({'message': 'Metrics calculated successfully.'})
+    return resp
+
+job_queue = JobQueue(JOB_DB, run_scoring_job, workers=JOB_WORKERS, flow=scoring_flow, lease_seconds=JOB_LEASE)
+if not PREFORK:
+    job_queue.start()
 
 if __name__ == '__main__':
-    # app.run(debug=True, host='127.0.0.1', port=8088)  # For local execution
-    app.run(debug=True, host='host_address', port=port)  # For server installation
+    # Local execution; set PASSER_HOST/PASSER_PORT for a server installation
+    app.run(debug=DEBUG, host=HOST, port=PORT)
 
@@ -0,0 +1,234 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import torch
+
+from encoder_registry import DEFAULT_MODEL_NAME, get_registry
+from text_encoding import TextEncoding, wordpiece_ids
+
+# JSON table written by `python bertscore_engine.py`; empty weights every token equally
+DEFAULT_IDF_PATH = os.environ.get('PASSER_BERTSCORE_IDF', '')
+
+# Upper bound on the floats of one batched matmul: the padded embeddings of a chunk
+# of pairs plus their similarity matrices (pairs x pred tokens x ref tokens)
+DEFAULT_MAX_CELLS = int(os.environ.get('PASSER_BERTSCORE_MAX_CELLS', 4 * 1024 * 1024))
+
+# Below any cosine similarity, so padded positions never win a max
+_PADDING_SIMILARITY = -2.0
+
+
+class IdfTable:
+    """
+    Inverse document frequency of WordPiece IDs over a QA corpus, as in the
+    BERTScore paper: idf(w) = log((M + 1) / (df(w) + 1)) for M documents, with
+    [CLS] and [SEP] weighted 0. Tied to the tokenizer that produced the IDs.
+    """
+
+    def __init__(self, idf: Dict[int, float], documents: int, tokenizer: str, special_ids: Sequence[int]):
+        self.idf = idf
+        self.documents = documents
+        self.tokenizer = tokenizer
+        self.special_ids = set(special_ids)
+        self.default = math.log(documents + 1)
+
+    @classmethod
+    def from_documents(cls, documents: Sequence[Sequence[int]], tokenizer: str, special_ids: Sequence[int]) -> 'IdfTable':
+        df = Counter()
+        for ids in documents:
+            df.update(set(ids))
+        total = len(documents)
+        return cls({token: math.log((total + 1) / (count + 1)) for token, count in df.items()},
+                   total, tokenizer, special_ids)
+
+    def weights(self, ids: Sequence[int]) -> List[float]:
+        return [0.0 if token in self.special_ids else self.idf.get(token, self.default) for token in ids]
+
+    def to_state(self) -> dict:
+        return {'tokenizer': self.tokenizer, 'documents': self.documents, 'special_ids': sorted(self.special_ids),
+                'idf': {str(token): value for token, value in self.idf.items()}}
+
+    @classmethod
+    def from_state(cls, state: dict) -> 'IdfTable':
+        return cls({int(token): value for token, value in state['idf'].items()},
+                   state['documents'], state['tokenizer'], state['special_ids'])
+
+    def save(self, path: str):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_state(), f)
+
+    @classmethod
+    def load(cls, path: str) -> 'IdfTable':
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_state(json.load(f))
+
+
+class BertScoreEngine:
+    """
+    BERTScore from token-level embeddings without the (L_pred x L_ref x hidden)
+    broadcast of cosine_similarity.
+
+    Token embeddings are L2-normalized once, so the similarity matrix of a
+    pair is a single matmul. Many pairs are scored with one padded batched
+    matmul per chunk, with masks keeping padding out of the maxima and means;
+    chunks are cut so no similarity tensor exceeds max_cells. Precision and
+    recall are plain means over tokens, or IDF-weighted means when an
+    IdfTable is given.
+    """
+
+    def __init__(self, idf: Optional[IdfTable] = None, max_cells: int = DEFAULT_MAX_CELLS):
+        self.idf = idf
+        self.max_cells = max_cells
+        # Identifies the IDF table, which changes the scores; None for unweighted scores
+        self.variant = None
+        if idf is not None:
+            state = json.dumps(idf.to_state(), sort_keys=True).encode('utf-8')
+            self.variant = 'idf:' + hashlib.sha256(state).hexdigest()[:16]
+
+    def _weights(self, encoding: TextEncoding) -> Optional[torch.Tensor]:
+        if self.idf is None:
+            return None
+        tokenizer, _ = get_registry().get()
+        ids = wordpiece_ids(encoding.text, tokenizer)
+        if len(ids) != encoding.num_tokens:
+            print(f"BERTScore: {len(ids)} WordPiece IDs for {encoding.num_tokens} embeddings, using uniform weights")
+            return None
+        return torch.tensor(self.idf.weights(ids), dtype=torch.float32)
+
+    @staticmethod
+    def _normalized(encoding: TextEncoding) -> torch.Tensor:
+        tokens = encoding.tokens[0]
+        return tokens / tokens.norm(dim=-1, keepdim=True).clamp_min(1e-8)
+
+    def _chunks(self, sizes: List[Tuple[int, int]], hidden: int) -> List[List[int]]:
+        # Pairs of similar shape share a chunk, so little of each matmul is padding
+        order = sorted(range(len(sizes)), key=lambda i: sizes[i])
+        chunks, chunk, rows, cols = [], [], 0, 0
+        for i in order:
+            pred_len, ref_len = sizes[i]
+            new_rows, new_cols = max(rows, pred_len), max(cols, ref_len)
+            cells = (len(chunk) + 1) * (new_rows * new_cols + (new_rows + new_cols) * hidden)
+            if chunk and cells > self.max_cells:
+                chunks.append(chunk)
+                chunk, new_rows, new_cols = [], pred_len, ref_len
+            chunk.append(i)
+            rows, cols = new_rows, new_cols
+        if chunk:
+            chunks.append(chunk)
+        return chunks
+
+    @staticmethod
+    def _mask(tensors: List[torch.Tensor], width: int) -> torch.Tensor:
+        lengths = torch.tensor([tensor.shape[0] for tensor in tensors])
+        return torch.arange(width).unsqueeze(0) < lengths.unsqueeze(1)
+
+    def _score_chunk(self, preds: List[torch.Tensor], refs: List[torch.Tensor],
+                     pred_weights: List[torch.Tensor], ref_weights: List[torch.Tensor]) -> List[Dict[str, float]]:
+        pad = torch.nn.utils.rnn.pad_sequence
+        similarities = torch.bmm(pad(preds, batch_first=True), pad(refs, batch_first=True).transpose(1, 2))
+        mask = self._mask(preds, similarities.shape[1]).unsqueeze(2) & self._mask(refs, similarities.shape[2]).unsqueeze(1)
+        similarities.masked_fill_(~mask, _PADDING_SIMILARITY)
+
+        # Weights are 0 on padding, so padded tokens drop out of the means
+        pred_w = pad(pred_weights, batch_first=True)
+        ref_w = pad(ref_weights, batch_first=True)
+        pred_total = pred_w.sum(dim=1)
+        ref_total = ref_w.sum(dim=1)
+        precision = (similarities.max(dim=2)[0] * pred_w).sum(dim=1) / pred_total.clamp_min(1e-12)
+        recall = (similarities.max(dim=1)[0] * ref_w).sum(dim=1) / ref_total.clamp_min(1e-12)
+
+        scores = []
+        for p, r in zip(precision.tolist(), recall.tolist()):
+            f1 = 2 * p * r / (p + r) if p + r > 0 else 0
+            scores.append({'precision': p, 'recall': r, 'f1': f1})
+        return scores
+
+    def score_batch(self, pairs: Sequence[Tuple[TextEncoding, TextEncoding]]) -> List[Dict[str, float]]:
+        """precision/recall/f1 of many (prediction encoding, reference encoding) pairs"""
+        preds = [self._normalized(pred) for pred, _ in pairs]
+        refs = [self._normalized(ref) for _, ref in pairs]
+        pred_weights, ref_weights = [], []
+        for (pred, ref), p, r in zip(pairs, preds, refs):
+            weights = self._weights(pred), self._weights(ref)
+            if weights[0] is None or weights[1] is None:
+                weights = torch.ones(p.shape[0]), torch.ones(r.shape[0])
+            pred_weights.append(weights[0])
+            ref_weights.append(weights[1])
+
+        scores = [None] * len(pairs)
+        with torch.no_grad():
+            sizes = [(p.shape[0], r.shape[0]) for p, r in zip(preds, refs)]
+            for chunk in self._chunks(sizes, preds[0].shape[1] if preds else 0):
+                chunk_scores = self._score_chunk([preds[i] for i in chunk], [refs[i] for i in chunk],
+                                                 [pred_weights[i] for i in chunk], [ref_weights[i] for i in chunk])
+                for i, score in zip(chunk, chunk_scores):
+                    scores[i] = score
+        return scores
+
+    def score(self, pred: TextEncoding, ref: TextEncoding) -> Dict[str, float]:
+        return self.score_batch([(pred, ref)])[0]
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_bertscore_engine() -> BertScoreEngine:
+    """Return the process-wide BERTScore engine, with the IDF table of PASSER_BERTSCORE_IDF if set"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            idf = None
+            if DEFAULT_IDF_PATH:
+                idf = IdfTable.load(DEFAULT_IDF_PATH)
+                registry = get_registry()
+                if idf.tokenizer != registry.model_name:
+                    raise ValueError(f"IDF table {DEFAULT_IDF_PATH} was built with tokenizer {idf.tokenizer}, "
+                                     f"the encoder is {registry.model_name}.")
+                print(f"BERTScore IDF weights from {DEFAULT_IDF_PATH} ({idf.documents} documents)")
+            _engine = BertScoreEngine(idf)
+        return _engine
+
+
+def corpus_documents(paths: Sequence[str], tokenizer) -> List[List[int]]:
+    """
+    WordPiece IDs of every question and answer of QA JSON datasets, every line
+    of text files, or every text of compiled datasets (see dataset_cache).
+    """
+    from dataset_cache import CompiledDataset, read_texts
+
+    documents = []
+    for path in paths:
+        if os.path.isdir(path):
+            dataset = CompiledDataset(path)
+            for row in range(len(dataset)):
+                ids = dataset.wordpiece_ids(row) if dataset.tokenizer == tokenizer.name_or_path else None
+                documents.append(ids if ids is not None else wordpiece_ids(dataset.text(row), tokenizer))
+        else:
+            documents += [wordpiece_ids(text, tokenizer) for _, _, text in read_texts(path) if text]
+    return documents
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the BERTScore IDF table from a QA corpus.')
+    parser.add_argument('sources', nargs='+', help='QA JSON datasets, paragraph text files or compiled dataset directories')
+    parser.add_argument('--output', default='bertscore_idf.json', help='Point PASSER_BERTSCORE_IDF at this file when serving')
+    parser.add_argument('--model', default=DEFAULT_MODEL_NAME, help='Tokenizer; must match the serving encoder')
+    args = parser.parse_args()
+
+    from transformers import BertTokenizer
+
+    tokenizer = BertTokenizer.from_pretrained(args.model)
+    documents = corpus_documents(args.sources, tokenizer)
+    table = IdfTable.from_documents(documents, args.model, [tokenizer.cls_token_id, tokenizer.sep_token_id])
+    table.save(args.output)
+    print(f"IDF of {len(table.idf)} WordPiece IDs over {table.documents} documents written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
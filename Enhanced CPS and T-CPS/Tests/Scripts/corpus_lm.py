@@ -0,0 +1,100 @@
+import argparse
+import hashlib
+import json
+import os
+import threading
+from typing import List, Optional, Sequence
+
+from dataset_cache import CompiledDataset, read_texts
+from ngram_perplexity import NgramLanguageModel
+from text_analysis import TextAnalysis
+
+# Model directory written by `python corpus_lm.py`; empty disables the corpus perplexity
+DEFAULT_CORPUS_LM = os.environ.get('PASSER_CORPUS_LM', '')
+
+# Trigrams like the per-reference Lidstone model; gamma smooths the unigrams the
+# Witten-Bell interpolation ends in, so unknown words keep a nonzero probability
+DEFAULT_ORDER = 3
+DEFAULT_GAMMA = 0.1
+
+
+def corpus_sentences(paths: Sequence[str]) -> List[List[str]]:
+    """
+    Lowercased word tokens per sentence of every paragraph of text files and
+    every answer of QA JSON datasets, tokenized like the reference models.
+    Compiled datasets (see dataset_cache) supply their stored sentences.
+    """
+    sentences = []
+    for path in paths:
+        if os.path.isdir(path):
+            dataset = CompiledDataset(path)
+            for row in range(len(dataset)):
+                if dataset.kind(row) != 'question':
+                    sentences += dataset.sentences(row)
+            continue
+        for kind, _, text in read_texts(path):
+            if kind != 'question' and text:
+                sentences += TextAnalysis(text).sentences
+    return sentences
+
+
+def build_corpus_lm(paths: Sequence[str], output_dir: str, order: int = DEFAULT_ORDER,
+                    gamma: float = DEFAULT_GAMMA) -> NgramLanguageModel:
+    """Fit the n-gram model on the corpus once and save its count tables under output_dir"""
+    model = NgramLanguageModel(order, gamma).fit(corpus_sentences(paths))
+    model.save(output_dir)
+    sources = {}
+    for path in paths:
+        if os.path.isdir(path):
+            sources[os.path.basename(path.rstrip(os.sep))] = CompiledDataset(path).meta['source_sha256']
+        else:
+            with open(path, 'rb') as f:
+                sources[os.path.basename(path)] = hashlib.sha256(f.read()).hexdigest()
+    with open(os.path.join(output_dir, 'sources.json'), 'w', encoding='utf-8') as f:
+        json.dump(sources, f, indent=2)
+    return NgramLanguageModel.load(output_dir)
+
+
+_model = None
+_model_lock = threading.Lock()
+
+
+def get_corpus_lm() -> Optional[NgramLanguageModel]:
+    """Return the process-wide corpus model named by PASSER_CORPUS_LM, or None when it is not set"""
+    global _model
+    if not DEFAULT_CORPUS_LM:
+        return None
+    with _model_lock:
+        if _model is None:
+            _model = NgramLanguageModel.load(DEFAULT_CORPUS_LM)
+            print(f"Corpus n-gram model from {DEFAULT_CORPUS_LM} ({_model.stats()})")
+        return _model
+
+
+def corpus_perplexity(analysis: TextAnalysis) -> Optional[float]:
+    """
+    Perplexity of a candidate under the corpus model (Witten-Bell interpolated,
+    see NgramLanguageModel.text_perplexity) over all of its sentences, or None
+    for a candidate without sentences. Nothing is fitted per request.
+    """
+    sentences = analysis.sentences
+    if not sentences:
+        return None
+    return get_corpus_lm().text_perplexity(sentences)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the corpus n-gram model used for the corpus perplexity.')
+    parser.add_argument('sources', nargs='+', help='Paragraph text files (e.g. sourceBookParagraphs.txt), QA JSON '
+                                                   'datasets (answers are used) or compiled dataset directories')
+    parser.add_argument('--output-dir', default='corpus_lm', help='Point PASSER_CORPUS_LM at this directory when serving')
+    parser.add_argument('--order', type=int, default=DEFAULT_ORDER, help='n-gram order')
+    parser.add_argument('--gamma', type=float, default=DEFAULT_GAMMA, help='Lidstone smoothing of the unigrams')
+    args = parser.parse_args()
+
+    model = build_corpus_lm(args.sources, args.output_dir, args.order, args.gamma)
+    print(f"Corpus model {model.stats()} written to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
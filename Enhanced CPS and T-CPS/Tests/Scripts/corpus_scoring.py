@@ -0,0 +1,178 @@
+import argparse
+import json
+import math
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from metric_families import f1_counts, f1_from_counts
+from rouge_engine import RougeEngine, get_rouge_engine, rouge_values
+from text_analysis import TextAnalysis
+
+# BLEU n-gram orders, uniformly weighted as in sentence_bleu
+BLEU_ORDERS = 4
+
+ROUGE_KEYS = (('rouge-1', 'Rouge-1'), ('rouge-2', 'Rouge-2'), ('rouge-l', 'Rouge-l'))
+
+
+def bleu_from_counts(numerators: List[int], denominators: List[int], hyp_len: int, ref_len: int) -> float:
+    """
+    BLEU from clipped n-gram matches and hypothesis n-gram totals per order, as
+    nltk's corpus_bleu computes it with SmoothingFunction().method4. For the
+    counts of a single pair this is sentence_bleu of that pair.
+    """
+    # nltk's Fraction keeps supporting _normalize=False, which fractions.Fraction dropped in Python 3.12
+    from nltk.translate.bleu_score import Fraction, SmoothingFunction, brevity_penalty
+
+    if numerators[0] == 0:
+        return 0
+    p_n = [Fraction(numerator, denominator, _normalize=False) for numerator, denominator in zip(numerators, denominators)]
+    p_n = SmoothingFunction().method4(p_n, references=None, hypothesis=None, hyp_len=hyp_len)
+    weight = 1 / len(p_n)
+    s = (weight * math.log(p_i) for p_i in p_n if p_i > 0)
+    return brevity_penalty(ref_len, hyp_len) * math.exp(math.fsum(s))
+
+
+def bleu_counts(reference: TextAnalysis, candidate: TextAnalysis) -> Tuple[List[int], List[int]]:
+    """Clipped n-gram matches and candidate n-gram totals of orders 1..BLEU_ORDERS"""
+    numerators, denominators = [], []
+    for n in range(1, BLEU_ORDERS + 1):
+        counts = candidate.ngram_counts(n)
+        reference_counts = reference.ngram_counts(n)
+        numerators.append(sum(min(count, reference_counts.get(ngram, 0)) for ngram, count in counts.items()))
+        denominators.append(max(1, sum(counts.values())))
+    return numerators, denominators
+
+
+class CorpusScorer:
+    """
+    Run-level BLEU, ROUGE and token F1 over a stream of (reference, candidate)
+    pairs, scored in one pass.
+
+    Each pair is tokenized and counted once (BLEU n-gram matches, ROUGE
+    n-gram and LCS overlaps, shared F1 tokens). Its per-question values are
+    computed from those counts and returned by add, and the counts are added
+    to run-wide totals, so the scorer keeps no per-pair state:
+
+    - BLEU: corpus BLEU (summed clipped matches and lengths, as corpus_bleu)
+    - ROUGE: micro (summed overlap counts) and macro (mean of per-question) r/p/f
+    - F1: micro (summed shared tokens) and macro (mean of per-question) token F1
+
+    Per-question values equal the sentence-level values of /metrics, ROUGE
+    included: the reference is scored as the ROUGE hypothesis there too.
+    ROUGE cannot score a pair whose text has no words (empty or only
+    punctuation); such a pair gets ROUGE 0, adds no overlap counts and is
+    counted in Rouge.skipped, while its BLEU and F1 counts go in as usual.
+    """
+
+    def __init__(self, rouge: Optional[RougeEngine] = None):
+        self.rouge = rouge or get_rouge_engine()
+        self.questions = 0
+        self.bleu_numerators = [0] * BLEU_ORDERS
+        self.bleu_denominators = [0] * BLEU_ORDERS
+        self.hyp_len = 0
+        self.ref_len = 0
+        self.rouge_counts = {key: [0, 0, 0] for key, _ in ROUGE_KEYS}
+        self.rouge_sums = {f'{name}.{part}': 0.0 for _, name in ROUGE_KEYS for part in ('r', 'p', 'f')}
+        self.f1_counts = [0, 0, 0]
+        self.f1_sum = 0.0
+        self.rouge_skipped = 0
+
+    def add(self, reference: str, candidate: str, reference_analysis: Optional[TextAnalysis] = None) -> Dict[str, float]:
+        """Counts one pair into the run totals and returns its per-question values"""
+        ref = reference_analysis or TextAnalysis(reference)
+        cand = TextAnalysis(candidate)
+        values = {}
+
+        numerators, denominators = bleu_counts(ref, cand)
+        hyp_len, ref_len = len(cand.split), len(ref.split)
+        values['BLEU'] = bleu_from_counts(numerators, denominators, hyp_len, ref_len)
+        for n in range(BLEU_ORDERS):
+            self.bleu_numerators[n] += numerators[n]
+            self.bleu_denominators[n] += denominators[n]
+        self.hyp_len += hyp_len
+        self.ref_len += ref_len
+
+        try:
+            rouge_counts = self.rouge.counts_analyses(ref, cand)
+        except ValueError:
+            rouge_counts = {key: (0, 0, 0) for key, _ in ROUGE_KEYS}
+            self.rouge_skipped += 1
+        for key, name in ROUGE_KEYS:
+            totals = self.rouge_counts[key]
+            for k, count in enumerate(rouge_counts[key]):
+                totals[k] += count
+            scores = rouge_values(*rouge_counts[key])
+            for part in ('r', 'p', 'f'):
+                values[f'{name}.{part}'] = scores[part]
+                self.rouge_sums[f'{name}.{part}'] += scores[part]
+
+        counts = f1_counts(cand, ref)
+        for k, count in enumerate(counts):
+            self.f1_counts[k] += count
+        values['F1 score'] = f1_from_counts(*counts)
+        self.f1_sum += values['F1 score']
+        self.questions += 1
+        return values
+
+    def result(self) -> Dict[str, object]:
+        """Run-wide values of the pairs added so far"""
+        n = self.questions
+        micro = {}
+        macro = {}
+        for key, name in ROUGE_KEYS:
+            scores = rouge_values(*self.rouge_counts[key])
+            for part in ('r', 'p', 'f'):
+                micro[f'{name}.{part}'] = scores[part]
+                macro[f'{name}.{part}'] = self.rouge_sums[f'{name}.{part}'] / n if n else 0.0
+        return {
+            'questions': n,
+            'BLEU': bleu_from_counts(self.bleu_numerators, self.bleu_denominators, self.hyp_len, self.ref_len) if n else 0.0,
+            'BLEU.precisions': [num / den if den else 0.0 for num, den in zip(self.bleu_numerators, self.bleu_denominators)],
+            'BLEU.hypothesis_length': self.hyp_len,
+            'BLEU.reference_length': self.ref_len,
+            'Rouge.micro': micro,
+            'Rouge.macro': macro,
+            'Rouge.skipped': self.rouge_skipped,
+            'F1.micro': f1_from_counts(*self.f1_counts),
+            'F1.macro': self.f1_sum / n if n else 0.0,
+        }
+
+
+def score_corpus(pairs: Iterable[Tuple[str, str]], reference_analyses: bool = True) -> Tuple[List[Dict[str, float]], Dict[str, object]]:
+    """
+    Per-question values and run-wide values of (reference, candidate) pairs.
+    References are read through the shared reference cache unless
+    reference_analyses is False, so their tokenizations are reused.
+    """
+    scorer = CorpusScorer()
+    cache = None
+    if reference_analyses:
+        from reference_cache import get_reference_cache
+
+        cache = get_reference_cache()
+    questions = []
+    for reference, candidate in pairs:
+        analysis = cache.get(reference).analysis if cache is not None else None
+        questions.append(scorer.add(reference, candidate, analysis))
+    return questions, scorer.result()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Corpus-level BLEU, ROUGE and F1 of a whole test run.")
+    parser.add_argument('run', help='JSON list of {reference, candidate[, testID]} items')
+    parser.add_argument('--output', help='Write {questions, corpus} here instead of printing the corpus values')
+    args = parser.parse_args()
+
+    with open(args.run, 'r', encoding='utf-8') as f:
+        items = json.load(f)
+    questions, corpus = score_corpus(((item['reference'], item['candidate']) for item in items), reference_analyses=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'questions': [dict(values, testID=item.get('testID')) for item, values in zip(items, questions)],
+                       'corpus': corpus}, f, indent=2)
+        print(f"Corpus values of {len(items)} questions written to {args.output}")
+    else:
+        print(json.dumps(corpus, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from encoder_registry import DEFAULT_MODEL_NAME
+from text_analysis import TextAnalysis
+
+# Compiled dataset directories the scorer reads reference tokenizations from,
+# separated by os.pathsep; empty tokenizes every reference at request time
+DEFAULT_COMPILED_DATASETS = os.environ.get('PASSER_COMPILED_DATASETS', '')
+
+# Bumped whenever the arrays of a compiled dataset change layout
+COMPILED_FORMAT = 1
+
+# Kind of each compiled text: QA datasets hold question/answer rows, text files paragraph rows
+KINDS = ('question', 'answer', 'paragraph')
+
+ARRAYS = (
+    'kinds', 'items', 'hashes', 'text_bytes', 'text_offsets',
+    'vocab_bytes', 'vocab_offsets', 'split_ids', 'split_offsets',
+    'word_ids', 'sentence_offsets', 'text_sentences', 'wordpiece_ids', 'wordpiece_offsets',
+)
+
+
+def text_digest(text: str) -> bytes:
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+
+def read_texts(source_path: str) -> List[Tuple[str, int, str]]:
+    """
+    (kind, item, text) rows of a source file: the question and answer of every
+    item of a QA JSON dataset, or every non-empty line of a paragraphs file.
+    """
+    with open(source_path, 'r', encoding='utf-8') as f:
+        if source_path.endswith('.json'):
+            return [(kind, item, qa.get(kind, ''))
+                    for item, qa in enumerate(json.load(f)) for kind in ('question', 'answer')]
+        return [('paragraph', item, line.strip())
+                for item, line in enumerate(line for line in f if line.strip())]
+
+
+def _string_table(strings: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+    encoded = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def compile_dataset(source_path: str, output_dir: str, tokenizer=None) -> 'CompiledDataset':
+    """
+    Tokenize every text of a source file once and write the result as .npy
+    arrays under output_dir. WordPiece IDs are only stored when a BERT
+    tokenizer is given; they are tied to its name_or_path.
+    """
+    rows = read_texts(source_path)
+    vocab = {}
+
+    def ids(tokens):
+        return [vocab.setdefault(token, len(vocab)) for token in tokens]
+
+    split_ids, split_offsets = [], [0]
+    word_ids, sentence_offsets, text_sentences = [], [0], [0]
+    wordpiece_ids, wordpiece_offsets = [], [0]
+    for _, _, text in rows:
+        analysis = TextAnalysis(text)
+        split_ids += ids(analysis.split)
+        split_offsets.append(len(split_ids))
+        for sentence in analysis.sentences:
+            word_ids += ids(sentence)
+            sentence_offsets.append(len(word_ids))
+        text_sentences.append(len(sentence_offsets) - 1)
+        if tokenizer is not None:
+            wordpiece_ids += tokenizer(text, truncation=True, max_length=512)['input_ids']
+        wordpiece_offsets.append(len(wordpiece_ids))
+
+    text_bytes, text_offsets = _string_table([text for _, _, text in rows])
+    vocab_bytes, vocab_offsets = _string_table(list(vocab))
+    arrays = {
+        'kinds': np.array([KINDS.index(kind) for kind, _, _ in rows], dtype=np.int8),
+        'items': np.array([item for _, item, _ in rows], dtype=np.int32),
+        'hashes': np.array([np.frombuffer(text_digest(text), dtype=np.uint8) for _, _, text in rows],
+                           dtype=np.uint8).reshape(len(rows), 32),
+        'text_bytes': text_bytes,
+        'text_offsets': text_offsets,
+        'vocab_bytes': vocab_bytes,
+        'vocab_offsets': vocab_offsets,
+        'split_ids': np.array(split_ids, dtype=np.int32),
+        'split_offsets': np.array(split_offsets, dtype=np.int64),
+        'word_ids': np.array(word_ids, dtype=np.int32),
+        'sentence_offsets': np.array(sentence_offsets, dtype=np.int64),
+        'text_sentences': np.array(text_sentences, dtype=np.int64),
+        'wordpiece_ids': np.array(wordpiece_ids, dtype=np.int32),
+        'wordpiece_offsets': np.array(wordpiece_offsets, dtype=np.int64),
+    }
+    with open(source_path, 'rb') as f:
+        source_sha256 = hashlib.sha256(f.read()).hexdigest()
+    meta = {
+        'format': COMPILED_FORMAT,
+        'source': os.path.basename(source_path),
+        'source_sha256': source_sha256,
+        'texts': len(rows),
+        'vocabulary': len(vocab),
+        'tokenizer': tokenizer.name_or_path if tokenizer is not None else None,
+    }
+
+    # Written next to the target and swapped in, so readers never see a half-written dataset
+    tmp_dir = output_dir.rstrip(os.sep) + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp_dir, f'{name}.npy'), array)
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.replace(tmp_dir, output_dir)
+    return CompiledDataset(output_dir)
+
+
+class CompiledDataset:
+    """
+    A QA dataset or paragraphs file tokenized ahead of time by compile_dataset.
+
+    Rows hold the raw text plus its whitespace tokens, lowercased word tokens
+    per sentence and BERT WordPiece IDs, as offsets into flat arrays of IDs
+    into one vocabulary table. All arrays are memory-mapped, so opening a
+    compiled dataset costs a few milliseconds whatever its size.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get('format') != COMPILED_FORMAT:
+            raise ValueError(f"{path} was compiled with format {self.meta.get('format')}, "
+                             f"expected {COMPILED_FORMAT}; compile the dataset again.")
+        for name in ARRAYS:
+            setattr(self, f'_{name}', np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r'))
+        self.tokenizer = self.meta.get('tokenizer')
+        self._rows = None
+        self._words = None
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._kinds)
+
+    def find(self, text: str) -> Optional[int]:
+        """Row of an exact text, or None"""
+        if self._rows is None:
+            with self._lock:
+                if self._rows is None:
+                    self._rows = {bytes(digest): row for row, digest in enumerate(self._hashes)}
+        return self._rows.get(text_digest(text))
+
+    def _words_table(self) -> List[str]:
+        if self._words is None:
+            blob = bytes(self._vocab_bytes)
+            offsets = self._vocab_offsets.tolist()
+            self._words = [blob[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+        return self._words
+
+    def vocabulary(self) -> List[str]:
+        return list(self._words_table())
+
+    def text(self, row: int) -> str:
+        return bytes(self._text_bytes[self._text_offsets[row]:self._text_offsets[row + 1]]).decode('utf-8')
+
+    def kind(self, row: int) -> str:
+        return KINDS[self._kinds[row]]
+
+    def item(self, row: int) -> int:
+        return int(self._items[row])
+
+    def texts(self, kind: Optional[str] = None) -> List[str]:
+        """Texts in source order, optionally only those of one kind"""
+        return [self.text(row) for row in range(len(self)) if kind is None or self.kind(row) == kind]
+
+    def qa_pairs(self) -> List[Tuple[str, str]]:
+        """(question, answer) of every item of a compiled QA dataset"""
+        questions = {self.item(row): self.text(row) for row in range(len(self)) if self.kind(row) == 'question'}
+        return [(questions.get(self.item(row), ''), self.text(row))
+                for row in range(len(self)) if self.kind(row) == 'answer']
+
+    def split(self, row: int) -> List[str]:
+        words = self._words_table()
+        return [words[i] for i in self._split_ids[self._split_offsets[row]:self._split_offsets[row + 1]].tolist()]
+
+    def sentences(self, row: int) -> List[List[str]]:
+        words = self._words_table()
+        bounds = self._sentence_offsets[self._text_sentences[row]:self._text_sentences[row + 1] + 1].tolist()
+        return [[words[i] for i in self._word_ids[start:end].tolist()] for start, end in zip(bounds, bounds[1:])]
+
+    def wordpiece_ids(self, row: int) -> Optional[List[int]]:
+        """WordPiece input IDs (with [CLS] and [SEP]) or None if compiled without a tokenizer"""
+        if self.tokenizer is None:
+            return None
+        return self._wordpiece_ids[self._wordpiece_offsets[row]:self._wordpiece_offsets[row + 1]].tolist()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            'path': self.path,
+            'source': self.meta['source'],
+            'texts': len(self),
+            'vocabulary': self.meta['vocabulary'],
+            'tokenizer': self.tokenizer,
+        }
+
+
+_datasets = None
+_datasets_lock = threading.Lock()
+
+
+def get_compiled_datasets() -> List[CompiledDataset]:
+    """Return the process-wide compiled datasets named by PASSER_COMPILED_DATASETS"""
+    global _datasets
+    with _datasets_lock:
+        if _datasets is None:
+            _datasets = []
+            for path in DEFAULT_COMPILED_DATASETS.split(os.pathsep):
+                if not path:
+                    continue
+                try:
+                    _datasets.append(CompiledDataset(path))
+                except (OSError, ValueError) as e:
+                    print(f"Error loading compiled dataset {path}: {e}")
+        return _datasets
+
+
+def find_compiled(text: str) -> Optional[Tuple[CompiledDataset, int]]:
+    """(dataset, row) of the first compiled dataset that holds text"""
+    for dataset in get_compiled_datasets():
+        row = dataset.find(text)
+        if row is not None:
+            return dataset, row
+    return None
+
+
+def compiled_wordpiece_ids(text: str, tokenizer_name: str) -> Optional[List[int]]:
+    """Stored WordPiece IDs of text, if a dataset compiled with the same tokenizer holds it"""
+    for dataset in get_compiled_datasets():
+        if dataset.tokenizer != tokenizer_name:
+            continue
+        row = dataset.find(text)
+        if row is not None:
+            return dataset.wordpiece_ids(row)
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile QA datasets and paragraph files into pre-tokenized binary datasets.')
+    parser.add_argument('sources', nargs='+', help='QA JSON files with question/answer pairs or text files with one paragraph per line')
+    parser.add_argument('--output-dir', default='compiled_datasets',
+                        help='One subdirectory per source is written here (list them in PASSER_COMPILED_DATASETS when serving)')
+    parser.add_argument('--model', default=DEFAULT_MODEL_NAME,
+                        help='Tokenizer of the WordPiece IDs; must match the serving encoder')
+    parser.add_argument('--no-wordpiece', action='store_true', help='Do not store WordPiece IDs (no transformers needed)')
+    args = parser.parse_args()
+
+    tokenizer = None
+    if not args.no_wordpiece:
+        from transformers import BertTokenizer
+
+        tokenizer = BertTokenizer.from_pretrained(args.model)
+    for source in args.sources:
+        output = os.path.join(args.output_dir, os.path.splitext(os.path.basename(source))[0])
+        dataset = compile_dataset(source, output, tokenizer)
+        print(f"Compiled {source}: {len(dataset)} texts, {dataset.meta['vocabulary']} words -> {output}")
+
+
+if __name__ == "__main__":
+    main()
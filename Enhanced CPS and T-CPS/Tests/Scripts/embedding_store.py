@@ -0,0 +1,259 @@
+import atexit
+import functools
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import uuid
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import torch
+
+from encoder_registry import get_registry
+from text_encoding import TextEncoding, encode_text, encode_texts
+
+# Root directory of the store; empty disables it
+DEFAULT_STORE_DIR = os.environ.get('PASSER_EMBEDDING_STORE', '')
+# Keep token-level hidden states (needed by BERTScore) or only CLS and mean-pooled vectors
+DEFAULT_KEEP_TOKENS = os.environ.get('PASSER_EMBEDDING_STORE_TOKENS', '1') == '1'
+# Rows buffered in memory before they are written out as one shard
+DEFAULT_SHARD_ROWS = int(os.environ.get('PASSER_EMBEDDING_SHARD_ROWS', 8192))
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class StoredEncoding:
+    """
+    Encoding read back from the store, with the same views as TextEncoding.
+
+    The float16 rows are torch views of the memory-mapped shard; each view is
+    upcast to float32 only when a metric reads it. When token-level states
+    were not stored, tokens falls back to a forward pass through fallback().
+    """
+
+    def __init__(self, text: str, rows: np.ndarray, num_tokens: int, has_tokens: bool,
+                 fallback: Optional[Callable[[], TextEncoding]] = None):
+        self.text = text
+        self._rows = torch.from_numpy(rows)
+        self._num_tokens = num_tokens
+        self.has_tokens = has_tokens
+        self._fallback = fallback
+        self._computed = None
+
+    @property
+    def cls(self) -> torch.Tensor:
+        return self._rows[0:1].float()
+
+    @property
+    def mean(self) -> torch.Tensor:
+        return self._rows[1:2].float()
+
+    @property
+    def tokens(self) -> torch.Tensor:
+        if self.has_tokens:
+            return self._rows[2:2 + self._num_tokens].unsqueeze(0).float()
+        if self._computed is None:
+            if self._fallback is None:
+                raise RuntimeError('Token-level states were not stored for this text.')
+            self._computed = self._fallback()
+        return self._computed.tokens
+
+    @property
+    def last_hidden_state(self) -> torch.Tensor:
+        return self.tokens
+
+    @property
+    def num_tokens(self) -> int:
+        return self._num_tokens
+
+
+class EmbeddingStore:
+    """
+    Content-addressed store of BERT encodings on disk.
+
+    Each text is stored as consecutive float16 rows: the [CLS] vector, the
+    mean-pooled vector and, optionally, the token-level hidden states. New
+    rows are buffered and written as immutable .npy shards that are read back
+    with np.load(mmap_mode='c'). A SQLite index maps the text hash to
+    (shard, offset, num_tokens), so several processes can share one store.
+    Everything lives under a directory per encoder ID (model plus weights
+    revision), so embeddings of different encoders never mix.
+    """
+
+    def __init__(self, root: str, encoder_id: str, keep_tokens: bool = DEFAULT_KEEP_TOKENS,
+                 shard_rows: int = DEFAULT_SHARD_ROWS):
+        self.root = root
+        self.encoder_id = encoder_id
+        self.keep_tokens = keep_tokens
+        self.shard_rows = shard_rows
+        self.path = os.path.join(root, re.sub(r'[^A-Za-z0-9._@-]+', '_', encoder_id))
+        os.makedirs(self.path, exist_ok=True)
+        self._conn = sqlite3.connect(os.path.join(self.path, 'index.db'), check_same_thread=False)
+        self._lock = threading.Lock()
+        self._shards = {}
+        self._pending = {}
+        self._pending_rows = 0
+        self.hits = 0
+        self.misses = 0
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key TEXT PRIMARY KEY, shard TEXT, offset INTEGER, num_tokens INTEGER, has_tokens INTEGER)"
+            )
+
+    def _shard(self, name: str) -> np.ndarray:
+        shard = self._shards.get(name)
+        if shard is None:
+            # Copy-on-write mapping: zero-copy reads, and torch gets a writable array
+            shard = np.load(os.path.join(self.path, name), mmap_mode='c')
+            self._shards[name] = shard
+        return shard
+
+    def get(self, text: str, fallback: Optional[Callable[[], TextEncoding]] = None) -> Optional[StoredEncoding]:
+        """Stored encoding of text, or None when it has not been stored"""
+        key = text_hash(text)
+        with self._lock:
+            pending = self._pending.get(key)
+            if pending is not None:
+                self.hits += 1
+                return StoredEncoding(text, pending[0], pending[1], pending[2], fallback)
+            row = self._conn.execute(
+                "SELECT shard, offset, num_tokens, has_tokens FROM embeddings WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            shard, offset, num_tokens, has_tokens = row
+            count = 2 + (num_tokens if has_tokens else 0)
+            rows = self._shard(shard)[offset:offset + count]
+        return StoredEncoding(text, rows, num_tokens, bool(has_tokens), fallback)
+
+    def contains(self, text: str) -> bool:
+        key = text_hash(text)
+        with self._lock:
+            if key in self._pending:
+                return True
+            return self._conn.execute("SELECT 1 FROM embeddings WHERE key = ?", (key,)).fetchone() is not None
+
+    def put(self, encoding: TextEncoding):
+        """Buffer an encoding; it is written out with the next shard"""
+        state = encoding.last_hidden_state[0]
+        vectors = [encoding.cls, encoding.mean] + ([state] if self.keep_tokens else [])
+        rows = torch.cat(vectors, dim=0).numpy().astype(np.float16)
+        key = text_hash(encoding.text)
+        with self._lock:
+            if key in self._pending or self._conn.execute("SELECT 1 FROM embeddings WHERE key = ?", (key,)).fetchone():
+                return
+            self._pending[key] = (rows, encoding.num_tokens, self.keep_tokens)
+            self._pending_rows += len(rows)
+            if self._pending_rows >= self.shard_rows:
+                self._flush_locked()
+
+    def flush(self):
+        """Write buffered encodings to a new shard"""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        name = f'shard-{os.getpid()}-{uuid.uuid4().hex[:12]}.npy'
+        entries = []
+        offset = 0
+        for key, (rows, num_tokens, has_tokens) in self._pending.items():
+            entries.append((key, name, offset, num_tokens, int(has_tokens)))
+            offset += len(rows)
+        shard = np.concatenate([rows for rows, _, _ in self._pending.values()], axis=0)
+        path = os.path.join(self.path, name)
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, shard)
+        os.replace(path + '.tmp', path)
+        with self._conn:
+            # Another process may have stored the same text meanwhile; the first copy wins
+            self._conn.executemany("INSERT OR IGNORE INTO embeddings VALUES (?, ?, ?, ?, ?)", entries)
+        print(f"Embedding store: wrote {len(entries)} encodings to {name}")
+        self._pending = {}
+        self._pending_rows = 0
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            stored = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            return {
+                'encoder': self.encoder_id,
+                'stored': stored,
+                'pending': len(self._pending),
+                'hits': self.hits,
+                'misses': self.misses,
+            }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_embedding_store() -> Optional[EmbeddingStore]:
+    """Return the process-wide embedding store, or None when PASSER_EMBEDDING_STORE is not set"""
+    global _store
+    if not DEFAULT_STORE_DIR:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = EmbeddingStore(DEFAULT_STORE_DIR, get_registry().encoder_id())
+            atexit.register(_store.flush)
+        return _store
+
+
+def _compute(text: str) -> TextEncoding:
+    tokenizer, model = get_registry().get()
+    return encode_text(text, tokenizer, model)
+
+
+def encode_stored(text: str) -> TextEncoding:
+    """
+    Encoding of text from the embedding store when it is there, otherwise a
+    forward pass whose result is added to the store (if one is configured).
+    """
+    store = get_embedding_store()
+    if store is None:
+        return _compute(text)
+    encoding = store.get(text, fallback=functools.partial(_compute, text))
+    if encoding is None:
+        encoding = _compute(text)
+        store.put(encoding)
+    return encoding
+
+
+def split_stored(texts: List[str]) -> Dict[int, StoredEncoding]:
+    """Stored encodings of the texts that are in the store, by position"""
+    store = get_embedding_store()
+    if store is None:
+        return {}
+    found = {}
+    for i, text in enumerate(texts):
+        encoding = store.get(text, fallback=functools.partial(_compute, text))
+        if encoding is not None:
+            found[i] = encoding
+    return found
+
+
+def encode_stored_batch(texts: List[str], batch_size: int = 16) -> List[TextEncoding]:
+    """
+    Encodings of many texts: those in the embedding store are read from it,
+    the rest go through padded batch forward passes and are added to the store.
+    """
+    encodings = split_stored(texts)
+    missing = [i for i in range(len(texts)) if i not in encodings]
+    if missing:
+        tokenizer, model = get_registry().get()
+        computed = encode_texts([texts[i] for i in missing], tokenizer, model, batch_size=batch_size)
+        store = get_embedding_store()
+        for i, encoding in zip(missing, computed):
+            encodings[i] = encoding
+            if store is not None:
+                store.put(encoding)
+    return [encodings[i] for i in range(len(texts))]
@@ -0,0 +1,159 @@
+import os
+import threading
+import time
+from typing import TYPE_CHECKING, Optional, Tuple
+
+# torch and transformers are imported when the encoder is loaded, so deployments
+# that never run a BERT metric do not pay for them at startup
+if TYPE_CHECKING:
+    import torch
+    from transformers import BertTokenizer, BertModel
+
+# Name or local path of the encoder shared by all BERT based metrics
+DEFAULT_MODEL_NAME = os.environ.get('PASSER_BERT_MODEL', 'bert-base-uncased')
+
+# 'fp32' serves the model as loaded, 'int8' a dynamically quantized copy (int8
+# linear layers, CPU only) and 'bf16' a bfloat16 copy; see quantization_parity.py
+# for how far the embedding metrics drift from fp32
+PRECISIONS = ('fp32', 'int8', 'bf16')
+DEFAULT_PRECISION = os.environ.get('PASSER_BERT_PRECISION', 'fp32')
+
+
+def reduce_precision(model: 'BertModel', precision: str) -> 'torch.nn.Module':
+    """Return the inference copy of model for the given precision"""
+    import torch
+
+    if precision == 'fp32':
+        return model
+    if precision == 'int8':
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if precision == 'bf16':
+        return model.to(torch.bfloat16)
+    raise ValueError(f"Unknown encoder precision '{precision}', expected one of {', '.join(PRECISIONS)}.")
+
+
+class EncoderRegistry:
+    """
+    Process-wide holder for the BERT tokenizer and model used by the metrics.
+
+    The encoder is loaded once, switched to eval/no-grad mode and warmed up
+    with a dummy inference. Readiness can be queried without blocking so the
+    frontend does not start a batch while the model is still loading.
+    """
+
+    def __init__(self, model_name: str = DEFAULT_MODEL_NAME, precision: str = DEFAULT_PRECISION):
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown encoder precision '{precision}', expected one of {', '.join(PRECISIONS)}.")
+        self.model_name = model_name
+        self.precision = precision
+        self.tokenizer = None
+        self.model = None
+        self.revision = None
+        self.error = None
+        self.load_seconds = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._loader = None
+
+    def load(self) -> None:
+        """Load and warm up the encoder (no-op if it is already loaded)"""
+        with self._lock:
+            if self._ready.is_set():
+                return
+            start = time.time()
+            try:
+                import torch
+                from transformers import BertTokenizer, BertModel
+
+                print(f"Loading encoder {self.model_name} ({self.precision})")
+                tokenizer = BertTokenizer.from_pretrained(self.model_name)
+                model = BertModel.from_pretrained(self.model_name)
+                model.eval()
+                model.requires_grad_(False)
+                revision = getattr(model.config, '_commit_hash', None) or 'local'
+                model = reduce_precision(model, self.precision)
+
+                # Warm-up inference so the first request does not pay for lazy init
+                inputs = tokenizer("Warm-up sentence for the encoder.", return_tensors='pt',
+                                   padding=True, truncation=True, max_length=512)
+                with torch.no_grad():
+                    model(**inputs)
+
+                self.tokenizer = tokenizer
+                self.model = model
+                # Hub commit of the weights; local checkpoints have none
+                self.revision = revision
+                self.error = None
+            except Exception as e:
+                self.error = str(e)
+                print(f"Error loading encoder {self.model_name}: {e}")
+                raise
+            finally:
+                self.load_seconds = time.time() - start
+            self._ready.set()
+            print(f"Encoder {self.model_name} ready in {self.load_seconds:.2f}s")
+
+    def load_async(self) -> threading.Thread:
+        """Start loading the encoder in a background thread"""
+        if self._loader is None:
+            self._loader = threading.Thread(target=self._load_quietly, name='encoder-loader', daemon=True)
+            self._loader.start()
+        return self._loader
+
+    def _load_quietly(self) -> None:
+        try:
+            self.load()
+        except Exception:
+            pass  # error is kept in self.error and reported by status()
+
+    def is_ready(self) -> bool:
+        return self._ready.is_set()
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        return self._ready.wait(timeout)
+
+    def get(self) -> Tuple['BertTokenizer', 'BertModel']:
+        """Return (tokenizer, model), loading synchronously if nobody started it yet"""
+        if not self._ready.is_set():
+            if self._loader is None:
+                self.load()
+            else:
+                self._loader.join()
+        if self.error or not self._ready.is_set():
+            raise RuntimeError(f"Encoder {self.model_name} is not available: {self.error}")
+        return self.tokenizer, self.model
+
+    @property
+    def variant(self) -> str:
+        """Model name plus precision; unlike encoder_id() it is known before loading"""
+        return self.model_name if self.precision == 'fp32' else f'{self.model_name}+{self.precision}'
+
+    def encoder_id(self) -> str:
+        """Model name, weights revision and precision, e.g. for keying stored embeddings"""
+        self.get()
+        suffix = '' if self.precision == 'fp32' else f'+{self.precision}'
+        return f"{self.model_name}@{self.revision}{suffix}"
+
+    def status(self) -> dict:
+        return {
+            'model': self.model_name,
+            'revision': self.revision,
+            'precision': self.precision,
+            'ready': self.is_ready(),
+            'loading': not self.is_ready() and self._loader is not None and self._loader.is_alive(),
+            'load_seconds': self.load_seconds,
+            'error': self.error,
+        }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_registry() -> EncoderRegistry:
+    """Return the process-wide encoder registry"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = EncoderRegistry()
+        return _registry
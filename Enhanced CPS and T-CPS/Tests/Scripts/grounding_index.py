@@ -0,0 +1,179 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from dataset_cache import CompiledDataset, read_texts
+
+# Index directory written by `python grounding_index.py`; empty disables grounding
+DEFAULT_INDEX_DIR = os.environ.get('PASSER_GROUNDING_INDEX', '')
+# Paragraphs returned as support for each candidate
+DEFAULT_TOP_K = int(os.environ.get('PASSER_GROUNDING_TOP_K', 3))
+
+# Bumped whenever the files of an index change layout
+INDEX_FORMAT = 1
+
+
+def source_paragraphs(path: str) -> List[str]:
+    """Paragraphs of a text file (one per line) or of a compiled paragraphs dataset"""
+    if os.path.isdir(path):
+        return CompiledDataset(path).texts('paragraph')
+    return [text for kind, _, text in read_texts(path) if kind == 'paragraph']
+
+
+def _normalized(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.maximum(norms, 1e-8)).astype(np.float32)
+
+
+def build_index(source_path: str, output_dir: str, batch_size: int = 16) -> 'GroundingIndex':
+    """
+    Encode every paragraph of a source once with the serving encoder and write
+    the L2-normalized mean-pooled embeddings as one (paragraphs x hidden) .npy
+    matrix under output_dir, next to the paragraph texts.
+    """
+    from embedding_store import encode_stored_batch
+    from encoder_registry import get_registry
+
+    paragraphs = source_paragraphs(source_path)
+    encodings = encode_stored_batch(paragraphs, batch_size=batch_size)
+    embeddings = _normalized(np.concatenate([encoding.mean.numpy() for encoding in encodings]))
+
+    if os.path.isdir(source_path):
+        source_sha256 = CompiledDataset(source_path).meta['source_sha256']
+    else:
+        with open(source_path, 'rb') as f:
+            source_sha256 = hashlib.sha256(f.read()).hexdigest()
+    meta = {
+        'format': INDEX_FORMAT,
+        'encoder': get_registry().encoder_id(),
+        'pooling': 'mean',
+        'source': os.path.basename(source_path.rstrip(os.sep)),
+        'source_sha256': source_sha256,
+        'paragraphs': len(paragraphs),
+        'dimensions': int(embeddings.shape[1]),
+    }
+
+    # Written next to the target and swapped in, like compiled datasets
+    tmp_dir = output_dir.rstrip(os.sep) + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    np.save(os.path.join(tmp_dir, 'embeddings.npy'), embeddings)
+    with open(os.path.join(tmp_dir, 'paragraphs.json'), 'w', encoding='utf-8') as f:
+        json.dump(paragraphs, f)
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2)
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.replace(tmp_dir, output_dir)
+    return GroundingIndex(output_dir)
+
+
+class GroundingIndex:
+    """
+    Precomputed embeddings of the source paragraphs the RAG answers should be
+    grounded in (sourceBookParagraphs.txt by default).
+
+    The embedding matrix is memory-mapped and already normalized, so scoring
+    a batch of candidates is one (candidates x hidden) @ (hidden x paragraphs)
+    matmul plus a partial sort for the top k. A candidate's grounding score
+    is the cosine similarity of its mean-pooled embedding to its best
+    supporting paragraph.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        if self.meta.get('format') != INDEX_FORMAT:
+            raise ValueError(f"{path} was built with format {self.meta.get('format')}, "
+                             f"expected {INDEX_FORMAT}; build the index again.")
+        self.embeddings = np.load(os.path.join(path, 'embeddings.npy'), mmap_mode='r')
+        with open(os.path.join(path, 'paragraphs.json'), 'r', encoding='utf-8') as f:
+            self.paragraphs = json.load(f)
+        self.encoder = self.meta['encoder']
+
+    def __len__(self) -> int:
+        return self.embeddings.shape[0]
+
+    def search(self, vectors: np.ndarray, k: int = DEFAULT_TOP_K) -> Tuple[np.ndarray, np.ndarray]:
+        """(rows, similarities) of the k most similar paragraphs of each query vector, best first"""
+        k = min(k, len(self))
+        similarities = _normalized(np.asarray(vectors, dtype=np.float32)) @ self.embeddings.T
+        if k < len(self):
+            rows = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+        else:
+            rows = np.tile(np.arange(len(self)), (similarities.shape[0], 1))
+        top = np.take_along_axis(similarities, rows, axis=1)
+        order = np.argsort(-top, axis=1)
+        return np.take_along_axis(rows, order, axis=1), np.take_along_axis(top, order, axis=1)
+
+    def ground(self, encodings: Sequence, k: int = DEFAULT_TOP_K) -> List[Dict[str, object]]:
+        """Grounding score and top-k supporting paragraphs of each candidate encoding"""
+        if not encodings:
+            return []
+        vectors = np.concatenate([encoding.mean.numpy() for encoding in encodings])
+        rows, similarities = self.search(vectors, k)
+        results = []
+        for row_ids, row_similarities in zip(rows.tolist(), similarities.tolist()):
+            results.append({
+                'grounding': row_similarities[0],
+                'support': [{'paragraph': row, 'similarity': similarity, 'text': self.paragraphs[row]}
+                            for row, similarity in zip(row_ids, row_similarities)],
+            })
+        return results
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            'path': self.path,
+            'source': self.meta['source'],
+            'paragraphs': len(self),
+            'encoder': self.encoder,
+        }
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_grounding_index() -> Optional[GroundingIndex]:
+    """
+    Return the process-wide grounding index named by PASSER_GROUNDING_INDEX, or
+    None when it is not set. Raises ValueError when it was built with another encoder.
+    """
+    global _index
+    if not DEFAULT_INDEX_DIR:
+        return None
+    with _index_lock:
+        if _index is None:
+            from encoder_registry import get_registry
+
+            index = GroundingIndex(DEFAULT_INDEX_DIR)
+            encoder = get_registry().encoder_id()
+            if index.encoder != encoder:
+                raise ValueError(f"Grounding index {DEFAULT_INDEX_DIR} was built with encoder {index.encoder}, "
+                                 f"the encoder is {encoder}; build the index again.")
+            print(f"Grounding index of {len(index)} paragraphs from {index.meta['source']}")
+            _index = index
+        return _index
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the paragraph embedding index used for the grounding score.')
+    parser.add_argument('source', help='Text file with one paragraph per line (e.g. sourceBookParagraphs.txt) '
+                                       'or a compiled paragraphs dataset')
+    parser.add_argument('--output-dir', default='grounding_index',
+                        help='Point PASSER_GROUNDING_INDEX at this directory when serving')
+    parser.add_argument('--batch-size', type=int, default=16, help='Paragraphs per BERT forward pass')
+    args = parser.parse_args()
+
+    index = build_index(args.source, args.output_dir, args.batch_size)
+    print(f"Indexed {len(index)} paragraphs of {args.source} with {index.encoder} -> {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+# Production serving for backEnd.py: `gunicorn backEnd:app` from this directory.
+#
+# The master imports the app, waits for the BERT encoder (when the default
+# profile needs it) and the metric family warm-up, then forks the workers, which share the weight pages
+# copy-on-write. `kill -HUP <master pid>` replaces the workers gracefully
+# (in-flight requests get graceful_timeout seconds to finish); new code needs
+# a full restart or the USR2 binary upgrade.
+import os
+import sys
+
+os.environ['PASSER_PREFORK'] = '1'
+
+bind = f"{os.environ.get('PASSER_HOST', '127.0.0.1')}:{os.environ.get('PASSER_PORT', 8088)}"
+workers = int(os.environ.get('PASSER_WORKERS', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('PASSER_THREADS', 4))
+preload_app = True
+# Batches and cold model loads can take minutes on CPU
+timeout = int(os.environ.get('PASSER_TIMEOUT', 300))
+graceful_timeout = int(os.environ.get('PASSER_GRACEFUL_TIMEOUT', 60))
+
+# torch intra-op threads per worker; keep workers * torch threads near the core count
+TORCH_THREADS = int(os.environ.get('PASSER_TORCH_THREADS', max(1, (os.cpu_count() or 1) // workers)))
+
+
+def when_ready(server):
+    import backEnd
+    import metric_families
+
+    # Everything shared by the workers is loaded before the first fork
+    if backEnd.NEEDS_ENCODER:
+        try:
+            backEnd.encoder_registry.get()
+        except RuntimeError as e:
+            server.log.error(f"Workers start without an encoder: {e}")
+    metric_families.wait_warm()
+    failed = {name: status['error'] for name, status in metric_families.family_status().items()
+              if name in backEnd.STARTUP_FAMILIES and not status['warmed']}
+    if failed:
+        server.log.error(f"Metric families not warmed: {failed}")
+    if 'meteor' in backEnd.STARTUP_FAMILIES:
+        try:
+            metric_families.ensure_wordnet_loaded()
+        except LookupError as e:
+            server.log.error(f"WordNet is not installed, METEOR will fail: {e}")
+    # Only the master may requeue jobs that were running when the last server died
+    backEnd.job_queue.recover()
+    server.log.info(f"Serving {workers} workers x {threads} threads, {TORCH_THREADS} torch threads each")
+
+
+def post_fork(server, worker):
+    import backEnd
+    import metric_families
+
+    metric_families.reopen_wordnet_files()
+    # Lexical-only deployments never import torch
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(TORCH_THREADS)
+    backEnd.job_queue.start(recover=False)
@@ -0,0 +1,240 @@
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Callable, Dict, Hashable, Optional
+
+from scoring_scheduler import HOLD_SMOOTHING, FairQueue
+
+# Long-polls re-read the job this often, to see jobs finished by other worker processes
+POLL_SECONDS = 0.5
+
+# A running job whose process has not renewed it for this long is requeued
+LEASE_SECONDS = 60.0
+
+
+class JobQueue:
+    """
+    Persistent queue of scoring jobs drained by a pool of worker threads.
+
+    Jobs are written to a SQLite file before their ID is returned, so work that
+    was accepted but not finished (queued or running) is picked up again when
+    the backend restarts. handler(kind, payload) does the actual work and its
+    return value must be JSON serializable.
+
+    Several processes (e.g. pre-forked server workers) can share one queue
+    file: each opens its own connection and a job is only run by the process
+    that moves it from queued to running.
+
+    Queued jobs are handed to the workers round-robin by flow(payload) (e.g.
+    userID and testID), so one user's pile of jobs does not hold back the
+    jobs everyone else submits after it.
+
+    Running jobs are leased: their process renews updated_at every quarter
+    lease, and any process requeues (and runs) jobs whose lease ran out, so
+    a job left running by a killed or recycled worker is picked up again
+    without restarting the server.
+    """
+
+    def __init__(self, db_path: str, handler: Callable[[str, dict], object], workers: int = 2,
+                 flow: Optional[Callable[[dict], Hashable]] = None, lease_seconds: float = LEASE_SECONDS):
+        self.db_path = db_path
+        self.handler = handler
+        self.workers = workers
+        self.lease_seconds = lease_seconds
+        self._running = set()
+        self.flow = flow or (lambda payload: None)
+        self._conn = None
+        self._pid = None
+        self._db_lock = threading.Lock()
+        self._finished = threading.Condition()
+        self._pending = FairQueue()
+        self._available = threading.Condition()
+        self._job_seconds = None
+        self._threads = []
+        self._create_table()
+
+    @property
+    def _connection(self) -> sqlite3.Connection:
+        # SQLite connections must not cross fork(), so every process opens its own
+        if self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+            self._pid = os.getpid()
+        return self._conn
+
+    def _create_table(self):
+        with self._db_lock, self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, kind TEXT, payload TEXT, status TEXT,"
+                " result TEXT, error TEXT, created_at REAL, updated_at REAL)"
+            )
+
+    def recover(self):
+        """
+        Requeue jobs that were running when the backend died. Only call this
+        while no process is working on the queue (e.g. in the pre-fork master).
+        """
+        with self._db_lock, self._connection:
+            count = self._connection.execute("UPDATE jobs SET status = 'queued' WHERE status = 'running'").rowcount
+        if count:
+            print(f"Requeued {count} interrupted scoring jobs")
+
+    def start(self, recover: bool = True):
+        """Pick up queued jobs from a previous run and start the workers"""
+        if self._threads:
+            return
+        if recover:
+            self.recover()
+        with self._db_lock:
+            rows = self._connection.execute(
+                "SELECT id, payload FROM jobs WHERE status = 'queued' ORDER BY created_at").fetchall()
+        for job_id, payload in rows:
+            self._enqueue(job_id, json.loads(payload))
+        if rows:
+            print(f"Picked up {len(rows)} unfinished scoring jobs")
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'scoring-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        if self.workers:
+            thread = threading.Thread(target=self._renew_leases, name='scoring-leases', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, kind: str, payload: dict) -> str:
+        """Store a job and queue it; returns the job ID"""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._db_lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO jobs (id, kind, payload, status, created_at, updated_at) VALUES (?, ?, ?, 'queued', ?, ?)",
+                (job_id, kind, json.dumps(payload), now, now),
+            )
+        self._enqueue(job_id, payload)
+        return job_id
+
+    def _enqueue(self, job_id: str, payload: dict):
+        with self._available:
+            self._pending.put(self.flow(payload), job_id)
+            self._available.notify()
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """Return the job status and, once done, its result"""
+        with self._db_lock:
+            row = self._connection.execute(
+                "SELECT id, kind, status, result, error, created_at, updated_at FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {
+            'jobID': row[0],
+            'kind': row[1],
+            'status': row[2],
+            'result': json.loads(row[3]) if row[3] is not None else None,
+            'error': row[4],
+            'created_at': row[5],
+            'updated_at': row[6],
+        }
+
+    def wait(self, job_id: str, timeout: float) -> Optional[Dict]:
+        """Long-poll: block until the job is done or failed, or until timeout"""
+        deadline = time.time() + timeout
+        job = self.get(job_id)
+        while job is not None and job['status'] in ('queued', 'running'):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            with self._finished:
+                self._finished.wait(min(remaining, POLL_SECONDS))
+            job = self.get(job_id)
+        return job
+
+    def counts(self) -> Dict[str, int]:
+        with self._db_lock:
+            rows = self._connection.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return dict(rows)
+
+    def retry_after(self, queued: int) -> int:
+        """Seconds until this many queued jobs are expected to be through the workers, from recent job times"""
+        return max(1, math.ceil(queued * (self._job_seconds or 1.0) / max(1, self.workers)))
+
+    def _set_status(self, job_id: str, status: str, result=None, error: Optional[str] = None):
+        with self._db_lock, self._connection:
+            self._connection.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?",
+                (status, json.dumps(result) if result is not None else None, error, time.time(), job_id),
+            )
+
+    def reclaim_stale(self) -> int:
+        """Requeue running jobs whose lease ran out and queue them here; returns how many"""
+        stale_before = time.time() - self.lease_seconds
+        reclaimed = []
+        with self._db_lock, self._connection:
+            rows = self._connection.execute(
+                "SELECT id, payload FROM jobs WHERE status = 'running' AND updated_at < ?", (stale_before,)).fetchall()
+            for job_id, payload in rows:
+                # Another process may renew or reclaim it in between
+                if self._connection.execute(
+                        "UPDATE jobs SET status = 'queued', updated_at = ? WHERE id = ? AND status = 'running'"
+                        " AND updated_at < ?", (time.time(), job_id, stale_before)).rowcount:
+                    reclaimed.append((job_id, json.loads(payload)))
+        for job_id, payload in reclaimed:
+            self._enqueue(job_id, payload)
+        if reclaimed:
+            print(f"Requeued {len(reclaimed)} scoring jobs whose lease ran out")
+        return len(reclaimed)
+
+    def _renew_leases(self):
+        while True:
+            time.sleep(self.lease_seconds / 4)
+            try:
+                with self._db_lock:
+                    running = list(self._running)
+                if running:
+                    with self._db_lock, self._connection:
+                        self._connection.execute(
+                            f"UPDATE jobs SET updated_at = ? WHERE status = 'running' AND id IN ({','.join('?' * len(running))})",
+                            [time.time()] + running)
+                self.reclaim_stale()
+            except sqlite3.Error as e:
+                print(f"Renewing scoring job leases failed: {e}")
+
+    def _work(self):
+        while True:
+            with self._available:
+                while not len(self._pending):
+                    self._available.wait()
+                job_id = self._pending.get()
+            with self._db_lock, self._connection:
+                # Claim the job; another process or thread may have taken it already
+                claimed = self._connection.execute(
+                    "UPDATE jobs SET status = 'running', updated_at = ? WHERE id = ? AND status = 'queued'",
+                    (time.time(), job_id),
+                ).rowcount
+                row = self._connection.execute("SELECT kind, payload FROM jobs WHERE id = ?", (job_id,)).fetchone()
+                if claimed and row is not None:
+                    self._running.add(job_id)
+            if not claimed or row is None:
+                continue
+            kind, payload = row[0], json.loads(row[1])
+            start = time.time()
+            try:
+                result = self.handler(kind, payload)
+                self._set_status(job_id, 'done', result=result)
+            except Exception as e:
+                print(f"Scoring job {job_id} failed: {e}")
+                self._set_status(job_id, 'failed', error=str(e))
+            finally:
+                with self._db_lock:
+                    self._running.discard(job_id)
+            seconds = time.time() - start
+            if self._job_seconds is not None:
+                seconds = (1 - HOLD_SMOOTHING) * self._job_seconds + HOLD_SMOOTHING * seconds
+            self._job_seconds = seconds
+            with self._finished:
+                self._finished.notify_all()
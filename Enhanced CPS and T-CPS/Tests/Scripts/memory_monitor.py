@@ -0,0 +1,218 @@
+import gc
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+# Frames recorded per allocation by tracemalloc; 0 leaves it off, as tracing slows
+# allocation-heavy code (tokenization, n-gram counting) down considerably
+DEFAULT_TRACEMALLOC_FRAMES = int(os.environ.get('PASSER_TRACEMALLOC', 0))
+# Allocation sites listed by the top-N snapshots
+DEFAULT_TOP_N = int(os.environ.get('PASSER_TRACEMALLOC_TOP', 20))
+
+# Per-request memory records kept for /debug/memory
+RECENT_REQUESTS = 100
+
+MB = 1024 * 1024
+
+
+def malloc_trim_settings() -> Tuple[int, float]:
+    """
+    (every, above_mb) from PASSER_MALLOC_TRIM_EVERY and PASSER_MALLOC_TRIM_ABOVE_MB:
+    hand freed heap memory back to the OS (glibc only, see trim_heap) after every
+    N-th scoring request, and/or once RSS has grown this many MB since the last
+    trim. 0 leaves either off, as a trim costs a few milliseconds that would
+    otherwise be added to every request. Read when a monitor is made, so tools
+    like memory_soak can set them after importing this module.
+    """
+    return (int(os.environ.get('PASSER_MALLOC_TRIM_EVERY', 0)),
+            float(os.environ.get('PASSER_MALLOC_TRIM_ABOVE_MB', 0)))
+
+
+def peak_rss_bytes() -> int:
+    """Highest resident set size of the process so far (0 where the resource module is missing)"""
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes on Linux
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def rss_bytes() -> int:
+    """Current resident set size of the process, from /proc on Linux (the peak elsewhere)"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+
+_libc = None
+
+
+def trim_heap() -> bool:
+    """
+    Return the free memory at the top and in the holes of the glibc heaps to
+    the OS (malloc_trim). Tensors of every padded batch shape are freed into
+    the heaps of torch's threads, where glibc keeps them, so without this
+    RSS creeps up over a long batch run although nothing is leaked. False
+    where glibc is not the allocator.
+    """
+    global _libc
+    if _libc is None:
+        import ctypes
+        import ctypes.util
+
+        try:
+            _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6')
+            _libc.malloc_trim
+        except (OSError, AttributeError):
+            _libc = False
+    if not _libc:
+        return False
+    _libc.malloc_trim(0)
+    return True
+
+
+class MemoryMonitor:
+    """
+    Memory use of the process and of each request.
+
+    start() and finish() bracket a request and record its RSS before and
+    after, the growth of the process's peak RSS while it ran (the part of
+    a spike that went above every earlier one) and, with tracemalloc on,
+    the peak of traced Python allocations above what was allocated when it
+    started. Tracemalloc's peak is process-wide, so the peaks of
+    overlapping requests include each other's allocations.
+
+    With trim_every or trim_above_mb, finish() first returns the freed heap
+    memory to the OS (see trim_heap) on every trim_every-th request, and on
+    any request after which RSS is trim_above_mb above what it was after the
+    last trim. Those records carry trimmed_mb, and their rss_delta_mb is what
+    the request left behind.
+
+    With tracemalloc on, top() lists the allocation sites holding the most
+    memory and those that grew the most since the previous top() call,
+    which is how a slow leak shows up between two calls a few hundred
+    requests apart.
+    """
+
+    def __init__(self, frames: int = DEFAULT_TRACEMALLOC_FRAMES, trim_every: Optional[int] = None,
+                 trim_above_mb: Optional[float] = None):
+        default_every, default_above_mb = malloc_trim_settings()
+        trim_every = default_every if trim_every is None else trim_every
+        trim_above_mb = default_above_mb if trim_above_mb is None else trim_above_mb
+        self.frames = frames
+        self.trim_every = trim_every
+        self.trim_above = trim_above_mb * MB
+        self._finished = 0
+        if frames > 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=RECENT_REQUESTS)
+        self._endpoints = {}
+        self._previous_snapshot = None
+        self.started_rss = rss_bytes()
+        self._trimmed_rss = self.started_rss
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self) -> Tuple[int, int, int, float]:
+        traced = 0
+        if self.tracing:
+            traced = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        return rss_bytes(), peak_rss_bytes(), traced, time.perf_counter()
+
+    def finish(self, token: Tuple[int, int, int, float], endpoint: str) -> Dict[str, object]:
+        """Record of the request started with token, also kept for report(); trims the heap first when due"""
+        rss_before, peak_before, traced_before, start = token
+        rss = rss_bytes()
+        trimmed = None
+        if self._trim_due(rss) and trim_heap():
+            trimmed, rss = rss - rss_bytes(), rss_bytes()
+            self._trimmed_rss = rss
+        record = {
+            'endpoint': endpoint,
+            'seconds': round(time.perf_counter() - start, 4),
+            'rss_mb': round(rss / MB, 2),
+            'rss_delta_mb': round((rss - rss_before) / MB, 2),
+            'peak_rss_delta_mb': round((peak_rss_bytes() - peak_before) / MB, 2),
+        }
+        if trimmed is not None:
+            record['trimmed_mb'] = round(trimmed / MB, 2)
+        if self.tracing:
+            record['traced_peak_mb'] = round(max(0, tracemalloc.get_traced_memory()[1] - traced_before) / MB, 2)
+        with self._lock:
+            self._recent.append(record)
+            totals = self._endpoints.setdefault(endpoint, {'requests': 0, 'rss_delta_mb': 0.0, 'max_rss_delta_mb': 0.0})
+            totals['requests'] += 1
+            totals['rss_delta_mb'] = round(totals['rss_delta_mb'] + record['rss_delta_mb'], 2)
+            totals['max_rss_delta_mb'] = max(totals['max_rss_delta_mb'], record['rss_delta_mb'])
+        return record
+
+    def _trim_due(self, rss: int) -> bool:
+        with self._lock:
+            self._finished += 1
+            if self.trim_every > 0 and self._finished % self.trim_every == 0:
+                return True
+        return self.trim_above > 0 and rss - self._trimmed_rss >= self.trim_above
+
+    def top(self, n: int = DEFAULT_TOP_N) -> Optional[Dict[str, List[Dict[str, object]]]]:
+        """Largest and fastest-growing allocation sites, or None while tracemalloc is off"""
+        if not self.tracing:
+            return None
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<unknown>'),
+        ))
+        largest = [{'where': str(stat.traceback), 'size_kb': round(stat.size / 1024, 1), 'count': stat.count}
+                   for stat in snapshot.statistics('lineno')[:n]]
+        growth = []
+        with self._lock:
+            previous, self._previous_snapshot = self._previous_snapshot, snapshot
+        if previous is not None:
+            growth = [{'where': str(stat.traceback), 'size_diff_kb': round(stat.size_diff / 1024, 1),
+                       'count_diff': stat.count_diff}
+                      for stat in snapshot.compare_to(previous, 'lineno')[:n] if stat.size_diff > 0]
+        return {'largest': largest, 'growth_since_last': growth}
+
+    def report(self, recent: int = 20) -> Dict[str, object]:
+        with self._lock:
+            endpoints = {endpoint: dict(totals) for endpoint, totals in self._endpoints.items()}
+            records = list(self._recent)[-recent:]
+        report = {
+            'rss_mb': round(rss_bytes() / MB, 2),
+            'peak_rss_mb': round(peak_rss_bytes() / MB, 2),
+            'started_rss_mb': round(self.started_rss / MB, 2),
+            'gc': {'counts': gc.get_count(), 'garbage': len(gc.garbage)},
+            'endpoints': endpoints,
+            'recent': records,
+            'tracemalloc': self.tracing,
+        }
+        if self.tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            report['traced_mb'] = round(current / MB, 2)
+            report['traced_peak_mb'] = round(peak / MB, 2)
+        return report
+
+
+_monitor = None
+_monitor_lock = threading.Lock()
+
+
+def get_memory_monitor() -> MemoryMonitor:
+    """Return the process-wide memory monitor, tracing allocations when PASSER_TRACEMALLOC is set"""
+    global _monitor
+    with _monitor_lock:
+        if _monitor is None:
+            _monitor = MemoryMonitor()
+        return _monitor
@@ -0,0 +1,150 @@
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import Iterator, List, Optional, Tuple
+
+from dataset_cache import read_texts
+from memory_monitor import MB, malloc_trim_settings, rss_bytes, trim_heap
+
+# EUDataset.json at the repository root, wherever the soak is run from
+DEFAULT_DATASET = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'EUDataset.json'))
+
+
+def soak_pairs(path: str, count: int, seed: int = 1) -> Iterator[Tuple[str, str]]:
+    """
+    count (reference, candidate) pairs replayed from the answers of a QA
+    dataset. References cycle through the answers; every candidate is a
+    different perturbation of its reference (dropped words plus a few words
+    of another answer), so the result cache never answers and every pair is
+    scored in full.
+    """
+    answers = [text for kind, _, text in read_texts(path) if kind == 'answer' and text]
+    rng = random.Random(seed)
+    for i in range(count):
+        reference = answers[i % len(answers)]
+        words = reference.split()
+        kept = [word for word in words if rng.random() > 0.2] or words[:1]
+        other = answers[rng.randrange(len(answers))].split()
+        start = rng.randrange(len(other))
+        yield reference, ' '.join(kept + other[start:start + rng.randint(3, 12)])
+
+
+def growth_mb(samples: List[Tuple[int, int]], warm_up: int) -> Tuple[float, float]:
+    """
+    (MB per 1000 requests, MB over the window) of the least-squares line
+    through the RSS samples taken after warm_up requests. A process whose
+    memory has plateaued stays near 0 on both.
+    """
+    window = [(done, rss / MB) for done, rss in samples if done >= warm_up]
+    if len(window) < 2:
+        return 0.0, 0.0
+    mean_x = sum(x for x, _ in window) / len(window)
+    mean_y = sum(y for _, y in window) / len(window)
+    var_x = sum((x - mean_x) ** 2 for x, _ in window)
+    slope = sum((x - mean_x) * (y - mean_y) for x, y in window) / var_x if var_x else 0.0
+    return slope * 1000, slope * (window[-1][0] - window[0][0])
+
+
+def run_soak(path: str, requests: int, endpoint: str = 'metrics', batch_size: int = 8,
+             profile: Optional[str] = None, sample_every: int = 100) -> Tuple[List[Tuple[int, int]], dict]:
+    """
+    Replays the pairs through the backend in this process (Flask test client),
+    one per /metrics request or batch_size per /metrics/batch request, and
+    samples the RSS after a garbage collection every sample_every pairs.
+    With heap trimming configured (see malloc_trim_settings) the heap is
+    trimmed before each sample too: RSS saws up and down between the
+    server's trims, and which point of that a sample hits would otherwise
+    decide the plateau check. Returns the (pairs scored, RSS bytes) samples
+    and the memory report.
+    """
+    import backEnd
+
+    client = backEnd.app.test_client()
+    trimming = any(malloc_trim_settings())
+    samples = [(0, rss_bytes())]
+    pending = []
+    done = 0
+    start = time.perf_counter()
+    for i, (reference, candidate) in enumerate(soak_pairs(path, requests)):
+        item = {'reference': reference, 'candidate': candidate, 'testID': f'soak-{i}', 'description': 'memory soak'}
+        if profile:
+            item['profile'] = profile
+        pending.append(item)
+        if endpoint == 'batch' and len(pending) < batch_size and i < requests - 1:
+            continue
+        if endpoint == 'batch':
+            body = {'userID': 'memory-soak', 'items': pending}
+            if profile:
+                body['profile'] = profile
+            response = client.post('/metrics/batch', json=body)
+        else:
+            response = client.post('/metrics', json=dict(pending[0], userID='memory-soak'))
+        if response.status_code != 200:
+            raise RuntimeError(f"Request {i} failed with {response.status_code}: {response.get_data(as_text=True)}")
+        previous, done = done, done + len(pending)
+        pending = []
+        if done // sample_every > previous // sample_every or done == requests:
+            gc.collect()
+            if trimming:
+                trim_heap()
+            samples.append((done, rss_bytes()))
+            print(f"{done}/{requests} pairs, RSS {samples[-1][1] / MB:.1f} MB, {time.perf_counter() - start:.0f}s")
+    return samples, backEnd.memory_monitor.report()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay dataset pairs through the metrics backend and fail if RSS keeps growing.')
+    parser.add_argument('dataset', nargs='?', default=DEFAULT_DATASET,
+                        help='QA JSON dataset whose answers are replayed')
+    parser.add_argument('--requests', type=int, default=3000, help='Pairs to score')
+    parser.add_argument('--endpoint', choices=('metrics', 'batch'), default='metrics')
+    parser.add_argument('--batch-size', type=int, default=8, help='Pairs per /metrics/batch request, as testRAGbat.js')
+    parser.add_argument('--profile', help='Metric profile (the server default when omitted)')
+    parser.add_argument('--sample-every', type=int, default=100, help='Pairs between RSS samples')
+    parser.add_argument('--warm-up', type=float, default=0.25,
+                        help='Fraction of the run left out of the plateau check (model loads, caches filling up)')
+    parser.add_argument('--max-growth-mb', type=float, default=16.0,
+                        help='Fail when RSS grows more than this over the run after the warm-up')
+    parser.add_argument('--result-cache-size', type=int, default=256,
+                        help='Bounded caches are sized so they fill up during the warm-up')
+    parser.add_argument('--trim-every', type=int,
+                        help='Return freed heap memory to the OS every this many requests (PASSER_MALLOC_TRIM_EVERY)')
+    parser.add_argument('--trim-above-mb', type=float,
+                        help='Return freed heap memory to the OS once RSS grew this much since the last time '
+                             '(PASSER_MALLOC_TRIM_ABOVE_MB)')
+    parser.add_argument('--output', help='Write the samples and the memory report as JSON here')
+    args = parser.parse_args()
+
+    # Nothing is stored, the caches fill up early and queued jobs of a real server are left alone
+    os.environ.setdefault('PASSER_STORE_RESULTS', '0')
+    os.environ.setdefault('PASSER_RESULT_CACHE_SIZE', str(args.result_cache_size))
+    os.environ.setdefault('PASSER_JOB_WORKERS', '0')
+    os.environ.setdefault('PASSER_JOB_DB', os.path.join(tempfile.gettempdir(), 'passer_soak_jobs.db'))
+    # Soak the trim settings about to be deployed
+    if args.trim_every is not None:
+        os.environ['PASSER_MALLOC_TRIM_EVERY'] = str(args.trim_every)
+    if args.trim_above_mb is not None:
+        os.environ['PASSER_MALLOC_TRIM_ABOVE_MB'] = str(args.trim_above_mb)
+
+    samples, report = run_soak(args.dataset, args.requests, args.endpoint, args.batch_size, args.profile,
+                               args.sample_every)
+    per_1000, growth = growth_mb(samples, int(args.requests * args.warm_up))
+    passed = growth <= args.max_growth_mb
+    print(f"RSS {samples[0][1] / MB:.1f} MB at start, {samples[-1][1] / MB:.1f} MB after {samples[-1][0]} pairs; "
+          f"after the warm-up {per_1000:+.2f} MB per 1000 pairs, {growth:+.1f} MB in total "
+          f"({'plateau' if passed else f'still growing, limit {args.max_growth_mb} MB'})")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'samples': [{'pairs': done, 'rss_mb': round(rss / MB, 2)} for done, rss in samples],
+                       'mb_per_1000': per_1000, 'growth_mb': growth, 'passed': passed, 'report': report}, f, indent=2)
+        print(f"Soak results written to {args.output}")
+    sys.exit(0 if passed else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import json
+import os
+import threading
+from collections import defaultdict
+from typing import Dict, FrozenSet, Iterable, List, Sequence, Tuple
+
+from nltk.corpus import wordnet
+from nltk.stem.porter import PorterStemmer
+
+Enum = List[Tuple[int, str]]
+
+
+class MeteorEngine:
+    """
+    METEOR with process-wide memos of Porter stems and WordNet synonym sets.
+
+    Scores are identical to nltk.translate.meteor_score.single_meteor_score
+    (nltk 3.10 alignment: exact, then stem, then WordNet synonym matches, each
+    matching from the end of the hypothesis) with the default preprocess,
+    stemmer, WordNet reader and alpha/beta/gamma. Only the stemmer and
+    synset lookups are memoized; the alignment itself is the same algorithm.
+    """
+
+    def __init__(self, alpha: float = 0.9, beta: float = 3.0, gamma: float = 0.5):
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        self._stemmer = PorterStemmer()
+        self._stems = {}
+        self._synonyms = {}
+        self._wordnet_lock = threading.Lock()
+
+    def stem(self, word: str) -> str:
+        stem = self._stems.get(word)
+        if stem is None:
+            stem = self._stems.setdefault(word, self._stemmer.stem(word))
+        return stem
+
+    def synonyms(self, word: str) -> FrozenSet[str]:
+        """The word plus every single-word lemma of its WordNet synsets"""
+        synonyms = self._synonyms.get(word)
+        if synonyms is None:
+            # The WordNet reader loads lazily and is not thread-safe while doing so
+            with self._wordnet_lock:
+                synonyms = self._synonyms.get(word)
+                if synonyms is None:
+                    names = {lemma.name() for synset in wordnet.synsets(word) for lemma in synset.lemmas()}
+                    synonyms = frozenset(name for name in names if name.find('_') < 0) | {word}
+                    self._synonyms[word] = synonyms
+        return synonyms
+
+    def warm(self, words: Iterable[str]) -> int:
+        """Fill the memos for a vocabulary (synonyms are looked up on stems, as in nltk)"""
+        count = 0
+        for word in set(word.lower() for word in words):
+            self.synonyms(self.stem(word))
+            count += 1
+        return count
+
+    def warm_from_files(self, paths: Sequence[str]) -> int:
+        """
+        Warm from QA JSON datasets (questions and answers) or plain text files,
+        tokenized by whitespace like the METEOR inputs, or from the vocabulary
+        of compiled datasets (directories written by dataset_cache).
+        """
+        words = set()
+        for path in paths:
+            if os.path.isdir(path):
+                from dataset_cache import CompiledDataset
+
+                words.update(CompiledDataset(path).vocabulary())
+                continue
+            with open(path, 'r', encoding='utf-8') as f:
+                if path.endswith('.json'):
+                    for qa in json.load(f):
+                        words.update(qa.get('question', '').split())
+                        words.update(qa.get('answer', '').split())
+                else:
+                    words.update(f.read().split())
+        count = self.warm(words)
+        print(f"METEOR memo warmed with {count} words from {', '.join(paths)}")
+        return count
+
+    @staticmethod
+    def _match(hypothesis: Enum, reference: Enum) -> Tuple[List[Tuple[int, int]], Enum, Enum]:
+        # Exact matches, taking the last free reference position for each hypothesis word from the end
+        matches = []
+        ref_positions = defaultdict(list)
+        for j, (_, word) in enumerate(reference):
+            ref_positions[word].append(j)
+        matched_hyp = set()
+        matched_ref = set()
+        for i in range(len(hypothesis) - 1, -1, -1):
+            positions = ref_positions.get(hypothesis[i][1])
+            if positions:
+                j = positions.pop()
+                matched_hyp.add(i)
+                matched_ref.add(j)
+                matches.append((hypothesis[i][0], reference[j][0]))
+        return (matches,
+                [pair for i, pair in enumerate(hypothesis) if i not in matched_hyp],
+                [pair for j, pair in enumerate(reference) if j not in matched_ref])
+
+    def _match_synonyms(self, hypothesis: Enum, reference: Enum) -> List[Tuple[int, int]]:
+        matches = []
+        ref_positions = defaultdict(list)
+        for j, (_, word) in enumerate(reference):
+            ref_positions[word].append(j)
+        for i in range(len(hypothesis) - 1, -1, -1):
+            best_j = -1
+            best_word = None
+            for synonym in self.synonyms(hypothesis[i][1]):
+                positions = ref_positions.get(synonym)
+                if positions and positions[-1] > best_j:
+                    best_j = positions[-1]
+                    best_word = synonym
+            if best_word is not None:
+                ref_positions[best_word].pop()
+                matches.append((hypothesis[i][0], reference[best_j][0]))
+        return matches
+
+    def align(self, reference: Sequence[str], hypothesis: Sequence[str]) -> List[Tuple[int, int]]:
+        """Sorted (hypothesis index, reference index) matches"""
+        hyp = list(enumerate(word.lower() for word in hypothesis))
+        ref = list(enumerate(word.lower() for word in reference))
+        exact, hyp, ref = self._match(hyp, ref)
+        stem, hyp, ref = self._match([(i, self.stem(w)) for i, w in hyp], [(j, self.stem(w)) for j, w in ref])
+        synonym = self._match_synonyms(hyp, ref)
+        return sorted(exact + stem + synonym, key=lambda pair: pair[0])
+
+    @staticmethod
+    def _count_chunks(matches: List[Tuple[int, int]]) -> int:
+        chunks = 1
+        for (h0, r0), (h1, r1) in zip(matches, matches[1:]):
+            if not (h1 == h0 + 1 and r1 == r0 + 1):
+                chunks += 1
+        return chunks
+
+    def score(self, reference: Sequence[str], hypothesis: Sequence[str]) -> float:
+        """Same arguments and value as single_meteor_score(reference, hypothesis)"""
+        if isinstance(reference, str) or isinstance(hypothesis, str):
+            raise TypeError('METEOR expects pre-tokenized reference and hypothesis (lists of str).')
+        matches = self.align(reference, hypothesis)
+        matches_count = len(matches)
+        if not matches_count or not hypothesis or not reference:
+            return 0.0
+        precision = float(matches_count) / len(hypothesis)
+        recall = float(matches_count) / len(reference)
+        fmean = (precision * recall) / (self.alpha * precision + (1 - self.alpha) * recall)
+        frag_frac = float(self._count_chunks(matches)) / matches_count
+        penalty = self.gamma * frag_frac ** self.beta
+        return (1 - penalty) * fmean
+
+    def score_batch(self, pairs: Sequence[Tuple[Sequence[str], Sequence[str]]]) -> List[float]:
+        """Scores of many (reference, hypothesis) token lists, sharing the memos"""
+        return [self.score(reference, hypothesis) for reference, hypothesis in pairs]
+
+    def stats(self) -> Dict[str, int]:
+        return {'stems': len(self._stems), 'synonym_sets': len(self._synonyms)}
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_meteor_engine() -> MeteorEngine:
+    """Return the process-wide METEOR engine"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = MeteorEngine()
+        return _engine
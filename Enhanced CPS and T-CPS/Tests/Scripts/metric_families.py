@@ -0,0 +1,690 @@
+import importlib
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Sequence, Tuple
+
+from reference_cache import ReferenceEntry, get_reference_cache
+from rouge_engine import get_rouge_engine
+from scoring_scheduler import hold_until_done
+from text_analysis import TextAnalysis
+
+# nltk, scipy and torch are imported by the families that use them (see
+# FAMILY_MODULES), so a lexical deployment starts without loading torch
+if TYPE_CHECKING:
+    from text_encoding import TextEncoding
+
+# Order of the values in the results vector stored in MongoDB and sent to the llmtest contract
+RESULT_FIELDS = [
+    'METEOR', 'BLEU',
+    'Rouge-1.r', 'Rouge-1.p', 'Rouge-1.f',
+    'Rouge-2.r', 'Rouge-2.p', 'Rouge-2.f',
+    'Rouge-l.r', 'Rouge-l.p', 'Rouge-l.f',
+    'Laplace Perplexity', 'Lidstone Perplexity',
+    'Cosine similarity', 'Pearson correlation', 'F1 score',
+    'Bert-Score.precision', 'Bert-Score.recall', 'Bert-Score.f1',
+    'B-RT.coherence', 'B-RT.consistency', 'B-RT.fluency', 'B-RT.relevance', 'B-RT.average',
+]
+
+# Bump whenever a metric's definition changes, so cached results are not reused
+METRICS_VERSION = 1
+
+# Written into the slots of metrics a profile does not compute, so positional
+# readers of the 24-value vector keep working (null in JSON responses)
+SKIPPED_VALUE = float('nan')
+
+# Named subsets of RESULT_FIELDS a request can ask for
+PROFILES: Dict[str, List[str]] = {
+    'full': list(RESULT_FIELDS),
+    # The 9 metrics used by the CPS and T-CPS scripts (TCPSCalculator.metrics_config)
+    'cps': [
+        'METEOR', 'Rouge-2.f', 'Rouge-l.f', 'Bert-Score.f1', 'B-RT.average',
+        'F1 score', 'B-RT.fluency', 'Laplace Perplexity', 'Lidstone Perplexity',
+    ],
+    # Everything that does not need BERT
+    'lexical-only': [
+        'METEOR', 'BLEU',
+        'Rouge-1.r', 'Rouge-1.p', 'Rouge-1.f',
+        'Rouge-2.r', 'Rouge-2.p', 'Rouge-2.f',
+        'Rouge-l.r', 'Rouge-l.p', 'Rouge-l.f',
+        'Laplace Perplexity', 'Lidstone Perplexity', 'F1 score',
+    ],
+}
+DEFAULT_PROFILE = 'full'
+
+
+class PairContext:
+    """
+    Inputs shared by all metric families for one (reference, candidate) pair.
+
+    BERT encodings are computed lazily and at most once, even when several
+    families ask for them from different threads, and are read from the
+    embedding store when it has them. Everything derived from the reference
+    alone comes from the shared reference cache, and the lexical families
+    read their tokens from one TextAnalysis per text.
+    """
+
+    def __init__(self, reference: str, candidate: str, reference_encoding: Optional['TextEncoding'] = None,
+                 candidate_encoding: Optional['TextEncoding'] = None, combined_encoding: Optional['TextEncoding'] = None,
+                 precomputed: Optional[Dict[str, Dict[str, float]]] = None):
+        self.reference = reference
+        self.candidate = candidate
+        # Values of families already scored for a whole batch, by family name
+        self.precomputed = precomputed or {}
+        self._encodings = {
+            'reference': reference_encoding,
+            'candidate': candidate_encoding,
+            'combined': combined_encoding,
+        }
+        self._locks = {name: threading.Lock() for name in self._encodings}
+        self._reference_entry = None
+        self._candidate_analysis = None
+        # Time spent computing encodings, which the deadline scheduler accounts for separately
+        self.encoding_seconds = 0.0
+
+    @property
+    def reference_entry(self) -> ReferenceEntry:
+        if self._reference_entry is None:
+            self._reference_entry = get_reference_cache().get(self.reference)
+        return self._reference_entry
+
+    @property
+    def reference_analysis(self) -> TextAnalysis:
+        return self.reference_entry.analysis
+
+    @property
+    def candidate_analysis(self) -> TextAnalysis:
+        if self._candidate_analysis is None:
+            self._candidate_analysis = TextAnalysis(self.candidate)
+        return self._candidate_analysis
+
+    def encoding(self, name: str) -> 'TextEncoding':
+        from embedding_store import encode_stored
+
+        with self._locks[name]:
+            if self._encodings[name] is None:
+                start = time.perf_counter()
+                if name == 'reference':
+                    self._encodings[name] = self.reference_entry.encoding()
+                else:
+                    self._encodings[name] = encode_stored(self._text(name))
+                seconds = time.perf_counter() - start
+                self.encoding_seconds += seconds
+                _update_cost('encoding', seconds / _encoding_words(self, name))
+            return self._encodings[name]
+
+    def _text(self, name: str) -> str:
+        if name == 'reference':
+            return self.reference
+        if name == 'candidate':
+            return self.candidate
+        # Combined input used by B-RT for quality assessment
+        return f"Reference: {self.reference} Candidate: {self.candidate}"
+
+
+def meteor_family(ctx: PairContext) -> Dict[str, float]:
+    from meteor_engine import get_meteor_engine
+
+    # Same value as nltk's single_meteor_score, with memoized stems and WordNet synonyms
+    meteor_score = get_meteor_engine().score(ctx.reference_analysis.split, ctx.candidate_analysis.split)
+    print("METEOR", meteor_score)
+    return {'METEOR': meteor_score}
+
+
+def rouge_family(ctx: PairContext) -> Dict[str, float]:
+    # The reference is scored as the hypothesis, as in the original
+    # rouge.Rouge().get_scores(hypothesis=reference, ref=candidate) call
+    hypothesis = ctx.reference_analysis
+    ref = ctx.candidate_analysis
+
+    # Same r/p/f values as rouge.Rouge().get_scores, with a bit-parallel ROUGE-L
+    rouge_scores = [get_rouge_engine().score_analyses(hypothesis, ref)]
+    print("ROUGE", rouge_scores)
+
+    values = {}
+    for key, name in (('rouge-1', 'Rouge-1'), ('rouge-2', 'Rouge-2'), ('rouge-l', 'Rouge-l')):
+        for part in ('r', 'p', 'f'):
+            values[f'{name}.{part}'] = rouge_scores[0][key][part]
+    return values
+
+
+def bleu_family(ctx: PairContext) -> Dict[str, float]:
+    from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
+
+    # Reference and candidate sentences should be tokenized
+    reference_blue = ctx.reference_analysis.split
+    candidate_blue = ctx.candidate_analysis.split
+
+    # Create a smoothing function
+    smoothie = SmoothingFunction().method4
+
+    # Calculate BLEU score with smoothing
+    blue_score = sentence_bleu([reference_blue], candidate_blue, smoothing_function=smoothie)
+    print("BLEU", blue_score)
+    return {'BLEU': blue_score}
+
+
+def laplace_family(ctx: PairContext) -> Dict[str, float]:
+    # Bigram model with Laplace smoothing (add-one smoothing) fitted on the reference
+    model = ctx.reference_entry.laplace_model()
+
+    # Perplexity of the candidate
+    laplace_perplexity = model.perplexity(ctx.candidate_analysis.words)
+    print(f"Laplace Perplexity: {laplace_perplexity}")
+    return {'Laplace Perplexity': laplace_perplexity}
+
+
+def lidstone_family(ctx: PairContext) -> Dict[str, float]:
+    # Trigram model with Lidstone smoothing (gamma=0.1) fitted on the reference
+    model = ctx.reference_entry.lidstone_model()
+
+    # Perplexity is the exponentiated negative average log-likelihood of the
+    # candidate's first sentence
+    tokenized_test_text = ctx.candidate_analysis.sentences
+    lidstone_perplexity = model.perplexity(tokenized_test_text[0])
+    print(f"Lidstone Perplexity of the test text: {lidstone_perplexity}")
+    return {'Lidstone Perplexity': lidstone_perplexity}
+
+
+def f1_score(prediction: str, truth: str) -> float:
+    return f1_analyses(TextAnalysis(prediction), TextAnalysis(truth))
+
+
+def f1_analyses(prediction: TextAnalysis, truth: TextAnalysis) -> float:
+    return f1_from_counts(*f1_counts(prediction, truth))
+
+
+def f1_counts(prediction: TextAnalysis, truth: TextAnalysis) -> Tuple[int, int, int]:
+    """(shared, prediction, truth) lowercased token counts; summed over a run they give the micro F1"""
+    common_tokens = prediction.lower_counts & truth.lower_counts
+    return sum(common_tokens.values()), len(prediction.lower_split), len(truth.lower_split)
+
+
+def f1_from_counts(num_same: int, prediction_count: int, truth_count: int) -> float:
+    if num_same == 0:
+        return 0
+
+    precision = 1.0 * num_same / prediction_count
+    recall = 1.0 * num_same / truth_count
+    f1 = (2 * precision * recall) / (precision + recall)
+
+    return f1
+
+
+def f1_family(ctx: PairContext) -> Dict[str, float]:
+    f1 = f1_analyses(ctx.candidate_analysis, ctx.reference_analysis)
+    print(f"F1 Score: {f1:.3f}")
+    return {'F1 score': f1}
+
+
+def cosine_family(ctx: PairContext) -> Dict[str, float]:
+    import torch
+
+    # Cosine similarity between the [CLS] embeddings
+    cosine_similarity = torch.nn.functional.cosine_similarity(ctx.encoding('reference').cls, ctx.encoding('candidate').cls)
+    print(f"Cosine similarity: {cosine_similarity.item()}")
+    return {'Cosine similarity': cosine_similarity.item()}
+
+
+def pearson_family(ctx: PairContext) -> Dict[str, float]:
+    from scipy.stats import pearsonr
+
+    # Pearson Correlation Coefficient on the mean-pooled embeddings
+    pearson_corr, _ = pearsonr(ctx.encoding('reference').mean.numpy().flatten(),
+                               ctx.encoding('candidate').mean.numpy().flatten())
+    print(f"Pearson Correlation Coefficient: {pearson_corr}")
+    return {'Pearson correlation': pearson_corr}
+
+
+def compute_bertscore_alternative(pred_encoding: 'TextEncoding', ref_encoding: 'TextEncoding') -> Dict[str, float]:
+    from bertscore_engine import get_bertscore_engine
+
+    # Greedy token matching on normalized embeddings (one matmul, optional IDF weights)
+    return get_bertscore_engine().score(pred_encoding, ref_encoding)
+
+
+def bertscore_values(bert1_score: Dict[str, float]) -> Dict[str, float]:
+    return {
+        'Bert-Score.precision': bert1_score['precision'],
+        'Bert-Score.recall': bert1_score['recall'],
+        'Bert-Score.f1': bert1_score['f1'],
+    }
+
+
+def bertscore_family(ctx: PairContext) -> Dict[str, float]:
+    bert1_score = compute_bertscore_alternative(ctx.encoding('reference'), ctx.encoding('candidate'))
+    print("BERT Score", bert1_score)
+    return bertscore_values(bert1_score)
+
+
+def evaluate_bert_rt_score(ref_encoding: 'TextEncoding', cand_encoding: 'TextEncoding',
+                           combined_encoding: 'TextEncoding') -> Dict[str, float]:
+    import torch
+
+    # Get the embeddings for the [CLS] token of the combined input
+    cls_embedding = combined_encoding.cls
+
+    # Simple scoring based on vector norms and similarities
+    # We'll use different projections of the embedding to simulate different aspects
+    ref_emb = ref_encoding.cls
+    cand_emb = cand_encoding.cls
+
+    # Calculate base similarity
+    sim = torch.nn.functional.cosine_similarity(ref_emb, cand_emb).item()
+
+    # Coherence: how well the text flows (use normalized embedding components)
+    coherence = (torch.norm(cls_embedding[:, :100]).item() / 10.0) * sim
+    coherence = min(max(coherence, 0.0), 5.0)  # Scale to 0-5
+
+    # Consistency: semantic alignment (direct similarity)
+    consistency = sim * 5.0  # Scale similarity to 0-5
+
+    # Fluency: language quality (use different embedding components)
+    fluency = (torch.norm(cls_embedding[:, 100:300]).item() / 15.0) * sim
+    fluency = min(max(fluency, 0.0), 5.0)  # Scale to 0-5
+
+    # Relevance: how relevant the response is to the reference
+    relevance = sim * 5.0  # Scale similarity to 0-5
+
+    # Average score
+    avg_score = (coherence + consistency + fluency + relevance) / 4.0
+
+    return {
+        'coherence': coherence,
+        'consistency': consistency,
+        'fluency': fluency,
+        'relevance': relevance,
+        'avg_score': avg_score
+    }
+
+
+def brt_family(ctx: PairContext) -> Dict[str, float]:
+    bert_rt_score = evaluate_bert_rt_score(ctx.encoding('reference'), ctx.encoding('candidate'), ctx.encoding('combined'))
+    print("BERT-RT Score", bert_rt_score)
+    return {
+        'B-RT.coherence': bert_rt_score['coherence'],
+        'B-RT.consistency': bert_rt_score['consistency'],
+        'B-RT.fluency': bert_rt_score['fluency'],
+        'B-RT.relevance': bert_rt_score['relevance'],
+        'B-RT.average': bert_rt_score['avg_score'],
+    }
+
+
+# Metric families in the order calc_metrics has always computed them
+FAMILIES: Dict[str, Callable[[PairContext], Dict[str, float]]] = {
+    'meteor': meteor_family,
+    'rouge': rouge_family,
+    'bleu': bleu_family,
+    'laplace': laplace_family,
+    'lidstone': lidstone_family,
+    'cosine': cosine_family,
+    'pearson': pearson_family,
+    'f1': f1_family,
+    'bertscore': bertscore_family,
+    'brt': brt_family,
+}
+
+# Result fields each family produces; a family always fills all of its fields
+FAMILY_FIELDS: Dict[str, List[str]] = {
+    'meteor': ['METEOR'],
+    'rouge': ['Rouge-1.r', 'Rouge-1.p', 'Rouge-1.f', 'Rouge-2.r', 'Rouge-2.p', 'Rouge-2.f',
+              'Rouge-l.r', 'Rouge-l.p', 'Rouge-l.f'],
+    'bleu': ['BLEU'],
+    'laplace': ['Laplace Perplexity'],
+    'lidstone': ['Lidstone Perplexity'],
+    'cosine': ['Cosine similarity'],
+    'pearson': ['Pearson correlation'],
+    'f1': ['F1 score'],
+    'bertscore': ['Bert-Score.precision', 'Bert-Score.recall', 'Bert-Score.f1'],
+    'brt': ['B-RT.coherence', 'B-RT.consistency', 'B-RT.fluency', 'B-RT.relevance', 'B-RT.average'],
+}
+
+# BERT encodings (PairContext.encoding names) each neural family reads
+FAMILY_ENCODINGS: Dict[str, List[str]] = {
+    'cosine': ['reference', 'candidate'],
+    'pearson': ['reference', 'candidate'],
+    'bertscore': ['reference', 'candidate'],
+    'brt': ['reference', 'candidate', 'combined'],
+}
+
+# Families that run BERT; in concurrent mode they share one lane so the
+# lexical families can overlap with torch inference
+NEURAL_FAMILIES = ['cosine', 'pearson', 'bertscore', 'brt']
+
+# Modules each family imports on first use; load_family() imports them up front
+FAMILY_MODULES: Dict[str, List[str]] = {
+    'meteor': ['nltk.corpus', 'nltk.stem.porter', 'meteor_engine'],
+    'rouge': ['rouge_engine'],
+    'bleu': ['nltk.translate.bleu_score'],
+    'laplace': ['nltk.tokenize'],
+    'lidstone': ['nltk.tokenize'],
+    'cosine': ['torch', 'embedding_store'],
+    'pearson': ['scipy.stats', 'torch', 'embedding_store'],
+    'f1': [],
+    'bertscore': ['torch', 'embedding_store', 'bertscore_engine'],
+    'brt': ['torch', 'embedding_store'],
+}
+
+# Cheap-to-expensive order in which a deadline run schedules families it has not timed yet
+FAMILY_COST_ORDER = ['f1', 'bleu', 'rouge', 'laplace', 'lidstone', 'meteor', 'cosine', 'pearson', 'bertscore', 'brt']
+
+# Weight of the newest run in each family's moving average of seconds per word
+COST_SMOOTHING = 0.2
+
+# Pair each family is run on once by warm_families()
+WARM_UP_PAIR = (
+    "Climate-smart agriculture helps farmers adapt. It improves soil health and saves water.",
+    "Farmers adopt climate-smart agriculture to improve the soil and use less water.",
+)
+
+
+def families_for_profile(profile: str) -> List[str]:
+    """
+    Families needed for the fields of a profile, in FAMILIES order.
+    Raises ValueError for an unknown profile name.
+    """
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown metric profile '{profile}', expected one of {', '.join(PROFILES)}.")
+    fields = set(PROFILES[profile])
+    return [name for name in FAMILIES if fields.intersection(FAMILY_FIELDS[name])]
+
+
+def encodings_for_families(families: List[str]) -> List[str]:
+    """BERT encodings the given families read, in PairContext order"""
+    needed = {encoding for name in families for encoding in FAMILY_ENCODINGS.get(name, [])}
+    return [name for name in ('reference', 'candidate', 'combined') if name in needed]
+
+
+def json_values(res: List[float]) -> List[Optional[float]]:
+    """Results vector as JSON-safe floats, with skipped slots as None"""
+    return [None if x != x else float(x) for x in res]
+
+_executor = None
+_executor_lock = threading.Lock()
+_wordnet_loaded = False
+_family_status: Dict[str, dict] = {
+    name: {'loaded': False, 'warmed': False, 'load_seconds': None, 'warm_seconds': None, 'error': None}
+    for name in FAMILIES
+}
+_family_lock = threading.Lock()
+_warmer = None
+_warmer_lock = threading.Lock()
+# Seconds per word of reference plus candidate each family recently took, by family
+# name, and seconds per word of one BERT encoding under 'encoding'
+_family_costs: Dict[str, float] = {}
+
+
+def ensure_wordnet_loaded():
+    """nltk's lazy WordNet loader is not thread-safe, so load it before going concurrent"""
+    global _wordnet_loaded
+    if not _wordnet_loaded:
+        from nltk.corpus import wordnet
+
+        wordnet.ensure_loaded()
+        _wordnet_loaded = True
+
+
+def reopen_wordnet_files():
+    """
+    Drop WordNet's open data files so they are reopened on the next lookup. The
+    reader seeks in files it keeps open, so processes forked after the warm-up
+    must not share those file offsets with the parent.
+    """
+    if 'nltk.corpus' not in sys.modules:
+        return
+    from nltk.corpus import wordnet
+
+    # A LazyCorpusLoader that has not loaded yet has no data files
+    files = wordnet.__dict__.get('_data_file_map')
+    if files:
+        for f in files.values():
+            f.close()
+        files.clear()
+
+
+def load_family(name: str):
+    """Import the modules a family needs (no-op once loaded); import errors propagate"""
+    status = _family_status[name]
+    if status['loaded']:
+        return
+    with _family_lock:
+        if status['loaded']:
+            return
+        start = time.perf_counter()
+        try:
+            for module in FAMILY_MODULES[name]:
+                importlib.import_module(module)
+        except ImportError as e:
+            status['error'] = str(e)
+            raise
+        status['load_seconds'] = time.perf_counter() - start
+        status['loaded'] = True
+
+
+def _warm_up_context(families: Sequence[str]) -> PairContext:
+    reference, candidate = WARM_UP_PAIR
+    ctx = PairContext(reference, candidate)
+    # The warm-up pair is kept out of the reference cache and the embedding store
+    ctx._reference_entry = ReferenceEntry(reference)
+    needed = encodings_for_families(families)
+    if needed:
+        from encoder_registry import get_registry
+        from text_encoding import encode_texts
+
+        tokenizer, model = get_registry().get()
+        encodings = encode_texts([ctx._text(name) for name in needed], tokenizer, model)
+        ctx._encodings.update(zip(needed, encodings))
+    return ctx
+
+
+def warm_families(families: Sequence[str], meteor_vocab: Sequence[str] = ()):
+    """
+    Loads each family and runs it once on WARM_UP_PAIR, recording the outcome
+    in family_status(). Neural families wait for the BERT encoder. meteor_vocab
+    lists files whose vocabulary warms the METEOR memos (see MeteorEngine).
+    """
+    lexical = [name for name in families if name not in NEURAL_FAMILIES]
+    neural = [name for name in families if name in NEURAL_FAMILIES]
+    for names in (lexical, neural):
+        if not names:
+            continue
+        try:
+            for name in names:
+                load_family(name)
+            ctx = _warm_up_context(names)
+        except Exception as e:
+            print(f"Error loading metric families {', '.join(names)}: {e}")
+            for name in names:
+                _family_status[name]['error'] = str(e)
+            continue
+        for name in names:
+            status = _family_status[name]
+            start = time.perf_counter()
+            try:
+                if name == 'meteor':
+                    ensure_wordnet_loaded()
+                    if meteor_vocab:
+                        from meteor_engine import get_meteor_engine
+
+                        get_meteor_engine().warm_from_files(meteor_vocab)
+                FAMILIES[name](ctx)
+            except Exception as e:
+                status['error'] = str(e)
+                print(f"Error warming metric family {name}: {e}")
+                continue
+            status['warm_seconds'] = time.perf_counter() - start
+            status['warmed'] = True
+            status['error'] = None
+
+
+def warm_families_async(families: Sequence[str], meteor_vocab: Sequence[str] = ()) -> threading.Thread:
+    """Start warm_families in a background thread (once per process)"""
+    global _warmer
+    with _warmer_lock:
+        if _warmer is None:
+            _warmer = threading.Thread(target=warm_families, args=(list(families), list(meteor_vocab)),
+                                       name='family-warmer', daemon=True)
+            _warmer.start()
+        return _warmer
+
+
+def wait_warm(timeout: Optional[float] = None) -> bool:
+    """Wait for the background warm-up; True if it finished (or never started)"""
+    if _warmer is not None:
+        _warmer.join(timeout)
+        return not _warmer.is_alive()
+    return True
+
+
+def families_warmed(families: Sequence[str]) -> bool:
+    return all(_family_status[name]['warmed'] for name in families)
+
+
+def family_status() -> Dict[str, dict]:
+    """Loaded/warmed state of every family, for the /ready endpoint"""
+    return {name: dict(status) for name, status in _family_status.items()}
+
+
+def get_executor(threads: int) -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='metric-family')
+        return _executor
+
+
+def _pair_words(name: str, ctx: PairContext) -> int:
+    reference, candidate = len(ctx.reference_analysis.split), len(ctx.candidate_analysis.split)
+    if name in NEURAL_FAMILIES:
+        # BERT inputs are truncated to 512 tokens, so longer texts cost no more
+        reference, candidate = min(reference, 512), min(candidate, 512)
+    return max(1, reference + candidate)
+
+
+def _encoding_words(ctx: PairContext, encoding: str) -> int:
+    words = {'reference': len(ctx.reference_analysis.split), 'candidate': len(ctx.candidate_analysis.split)}
+    words['combined'] = words['reference'] + words['candidate']
+    return max(1, min(words[encoding], 512))
+
+
+def _update_cost(name: str, per_word: float):
+    cost = _family_costs.get(name)
+    _family_costs[name] = per_word if cost is None else (1 - COST_SMOOTHING) * cost + COST_SMOOTHING * per_word
+
+
+def estimated_cost(name: str, ctx: PairContext) -> Optional[float]:
+    """
+    Expected seconds of a family on this pair from its recent runs, plus the
+    BERT encodings it would have to compute first, or None before its first
+    timed run.
+    """
+    cost = _family_costs.get(name)
+    if cost is None:
+        return None
+    cost *= _pair_words(name, ctx)
+    encoding_cost = _family_costs.get('encoding', 0.0)
+    for encoding in FAMILY_ENCODINGS.get(name, []):
+        if ctx._encodings[encoding] is None:
+            cost += encoding_cost * _encoding_words(ctx, encoding)
+    return cost
+
+
+def _within_budget(name: str, ctx: PairContext, deadline: float) -> bool:
+    remaining = deadline - time.perf_counter()
+    if remaining <= 0:
+        return False
+    cost = estimated_cost(name, ctx)
+    # Families that were never timed are tried while any budget remains
+    return cost is None or cost <= remaining
+
+
+def _cost_order(names: List[str], ctx: PairContext) -> List[str]:
+    def key(name):
+        cost = estimated_cost(name, ctx)
+        return (cost if cost is not None else float('inf'), FAMILY_COST_ORDER.index(name))
+
+    return sorted(names, key=key)
+
+
+def _run_timed(names: List[str], ctx: PairContext, timings: Dict[str, float], deadline: Optional[float] = None,
+               values: Optional[Dict[str, float]] = None) -> Dict[str, float]:
+    values = {} if values is None else values
+    for name in names:
+        precomputed = name in ctx.precomputed
+        if deadline is not None and not precomputed and not _within_budget(name, ctx, deadline):
+            continue
+        # A family's first run includes imports and lazy loading, so it says nothing about its cost
+        warm = _family_status[name]['warmed']
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        encoding_start = ctx.encoding_seconds
+        load_family(name)
+        family_values = ctx.precomputed[name] if precomputed else FAMILIES[name](ctx)
+        values.update(family_values)
+        timings[name] = time.perf_counter() - start
+        if warm and not precomputed:
+            if name in NEURAL_FAMILIES:
+                # Encodings are costed on their own, whichever family computed them
+                seconds = timings[name] - (ctx.encoding_seconds - encoding_start)
+            else:
+                # CPU time of the lane, so waiting on the GIL in concurrent mode is not counted
+                seconds = time.thread_time() - cpu_start
+            _update_cost(name, seconds / _pair_words(name, ctx))
+        _family_status[name]['warmed'] = True
+    return values
+
+
+def run_families(ctx: PairContext, mode: str = 'sequential', threads: int = 4,
+                 families: Optional[List[str]] = None, deadline: Optional[float] = None,
+                 not_computed: Optional[List[str]] = None) -> Tuple[List[float], Dict[str, float]]:
+    """
+    Runs the metric families for one pair and returns (results vector, timings).
+
+    families limits the run to a subset (see families_for_profile); fields of
+    the families that are not run are set to SKIPPED_VALUE. mode='sequential'
+    runs the families one after the other. mode='concurrent' runs each lexical
+    family and the neural lane as separate tasks on a shared thread pool.
+    timings holds the wall time of each family in seconds plus 'total'.
+
+    deadline is a time.perf_counter() value by which the run should return.
+    Families then run cheapest first (by their recent seconds per word) and
+    a family only starts when its expected cost fits in the remaining
+    budget. In concurrent mode lanes that have not started by the deadline
+    are cancelled, and lanes still running finish their current family in
+    the background, holding the caller's scheduler slot until they do (see
+    scoring_scheduler.hold_until_done). The fields of every family that did
+    not complete are SKIPPED_VALUE too and are appended to not_computed.
+    """
+    selected = list(FAMILIES) if families is None else [name for name in FAMILIES if name in families]
+    timings = {}
+    start = time.perf_counter()
+    if deadline is not None:
+        selected = _cost_order(selected, ctx)
+    if mode == 'concurrent':
+        neural = [name for name in selected if name in NEURAL_FAMILIES]
+        lanes = [[name] for name in selected if name not in NEURAL_FAMILIES] + ([neural] if neural else [])
+        if 'meteor' in selected:
+            ensure_wordnet_loaded()
+        executor = get_executor(threads)
+        lane_timings = {}
+        shared = {}
+        futures = [executor.submit(_run_timed, lane, ctx, lane_timings, deadline, shared) for lane in lanes]
+        done, running = wait(futures, timeout=None if deadline is None else max(0.0, deadline - time.perf_counter()))
+        for future in done:
+            future.result()
+        if running:
+            running = [future for future in running if not future.cancel()]
+            hold_until_done(running)
+        # Snapshot, as lanes that missed the deadline keep writing
+        values = dict(shared)
+        timings.update(lane_timings)
+    else:
+        values = _run_timed(selected, ctx, timings, deadline)
+    timings['total'] = time.perf_counter() - start
+
+    if not_computed is not None:
+        fields = {field for name in selected for field in FAMILY_FIELDS[name]}
+        not_computed += [field for field in RESULT_FIELDS if field in fields and field not in values]
+    res = [values.get(field, SKIPPED_VALUE) for field in RESULT_FIELDS]
+    return res, timings
@@ -0,0 +1,222 @@
+import argparse
+import json
+import os
+import zlib
+from collections import defaultdict
+from typing import Dict, Hashable, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from dataset_cache import CompiledDataset, read_texts
+from text_analysis import TextAnalysis
+
+# Estimated Jaccard similarity of word shingles above which two texts are near-duplicates
+DEFAULT_THRESHOLD = float(os.environ.get('PASSER_DEDUPE_THRESHOLD', 0.9))
+DEFAULT_NUM_PERM = 128
+DEFAULT_SHINGLE_SIZE = 3
+
+# Mersenne prime 2**31 - 1; with a and b below it, (a * hash + b) fits in uint64 for 32-bit hashes
+_MERSENNE = (1 << 31) - 1
+
+
+class MinHasher:
+    """
+    MinHash signatures of the lowercased word shingles of texts.
+
+    Shingles are hashed with crc32 (stable across processes, unlike hash())
+    and permuted with num_perm random affine maps mod a Mersenne prime. The
+    fraction of equal signature slots estimates the Jaccard similarity of
+    the shingle sets. Texts shorter than shingle_size words use one shingle
+    of all their words.
+    """
+
+    def __init__(self, num_perm: int = DEFAULT_NUM_PERM, shingle_size: int = DEFAULT_SHINGLE_SIZE, seed: int = 1):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, _MERSENNE, num_perm).astype(np.uint64)
+        self._b = rng.randint(0, _MERSENNE, num_perm).astype(np.uint64)
+
+    def shingles(self, text: str) -> Set[str]:
+        tokens = TextAnalysis(text).lower_split
+        size = min(self.shingle_size, len(tokens))
+        return {' '.join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)} if size else set()
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """Signature of text, or None for a text without words"""
+        shingles = self.shingles(text)
+        if not shingles:
+            return None
+        hashes = np.fromiter((zlib.crc32(shingle.encode('utf-8')) for shingle in shingles),
+                             dtype=np.uint64, count=len(shingles))
+        return ((np.outer(hashes, self._a) + self._b) % _MERSENNE).min(axis=0).astype(np.uint32)
+
+
+def similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of two MinHash signatures"""
+    return float(np.count_nonzero(a == b)) / len(a)
+
+
+def lsh_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """
+    (bands, rows) whose LSH S-curve (1/bands)**(1/rows) is closest to the
+    threshold, i.e. pairs at the threshold collide in some band about half
+    the time and pairs well above it almost always do.
+    """
+    best = None
+    for rows in range(1, num_perm + 1):
+        bands = num_perm // rows
+        error = abs((1.0 / bands) ** (1.0 / rows) - threshold)
+        if best is None or error < best[0]:
+            best = (error, bands, rows)
+    return best[1], best[2]
+
+
+class LshIndex:
+    """
+    Banded locality-sensitive hashing over MinHash signatures.
+
+    Each signature is cut into bands and every band is a key into its own
+    hash table, so a query only compares against texts that share a whole
+    band with it instead of against every indexed text. Band collisions
+    are verified on the full signatures against the threshold.
+    """
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, num_perm: int = DEFAULT_NUM_PERM):
+        self.threshold = threshold
+        self.bands, self.rows = lsh_bands(threshold, num_perm)
+        self._tables = [defaultdict(list) for _ in range(self.bands)]
+        self._signatures = {}
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def add(self, key: Hashable, signature: np.ndarray):
+        self._signatures[key] = signature
+        for table, band_key in zip(self._tables, self._band_keys(signature)):
+            table[band_key].append(key)
+
+    def query(self, signature: np.ndarray) -> List[Tuple[Hashable, float]]:
+        """(key, estimated similarity) of indexed texts at or above the threshold, most similar first"""
+        candidates = set()
+        for table, band_key in zip(self._tables, self._band_keys(signature)):
+            candidates.update(table.get(band_key, ()))
+        matches = [(key, similarity(signature, self._signatures[key])) for key in candidates]
+        return sorted([match for match in matches if match[1] >= self.threshold], key=lambda match: -match[1])
+
+
+def duplicate_clusters(texts: Sequence[str], threshold: float = DEFAULT_THRESHOLD,
+                       hasher: Optional[MinHasher] = None) -> List[List[int]]:
+    """
+    Groups of positions of near-duplicate texts (size 2 or more), each sorted,
+    largest group first. Groups are the connected components of the
+    near-duplicate pairs found through the LSH index.
+    """
+    hasher = hasher or MinHasher()
+    index = LshIndex(threshold, hasher.num_perm)
+    parent = list(range(len(texts)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, text in enumerate(texts):
+        signature = hasher.signature(text)
+        if signature is None:
+            continue
+        for j, _ in index.query(signature):
+            parent[find(i)] = find(j)
+        index.add(i, signature)
+
+    groups = defaultdict(list)
+    for i in range(len(texts)):
+        groups[find(i)].append(i)
+    return sorted((group for group in groups.values() if len(group) > 1), key=lambda group: (-len(group), group[0]))
+
+
+def collapse_pairs(pairs: Sequence[Tuple[str, str]], threshold: float = DEFAULT_THRESHOLD,
+                   hasher: Optional[MinHasher] = None) -> List[int]:
+    """
+    Position of the representative of each (reference, candidate) pair: the
+    first earlier pair whose reference and candidate are both near-duplicates
+    of this pair's, or the pair itself. Only representatives are indexed, so
+    every pair is within the threshold of its own representative.
+    """
+    hasher = hasher or MinHasher()
+    index = LshIndex(threshold, hasher.num_perm)
+    signatures = {}
+
+    def signature(text):
+        if text not in signatures:
+            signatures[text] = hasher.signature(text)
+        return signatures[text]
+
+    exact = {}
+    representatives = []
+    for i, (reference, candidate) in enumerate(pairs):
+        representative = exact.get((reference, candidate))
+        if representative is None:
+            reference_signature, candidate_signature = signature(reference), signature(candidate)
+            if reference_signature is not None and candidate_signature is not None:
+                for j, _ in index.query(candidate_signature):
+                    other = signature(pairs[j][0])
+                    if pairs[j][0] == reference or similarity(reference_signature, other) >= threshold:
+                        representative = j
+                        break
+                if representative is None:
+                    index.add(i, candidate_signature)
+        if representative is None:
+            representative = i
+            exact[(reference, candidate)] = i
+        representatives.append(representative)
+    return representatives
+
+
+def dataset_report(path: str, threshold: float = DEFAULT_THRESHOLD) -> Dict[str, object]:
+    """Near-duplicate clusters of each kind of text (question, answer, paragraph) of a dataset"""
+    if os.path.isdir(path):
+        dataset = CompiledDataset(path)
+        rows = [(dataset.kind(row), dataset.item(row), dataset.text(row)) for row in range(len(dataset))]
+    else:
+        rows = read_texts(path)
+    hasher = MinHasher()
+    report = {'source': path, 'threshold': threshold, 'kinds': {}}
+    for kind in sorted({kind for kind, _, _ in rows}):
+        texts = [(item, text) for row_kind, item, text in rows if row_kind == kind]
+        clusters = duplicate_clusters([text for _, text in texts], threshold, hasher)
+        report['kinds'][kind] = {
+            'texts': len(texts),
+            'clusters': len(clusters),
+            'duplicates': sum(len(cluster) - 1 for cluster in clusters),
+            'groups': [[{'item': texts[i][0], 'text': texts[i][1]} for i in cluster] for cluster in clusters],
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report near-duplicate questions, answers or paragraphs of datasets.')
+    parser.add_argument('sources', nargs='+', help='QA JSON datasets, paragraph text files or compiled dataset directories')
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='Estimated Jaccard similarity of word shingles')
+    parser.add_argument('--output', help='Write the clusters as JSON here')
+    args = parser.parse_args()
+
+    reports = [dataset_report(source, args.threshold) for source in args.sources]
+    for report in reports:
+        for kind, summary in report['kinds'].items():
+            print(f"{report['source']} {kind}s: {summary['texts']} texts, {summary['clusters']} near-duplicate clusters, "
+                  f"{summary['duplicates']} redundant")
+            for group in summary['groups'][:5]:
+                print(f"  items {', '.join(str(entry['item']) for entry in group)}: {group[0]['text'][:80]!r}")
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(reports, f, indent=2)
+        print(f"Clusters written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,215 @@
+import json
+import math
+import os
+import shutil
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+# Sentence padding used by nltk.lm.preprocessing.pad_both_ends
+LEFT_PAD = '<s>'
+RIGHT_PAD = '</s>'
+
+
+class NgramLanguageModel:
+    """
+    Array-backed Lidstone-smoothed n-gram model.
+
+    Equivalent to fitting nltk's Lidstone(order, gamma) (Laplace when gamma
+    is 1) on padded_everygram_pipeline output and calling perplexity() on
+    the everygrams of one padded test sentence, but n-grams are stored as
+    sorted int64 keys built from integer token IDs and looked up with
+    np.searchsorted. Log-probabilities are summed with math.fsum like nltk
+    so the perplexities are identical.
+
+    text_perplexity() instead scores every word of a text given its full
+    context, Witten-Bell interpolated down to the Lidstone unigram, which is
+    the sensible estimate for a model trained once on a large corpus. A
+    fitted model can be saved as .npy count tables and loaded back
+    memory-mapped, without fitting again.
+    """
+
+    def __init__(self, order: int, gamma: float):
+        self.order = order
+        self.gamma = gamma
+        self.vocab = {}
+        self.vocab_size = 0
+        self.base = 1
+        self.unk_id = 0
+        self.keys = {}
+        self.counts = {}
+        self.context_keys = {}
+        self.context_totals = {}
+        self.context_types = {}
+        self.unigram_total = 0
+
+    def _pad(self, tokens: Sequence[str]) -> List[str]:
+        return [LEFT_PAD] * (self.order - 1) + list(tokens) + [RIGHT_PAD] * (self.order - 1)
+
+    def _ngram_keys(self, ids: np.ndarray, k: int) -> np.ndarray:
+        """Keys of every k-gram of ids (one key per window)"""
+        if len(ids) < k:
+            return np.empty(0, dtype=np.int64)
+        windows = len(ids) - k + 1
+        keys = np.zeros(windows, dtype=np.int64)
+        for j in range(k):
+            keys = keys * self.base + ids[j:j + windows]
+        return keys
+
+    def fit(self, sentences: Sequence[Sequence[str]]) -> 'NgramLanguageModel':
+        """Fit on tokenized sentences (the input of padded_everygram_pipeline)"""
+        padded = [self._pad(sent) for sent in sentences]
+        self.vocab = {}
+        for sent in padded:
+            for word in sent:
+                self.vocab.setdefault(word, len(self.vocab))
+        if not self.vocab:
+            raise ValueError('Cannot fit an n-gram model on empty text.')
+        # nltk's Vocabulary counts <UNK> as one extra item
+        self.unk_id = len(self.vocab)
+        self.vocab_size = len(self.vocab) + 1
+        self.base = self.vocab_size
+        if self.base ** self.order >= 2 ** 63:
+            raise ValueError(f'Vocabulary of {self.vocab_size} words is too large for int64 {self.order}-gram keys.')
+
+        sentence_ids = [np.array([self.vocab[word] for word in sent], dtype=np.int64) for sent in padded]
+        for k in range(1, self.order + 1):
+            keys = np.concatenate([self._ngram_keys(ids, k) for ids in sentence_ids])
+            self.keys[k], self.counts[k] = np.unique(keys, return_counts=True)
+            if k > 1:
+                contexts, inverse = np.unique(self.keys[k] // self.base, return_inverse=True)
+                self.context_keys[k] = contexts
+                self.context_totals[k] = np.bincount(inverse, weights=self.counts[k]).astype(np.int64)
+                # Distinct words seen after each context, for Witten-Bell interpolation
+                self.context_types[k] = np.bincount(inverse).astype(np.int64)
+        self.unigram_total = int(self.counts[1].sum())
+        return self
+
+    @staticmethod
+    def _lookup(keys: np.ndarray, values: np.ndarray, queries: np.ndarray) -> np.ndarray:
+        if len(keys) == 0:
+            return np.zeros(len(queries), dtype=np.int64)
+        idx = np.searchsorted(keys, queries)
+        idx_clipped = np.minimum(idx, len(keys) - 1)
+        found = keys[idx_clipped] == queries
+        return np.where(found, values[idx_clipped], 0)
+
+    def _scores(self, test_sentences: Sequence[Sequence[str]]) -> List[List[float]]:
+        """Smoothed probability of every everygram of each padded test sentence"""
+        owners = {k: [] for k in range(1, self.order + 1)}
+        queries = {k: [] for k in range(1, self.order + 1)}
+        for owner, tokens in enumerate(test_sentences):
+            ids = np.array([self.vocab.get(word, self.unk_id) for word in self._pad(tokens)], dtype=np.int64)
+            for k in range(1, self.order + 1):
+                keys = self._ngram_keys(ids, k)
+                queries[k].append(keys)
+                owners[k].append(np.full(len(keys), owner, dtype=np.int64))
+
+        all_scores = []
+        all_owners = []
+        denominator_gamma = self.vocab_size * self.gamma
+        for k in range(1, self.order + 1):
+            keys = np.concatenate(queries[k])
+            word_counts = self._lookup(self.keys[k], self.counts[k], keys)
+            if k == 1:
+                norm_counts = np.full(len(keys), self.unigram_total, dtype=np.int64)
+            else:
+                norm_counts = self._lookup(self.context_keys[k], self.context_totals[k], keys // self.base)
+            scores = (word_counts.astype(np.float64) + self.gamma) / (norm_counts.astype(np.float64) + denominator_gamma)
+            all_scores.append(scores)
+            all_owners.append(np.concatenate(owners[k]))
+
+        scores = np.concatenate(all_scores)
+        owner_of = np.concatenate(all_owners)
+        order = np.argsort(owner_of, kind='stable')
+        bounds = np.searchsorted(owner_of[order], np.arange(len(test_sentences) + 1))
+
+        return [scores[order[bounds[i]:bounds[i + 1]]].tolist() for i in range(len(test_sentences))]
+
+    @staticmethod
+    def _perplexity(scores: List[float]) -> float:
+        # Same arithmetic as nltk LanguageModel.entropy/perplexity
+        entropy = -1 * (math.fsum(math.log(score, 2) for score in scores) / len(scores))
+        return pow(2.0, entropy)
+
+    def perplexities(self, test_sentences: Sequence[Sequence[str]]) -> List[float]:
+        """Perplexity of each tokenized test sentence, scored in one vectorized pass"""
+        return [self._perplexity(scores) for scores in self._scores(test_sentences)]
+
+    def perplexity(self, test_sentence: Sequence[str]) -> float:
+        return self.perplexities([test_sentence])[0]
+
+    def text_perplexity(self, test_sentences: Sequence[Sequence[str]]) -> float:
+        """
+        Perplexity of a whole text: every word and end padding of its padded
+        sentences scored given its order-1 preceding words, with
+        P(w|h) = (c(h, w) + T(h) * P(w|h')) / (c(h) + T(h)) where T(h) is the
+        number of distinct words seen after h, and P(w|h') for unseen h.
+        """
+        windows = [self._ngram_keys(np.array([self.vocab.get(word, self.unk_id) for word in self._pad(tokens)],
+                                             dtype=np.int64), self.order) for tokens in test_sentences]
+        keys = np.concatenate(windows) if windows else np.empty(0, dtype=np.int64)
+        if len(keys) == 0:
+            raise ValueError('Cannot compute the perplexity of empty text.')
+
+        words = keys % self.base
+        scores = (self._lookup(self.keys[1], self.counts[1], words).astype(np.float64) + self.gamma) / \
+            (self.unigram_total + self.vocab_size * self.gamma)
+        for k in range(2, self.order + 1):
+            suffixes = keys % (self.base ** k)
+            contexts = suffixes // self.base
+            counts = self._lookup(self.keys[k], self.counts[k], suffixes).astype(np.float64)
+            totals = self._lookup(self.context_keys[k], self.context_totals[k], contexts).astype(np.float64)
+            types = self._lookup(self.context_keys[k], self.context_types[k], contexts).astype(np.float64)
+            scores = np.where(totals > 0, (counts + types * scores) / np.maximum(totals + types, 1), scores)
+        return self._perplexity(scores.tolist())
+
+    def save(self, path: str):
+        """Write the count tables as .npy files plus meta.json under path (replaced atomically)"""
+        tmp_dir = path.rstrip(os.sep) + '.tmp'
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for k in self.keys:
+            np.save(os.path.join(tmp_dir, f'keys_{k}.npy'), self.keys[k])
+            np.save(os.path.join(tmp_dir, f'counts_{k}.npy'), self.counts[k])
+            if k > 1:
+                np.save(os.path.join(tmp_dir, f'context_keys_{k}.npy'), self.context_keys[k])
+                np.save(os.path.join(tmp_dir, f'context_totals_{k}.npy'), self.context_totals[k])
+                np.save(os.path.join(tmp_dir, f'context_types_{k}.npy'), self.context_types[k])
+        vocab = sorted(self.vocab, key=self.vocab.get)
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'order': self.order, 'gamma': self.gamma, 'unigram_total': self.unigram_total, 'vocab': vocab}, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_dir, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'NgramLanguageModel':
+        """Model saved by save(), with the count tables memory-mapped"""
+        with open(os.path.join(path, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        model = cls(meta['order'], meta['gamma'])
+        model.vocab = {word: i for i, word in enumerate(meta['vocab'])}
+        model.unk_id = len(model.vocab)
+        model.vocab_size = model.base = len(model.vocab) + 1
+        model.unigram_total = meta['unigram_total']
+        for k in range(1, model.order + 1):
+            model.keys[k] = np.load(os.path.join(path, f'keys_{k}.npy'), mmap_mode='r')
+            model.counts[k] = np.load(os.path.join(path, f'counts_{k}.npy'), mmap_mode='r')
+            if k > 1:
+                model.context_keys[k] = np.load(os.path.join(path, f'context_keys_{k}.npy'), mmap_mode='r')
+                model.context_totals[k] = np.load(os.path.join(path, f'context_totals_{k}.npy'), mmap_mode='r')
+                model.context_types[k] = np.load(os.path.join(path, f'context_types_{k}.npy'), mmap_mode='r')
+        return model
+
+    def stats(self) -> Dict[str, int]:
+        return {'vocab_size': self.vocab_size, **{f'{k}-grams': len(self.keys[k]) for k in self.keys}}
+
+
+def laplace_model(sentences: Sequence[Sequence[str]]) -> NgramLanguageModel:
+    """Bigram model with add-one smoothing, like nltk Laplace(2)"""
+    return NgramLanguageModel(order=2, gamma=1).fit(sentences)
+
+
+def lidstone_model(sentences: Sequence[Sequence[str]], gamma: float = 0.1) -> NgramLanguageModel:
+    """Trigram model with Lidstone smoothing, like nltk Lidstone(order=3, gamma=0.1)"""
+    return NgramLanguageModel(order=3, gamma=gamma).fit(sentences)
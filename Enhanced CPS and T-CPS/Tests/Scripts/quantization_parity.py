@@ -0,0 +1,122 @@
+import argparse
+import json
+import os
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from dataset_cache import CompiledDataset
+from encoder_registry import DEFAULT_MODEL_NAME, PRECISIONS, EncoderRegistry
+from metric_families import FAMILIES, FAMILY_FIELDS, PairContext
+from text_encoding import encode_texts
+
+# Families whose values depend on the encoder
+PARITY_FAMILIES = ['cosine', 'pearson', 'bertscore', 'brt']
+
+# EUDataset.json at the repository root, wherever the report is run from
+DEFAULT_DATASET = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'EUDataset.json'))
+
+
+def load_pairs(dataset_path: str, limit: int = 0) -> List[Tuple[str, str]]:
+    """
+    (reference, candidate) pairs for the report.
+
+    A QA dataset (question/answer items, like EUDataset.json) pairs every answer
+    with the answer of the next question, which is usually on the same topic. A
+    list of {reference, candidate} items, e.g. exported from a scoring run, is
+    used as it is. A compiled QA dataset (see dataset_cache) is read like the
+    QA JSON it was compiled from.
+    """
+    if os.path.isdir(dataset_path):
+        items = [{'answer': answer} for answer in CompiledDataset(dataset_path).texts('answer')]
+    else:
+        with open(dataset_path, 'r', encoding='utf-8') as f:
+            items = json.load(f)
+    if items and 'reference' in items[0]:
+        pairs = [(item['reference'], item['candidate']) for item in items]
+    else:
+        answers = [item['answer'] for item in items if item.get('answer')]
+        pairs = list(zip(answers, answers[1:] + answers[:1]))
+    return pairs[:limit] if limit else pairs
+
+
+def score_pairs(registry: EncoderRegistry, pairs: List[Tuple[str, str]], batch_size: int) -> Tuple[Dict[str, List[float]], float]:
+    """Encoder-dependent metric values of every pair, plus the seconds spent in BERT"""
+    tokenizer, model = registry.get()
+    texts = [text for reference, candidate in pairs
+             for text in (reference, candidate, f"Reference: {reference} Candidate: {candidate}")]
+    start = time.perf_counter()
+    encodings = encode_texts(texts, tokenizer, model, batch_size=batch_size)
+    encode_seconds = time.perf_counter() - start
+
+    values = {field: [] for name in PARITY_FAMILIES for field in FAMILY_FIELDS[name]}
+    for i, (reference, candidate) in enumerate(pairs):
+        ctx = PairContext(reference, candidate, *encodings[3 * i:3 * i + 3])
+        for name in PARITY_FAMILIES:
+            for field, value in FAMILIES[name](ctx).items():
+                values[field].append(float(value))
+    return values, encode_seconds
+
+
+def parity_report(model_name: str, precision: str, pairs: List[Tuple[str, str]], batch_size: int = 16) -> Dict:
+    """Compare the embedding metrics of a reduced-precision encoder with fp32"""
+    baseline = EncoderRegistry(model_name, 'fp32')
+    reduced = EncoderRegistry(model_name, precision)
+    expected, baseline_seconds = score_pairs(baseline, pairs, batch_size)
+    actual, reduced_seconds = score_pairs(reduced, pairs, batch_size)
+
+    metrics = {}
+    for field in expected:
+        a = np.array(expected[field])
+        b = np.array(actual[field])
+        diff = np.abs(a - b)
+        metrics[field] = {
+            'max_abs_diff': float(diff.max()),
+            'mean_abs_diff': float(diff.mean()),
+            'max_rel_diff': float((diff / np.maximum(np.abs(a), 1e-12)).max()),
+            # Whether the reduced encoder ranks the pairs like fp32 does
+            'correlation': float(np.corrcoef(a, b)[0, 1]) if len(a) > 1 and a.std() > 0 and b.std() > 0 else None,
+        }
+    return {
+        'model': model_name,
+        'precision': precision,
+        'pairs': len(pairs),
+        'fp32_encode_seconds': baseline_seconds,
+        'encode_seconds': reduced_seconds,
+        'speedup': baseline_seconds / reduced_seconds if reduced_seconds > 0 else None,
+        'metrics': metrics,
+    }
+
+
+def print_report(report: Dict):
+    print(f"\n{report['model']}: {report['precision']} vs fp32 on {report['pairs']} pairs")
+    print(f"BERT time: fp32 {report['fp32_encode_seconds']:.2f}s, "
+          f"{report['precision']} {report['encode_seconds']:.2f}s (speedup {report['speedup']:.2f}x)")
+    print(f"{'Metric':<24}{'max abs':>12}{'mean abs':>12}{'max rel':>12}{'corr':>10}")
+    for field, m in report['metrics'].items():
+        corr = f"{m['correlation']:.5f}" if m['correlation'] is not None else 'n/a'
+        print(f"{field:<24}{m['max_abs_diff']:>12.6f}{m['mean_abs_diff']:>12.6f}{m['max_rel_diff']:>12.4%}{corr:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parity report of a reduced-precision BERT encoder against fp32.')
+    parser.add_argument('dataset', nargs='?', default=DEFAULT_DATASET,
+                        help='QA JSON dataset or compiled dataset directory, or a list of {reference, candidate} items')
+    parser.add_argument('--model', default=DEFAULT_MODEL_NAME, help='Encoder name or path')
+    parser.add_argument('--precision', default='int8', choices=[p for p in PRECISIONS if p != 'fp32'])
+    parser.add_argument('--batch-size', type=int, default=16, help='Texts per BERT forward pass')
+    parser.add_argument('--limit', type=int, default=0, help='Only use the first N pairs')
+    parser.add_argument('--output', help='Also write the report as JSON to this file')
+    args = parser.parse_args()
+
+    report = parity_report(args.model, args.precision, load_pairs(args.dataset, args.limit), args.batch_size)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
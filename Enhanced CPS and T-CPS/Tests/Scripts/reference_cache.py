@@ -0,0 +1,231 @@
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, Optional
+
+from dataset_cache import find_compiled
+from encoder_registry import get_registry
+from ngram_perplexity import NgramLanguageModel, laplace_model, lidstone_model
+from text_analysis import TextAnalysis
+
+# nltk and torch are imported by the components that need them, so a lexical
+# deployment never loads torch and a cache lookup never loads nltk
+if TYPE_CHECKING:
+    from text_encoding import TextEncoding
+
+# Directory written by the precompute step; empty keeps the cache in memory only
+DEFAULT_CACHE_DIR = os.environ.get('PASSER_REFERENCE_CACHE_DIR', '')
+DEFAULT_CACHE_SIZE = int(os.environ.get('PASSER_REFERENCE_CACHE_SIZE', 1024))
+
+# Bumped whenever the stored components change shape; older files are only partly reused
+CACHE_FORMAT = 2
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ReferenceEntry:
+    """
+    Everything the metrics derive from a reference answer alone.
+
+    Components are computed on first use and kept: the TextAnalysis of the
+    reference (tokens, sentences, n-grams), the Laplace bigram and Lidstone
+    trigram count tables, and the BERT encoding (tied to the encoder name).
+    """
+
+    def __init__(self, text: str, analysis: Optional[TextAnalysis] = None):
+        self.text = text
+        self.key = text_hash(text)
+        self.analysis = analysis or TextAnalysis(text)
+        self._values = {}
+        self._locks = {name: threading.Lock() for name in ('laplace', 'lidstone', 'encoding')}
+
+    def _get(self, name, build):
+        with self._locks[name]:
+            if name not in self._values:
+                self._values[name] = build()
+            return self._values[name]
+
+    def laplace_model(self) -> NgramLanguageModel:
+        return self._get('laplace', lambda: laplace_model(self.analysis.sentences))
+
+    def lidstone_model(self) -> NgramLanguageModel:
+        return self._get('lidstone', lambda: lidstone_model(self.analysis.sentences))
+
+    def encoding(self) -> 'TextEncoding':
+        from embedding_store import encode_stored
+
+        return self._get('encoding', lambda: encode_stored(self.text))
+
+    def has_encoding(self) -> bool:
+        return 'encoding' in self._values
+
+    def set_encoding(self, encoding: 'TextEncoding'):
+        with self._locks['encoding']:
+            self._values['encoding'] = encoding
+
+    def compute_all(self):
+        self.laplace_model()
+        self.lidstone_model()
+
+    def to_state(self, encoder_name: str) -> dict:
+        state = {'text': self.text, 'encoder': encoder_name, 'format': CACHE_FORMAT,
+                 'split': self.analysis.split, 'sentences': self.analysis.sentences}
+        for name in ('laplace', 'lidstone'):
+            if name in self._values:
+                state[name] = self._values[name]
+        if self.has_encoding():
+            state['encoding'] = self._values['encoding'].last_hidden_state.numpy()
+        return state
+
+    @classmethod
+    def from_state(cls, state: dict, encoder_name: str) -> 'ReferenceEntry':
+        entry = cls(state['text'], TextAnalysis(state['text'], state.get('split'), state.get('sentences')))
+        if state.get('format') == CACHE_FORMAT:
+            for name in ('laplace', 'lidstone'):
+                if name in state:
+                    entry._values[name] = state[name]
+        # Embeddings from another encoder are dropped and recomputed on demand
+        if 'encoding' in state and state.get('encoder') == encoder_name:
+            import torch
+            from text_encoding import TextEncoding
+
+            entry._values['encoding'] = TextEncoding(state['text'], torch.from_numpy(state['encoding']))
+        return entry
+
+    @classmethod
+    def from_compiled(cls, text: str) -> Optional['ReferenceEntry']:
+        """Entry with the tokenizations of a compiled dataset row, or None if no dataset holds text"""
+        found = find_compiled(text)
+        if found is None:
+            return None
+        dataset, row = found
+        return cls(text, TextAnalysis(text, dataset.split(row), dataset.sentences(row)))
+
+
+class ReferenceCache:
+    """
+    LRU cache of ReferenceEntry objects keyed by the reference content hash,
+    backed by the pickles written by the precompute step. References found in
+    a compiled dataset (see dataset_cache) start with their tokenizations.
+    """
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, max_entries: int = DEFAULT_CACHE_SIZE):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.compiled = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f'{key}.pkl')
+
+    def get(self, reference: str) -> ReferenceEntry:
+        key = text_hash(reference)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+        entry = self._load(key)
+        compiled = None
+        if entry is None:
+            compiled = ReferenceEntry.from_compiled(reference)
+        with self._lock:
+            if entry is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                if compiled is not None:
+                    self.compiled += 1
+                entry = compiled or ReferenceEntry(reference)
+            # Another thread may have inserted the same reference meanwhile
+            entry = self._entries.setdefault(key, entry)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def _load(self, key: str) -> Optional[ReferenceEntry]:
+        if not self.cache_dir:
+            return None
+        path = self._path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                return ReferenceEntry.from_state(pickle.load(f), get_registry().variant)
+        except Exception as e:
+            print(f"Error loading reference cache entry {path}: {e}")
+            return None
+
+    def save(self, entry: ReferenceEntry):
+        if not self.cache_dir:
+            raise ValueError('No reference cache directory configured.')
+        path = self._path(entry.key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(entry.to_state(get_registry().variant), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses, 'compiled': self.compiled}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_reference_cache() -> ReferenceCache:
+    """Return the process-wide reference cache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ReferenceCache()
+        return _cache
+
+
+def precompute_dataset(dataset_path: str, cache: ReferenceCache, batch_size: int = 16) -> int:
+    """Compute and store the reference side of every answer in a QA JSON dataset"""
+    from text_encoding import encode_texts
+
+    with open(dataset_path, 'r', encoding='utf-8') as f:
+        qa_pairs = json.load(f)
+    references = list(OrderedDict.fromkeys(qa['answer'] for qa in qa_pairs if qa.get('answer')))
+    print(f"Precomputing {len(references)} unique references from {dataset_path}")
+
+    tokenizer, model = get_registry().get()
+    encodings = encode_texts(references, tokenizer, model, batch_size=batch_size)
+    for reference, encoding in zip(references, encodings):
+        entry = cache.get(reference)
+        entry.compute_all()
+        entry.set_encoding(encoding)
+        cache.save(entry)
+    print(f"Stored {len(references)} references in {cache.cache_dir}")
+    return len(references)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Precompute the reference side of a QA dataset for the metrics backend.')
+    parser.add_argument('datasets', nargs='+', help='QA JSON files with question/answer pairs')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR or 'reference_cache',
+                        help='Output directory (point PASSER_REFERENCE_CACHE_DIR at it when serving)')
+    parser.add_argument('--batch-size', type=int, default=16, help='Texts per BERT forward pass')
+    args = parser.parse_args()
+
+    cache = ReferenceCache(cache_dir=args.cache_dir)
+    total = sum(precompute_dataset(path, cache, args.batch_size) for path in args.datasets)
+    print(f"Done: {total} references")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from encoder_registry import get_registry
+from metric_families import METRICS_VERSION
+
+DEFAULT_CACHE_SIZE = int(os.environ.get('PASSER_RESULT_CACHE_SIZE', 10000))
+# SQLite file of the persistent layer; empty keeps results in memory only
+DEFAULT_CACHE_DB = os.environ.get('PASSER_RESULT_CACHE_DB', '')
+
+
+def result_key(reference: str, candidate: str, families: List[str]) -> str:
+    """
+    Hash of everything a results vector depends on: the two texts, the metric
+    families that were run, the metric definitions, the encoder variant and
+    the BERTScore IDF table, if one is used.
+    """
+    parts = [reference, candidate, sorted(families), METRICS_VERSION, get_registry().variant]
+    if 'bertscore' in families:
+        from bertscore_engine import get_bertscore_engine
+
+        variant = get_bertscore_engine().variant
+        if variant is not None:
+            parts.append(variant)
+    return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()
+
+
+class ResultCache:
+    """
+    Cache of computed results vectors keyed by result_key().
+
+    An in-memory LRU layer sits in front of an optional SQLite layer that
+    survives restarts and can be shared by several worker processes.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_CACHE_SIZE, db_path: str = DEFAULT_CACHE_DB):
+        self.max_entries = max_entries
+        self.db_path = db_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if db_path:
+            with self._lock, self._connection:
+                self._connection.execute(
+                    "CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, results TEXT, created_at REAL)"
+                )
+
+    @property
+    def _connection(self) -> sqlite3.Connection:
+        # SQLite connections must not cross fork(), so every process opens its own
+        if self._pid != os.getpid():
+            self._conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=30)
+            self._pid = os.getpid()
+        return self._conn
+
+    def _remember(self, key: str, res: List[float]):
+        self._entries[key] = res
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, key: str) -> Optional[List[float]]:
+        with self._lock:
+            res = self._entries.get(key)
+            if res is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return list(res)
+            if self.db_path:
+                row = self._connection.execute("SELECT results FROM results WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    res = json.loads(row[0])
+                    self._remember(key, res)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return list(res)
+            self.misses += 1
+            return None
+
+    def put(self, key: str, res: List[float]):
+        res = [float(x) for x in res]
+        with self._lock:
+            self._remember(key, res)
+            if self.db_path:
+                with self._connection:
+                    self._connection.execute(
+                        "INSERT OR REPLACE INTO results VALUES (?, ?, ?)", (key, json.dumps(res), time.time())
+                    )
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache() -> ResultCache:
+    """Return the process-wide result cache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+        return _cache
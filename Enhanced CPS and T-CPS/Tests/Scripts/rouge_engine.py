@@ -0,0 +1,163 @@
+import threading
+from typing import Dict, List, Sequence, Tuple, Union
+
+from text_analysis import TextAnalysis
+
+
+class TokenInterner:
+    """
+    Word -> integer ID table so comparisons are int compares. IDs only have
+    to agree within one scored pair, so each pair gets its own table and
+    the vocabulary of past candidates is not kept.
+    """
+
+    def __init__(self):
+        self._ids = {}
+
+    def ids(self, words: Sequence[str]) -> List[int]:
+        table = self._ids
+        for word in words:
+            if word not in table:
+                table[word] = len(table)
+        return [table[word] for word in words]
+
+    def __len__(self):
+        return len(self._ids)
+
+
+def _popcount(x: int) -> int:
+    return bin(x).count('1')
+
+
+class _BitParallelSequence:
+    """Match masks of one word sequence y: bit j of masks[w] is set when y[j] == w"""
+
+    def __init__(self, y: List[int]):
+        self.length = len(y)
+        self.all_ones = (1 << self.length) - 1
+        self.masks = {}
+        for j, word in enumerate(y):
+            self.masks[word] = self.masks.get(word, 0) | (1 << j)
+
+    def rows(self, x: List[int]) -> List[int]:
+        """
+        Bit-parallel LCS rows (Allison-Dix/Hyyrö): after processing x[:i],
+        bit j of rows[i] is clear when LCS(x[:i], y[:j+1]) > LCS(x[:i], y[:j]).
+        """
+        v = self.all_ones
+        rows = [v]
+        for word in x:
+            u = v & self.masks.get(word, 0)
+            v = ((v + u) | (v - u)) & self.all_ones
+            rows.append(v)
+        return rows
+
+    def prefix_lcs(self, row: int, j: int) -> int:
+        """LCS(x[:i], y[:j]) for the row of x[:i]"""
+        return _popcount(~row & ((1 << j) - 1))
+
+
+def recon_lcs_words(x: List[int], y_seq: _BitParallelSequence, y: List[int]) -> List[int]:
+    """
+    Words of the LCS of x and y, reconstructed along the same path as
+    rouge.rouge_score._recon_lcs (diagonal on a match, otherwise up when the
+    upper cell is strictly larger, else left), so the chosen LCS is the same.
+    """
+    rows = y_seq.rows(x)
+    i, j = len(x), len(y)
+    words = []
+    while i > 0 and j > 0:
+        if x[i - 1] == y[j - 1]:
+            words.append(x[i - 1])
+            i -= 1
+            j -= 1
+        elif y_seq.prefix_lcs(rows[i - 1], j) > y_seq.prefix_lcs(rows[i], j - 1):
+            i -= 1
+        else:
+            j -= 1
+    return words
+
+
+def lcs_length(x: List[int], y: List[int]) -> int:
+    """Length of the longest common subsequence of two ID sequences"""
+    seq = _BitParallelSequence(y)
+    return seq.prefix_lcs(seq.rows(x)[-1], len(y))
+
+
+def rouge_values(evaluated_count: int, reference_count: int, overlapping_count: int) -> Dict[str, float]:
+    # Same edge-case handling as rouge.rouge_score.f_r_p_rouge_n
+    precision = 0.0 if evaluated_count == 0 else overlapping_count / evaluated_count
+    recall = 0.0 if reference_count == 0 else overlapping_count / reference_count
+    f1_score = 2.0 * ((precision * recall) / (precision + recall + 1e-8))
+    return {"f": f1_score, "p": precision, "r": recall}
+
+
+class RougeEngine:
+    """
+    Drop-in replacement for rouge.Rouge().get_scores with the default
+    settings (ROUGE-1, ROUGE-2 and summary-level ROUGE-L, exclusive
+    n-gram sets). Texts are split into sentences on '.' exactly like the
+    rouge package, words are interned to integer IDs, and ROUGE-L uses a
+    bit-parallel LCS instead of the quadratic dictionary DP.
+    """
+
+    def counts_analyses(self, hyp: TextAnalysis, ref: TextAnalysis) -> Dict[str, Tuple[int, int, int]]:
+        """
+        (evaluated, reference, overlapping) counts behind each score: n-grams for
+        ROUGE-1/2, distinct words and LCS union words for ROUGE-L. Summing them
+        over many pairs gives micro-averaged (corpus) scores.
+        """
+        if len(hyp.rouge_sentences) <= 0:
+            raise ValueError("Hypothesis is empty.")
+        if len(ref.rouge_sentences) <= 0:
+            raise ValueError("Reference is empty.")
+
+        counts = {}
+        for n in (1, 2):
+            evaluated = hyp.rouge_ngrams(n)
+            reference = ref.rouge_ngrams(n)
+            counts[f'rouge-{n}'] = (len(evaluated), len(reference), len(evaluated & reference))
+
+        interner = TokenInterner()
+        hyp_sentences = [interner.ids(sentence) for sentence in hyp.rouge_sentences]
+        ref_sentences = [interner.ids(sentence) for sentence in ref.rouge_sentences]
+        hyp_words = [word for sentence in hyp_sentences for word in sentence]
+        ref_words = [word for sentence in ref_sentences for word in sentence]
+
+        # Summary-level ROUGE-L: union of the LCS words of every (reference, hypothesis) sentence pair
+        m = len(set(ref_words))
+        n = len(set(hyp_words))
+        hyp_sequences = [(_BitParallelSequence(sentence), sentence) for sentence in hyp_sentences]
+        union = set()
+        for ref_sentence in ref_sentences:
+            for hyp_seq, hyp_sentence in hyp_sequences:
+                union.update(recon_lcs_words(ref_sentence, hyp_seq, hyp_sentence))
+        counts['rouge-l'] = (n, m, len(union))
+        return counts
+
+    def score_analyses(self, hyp: TextAnalysis, ref: TextAnalysis) -> Dict[str, Dict[str, float]]:
+        """Scores of two texts from their (shared, cached) sentence splits and n-gram sets"""
+        return {key: rouge_values(*counts) for key, counts in self.counts_analyses(hyp, ref).items()}
+
+    def score(self, hyp: str, ref: str) -> Dict[str, Dict[str, float]]:
+        return self.score_analyses(TextAnalysis(hyp), TextAnalysis(ref))
+
+    def get_scores(self, hyps: Union[str, Sequence[str]], refs: Union[str, Sequence[str]]) -> List[Dict[str, Dict[str, float]]]:
+        """Same call shape and result layout as rouge.Rouge().get_scores"""
+        if isinstance(hyps, str):
+            hyps, refs = [hyps], [refs]
+        assert len(hyps) == len(refs)
+        return [self.score(hyp, ref) for hyp, ref in zip(hyps, refs)]
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_rouge_engine() -> RougeEngine:
+    """Return the process-wide ROUGE engine"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = RougeEngine()
+        return _engine
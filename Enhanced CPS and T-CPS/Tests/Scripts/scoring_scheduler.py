@@ -0,0 +1,265 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Dict, Hashable, Iterable
+
+# Requests or batch chunks scored at the same time per process; interactive work may
+# use all slots, bulk work all but BULK_RESERVED of them
+DEFAULT_SLOTS = int(os.environ.get('PASSER_SCORING_SLOTS', 4))
+# Slots kept free of bulk work so one-off checks never wait behind batches
+DEFAULT_BULK_RESERVED = int(os.environ.get('PASSER_BULK_RESERVED', 1))
+# Waiting requests per class beyond which new ones are turned away with 429
+DEFAULT_INTERACTIVE_QUEUE = int(os.environ.get('PASSER_INTERACTIVE_QUEUE', 32))
+DEFAULT_BULK_QUEUE = int(os.environ.get('PASSER_BULK_QUEUE', 8))
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+
+# Weight of the latest hold time in the per-class moving average behind Retry-After
+HOLD_SMOOTHING = 0.2
+
+# Ticket of the slot the current thread holds, for hold_until_done
+_current = threading.local()
+
+
+class Overloaded(Exception):
+    """Raised when a priority class has no room left; retry_after is in whole seconds"""
+
+    def __init__(self, priority: str, retry_after: int):
+        super().__init__(f'Too many {priority} scoring requests waiting, retry in {retry_after} s.')
+        self.priority = priority
+        self.retry_after = retry_after
+
+
+class FairQueue:
+    """
+    Round-robin queue over flows.
+
+    Items are kept in one FIFO per flow key and get() takes the head of the
+    next flow in turn, so a flow with hundreds of items waiting gets one
+    item out per round like a flow with one. Flows leave the rotation when
+    they are empty. Not synchronized; callers hold their own lock.
+    """
+
+    def __init__(self):
+        self._flows = OrderedDict()
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def put(self, flow: Hashable, item):
+        self._flows.setdefault(flow, deque()).append(item)
+        self._size += 1
+
+    def get(self):
+        """Head of the next flow in turn; raises IndexError when empty"""
+        flow, items = next(iter(self._flows.items()))
+        item = items.popleft()
+        # The flow goes to the back of the rotation, or out of it
+        del self._flows[flow]
+        if items:
+            self._flows[flow] = items
+        self._size -= 1
+        return item
+
+    def remove(self, flow: Hashable, item) -> bool:
+        items = self._flows.get(flow)
+        if items is None or item not in items:
+            return False
+        items.remove(item)
+        if not items:
+            del self._flows[flow]
+        self._size -= 1
+        return True
+
+    def flows(self) -> Dict[Hashable, int]:
+        return {flow: len(items) for flow, items in self._flows.items()}
+
+
+class _Ticket:
+    __slots__ = ('priority', 'flow', 'granted', 'lingering')
+
+    def __init__(self, priority: str, flow: Hashable):
+        self.priority = priority
+        self.flow = flow
+        self.granted = False
+        self.lingering = []
+
+
+def hold_until_done(futures: Iterable):
+    """
+    Keep the slot the current thread holds taken until these futures are done,
+    even after its block exits: work a request left running in the background
+    (metric lanes past a deadline) still occupies a thread, and the slot's
+    hold time is measured to when it finishes. Does nothing outside a slot.
+    """
+    ticket = getattr(_current, 'ticket', None)
+    if ticket is not None:
+        ticket.lingering += [future for future in futures if not future.done()]
+
+
+class ScoringScheduler:
+    """
+    Admission of scoring work into a fixed number of slots, by priority class.
+
+    Interactive work (/metrics) always goes first when a slot frees up and
+    may take every slot. Bulk work (/metrics/batch and queued jobs) takes a
+    slot per chunk of items and never holds the last bulk_reserved slots, so
+    a one-off check never waits behind batches. Waiting bulk chunks are
+    served round-robin by flow (userID, testID), so a long test run shares
+    the bulk slots evenly with every other run instead of holding them until
+    it is done.
+
+    Each class has a bounded wait queue. A request that would go past it is
+    refused with Overloaded carrying a Retry-After estimate from the queue
+    length and the recent slot hold times. Chunks of a batch that was
+    already admitted wait regardless (admit=False), so accepted work is not
+    thrown away halfway. Limits are per process.
+
+    Work a slot's block leaves running in the background (hold_until_done)
+    keeps the slot taken until it finishes.
+    """
+
+    def __init__(self, slots: int = DEFAULT_SLOTS, bulk_reserved: int = DEFAULT_BULK_RESERVED,
+                 interactive_queue: int = DEFAULT_INTERACTIVE_QUEUE, bulk_queue: int = DEFAULT_BULK_QUEUE):
+        self.slots = max(1, slots)
+        self.bulk_slots = max(1, self.slots - bulk_reserved)
+        self.queue_limits = {INTERACTIVE: interactive_queue, BULK: bulk_queue}
+        self._cond = threading.Condition()
+        self._interactive = deque()
+        self._bulk = FairQueue()
+        self._running = {INTERACTIVE: 0, BULK: 0}
+        self._hold_seconds = {INTERACTIVE: None, BULK: None}
+        self._served = {INTERACTIVE: 0, BULK: 0}
+        self._rejected = {INTERACTIVE: 0, BULK: 0}
+
+    def _waiting(self, priority: str) -> int:
+        return len(self._interactive) if priority == INTERACTIVE else len(self._bulk)
+
+    def _dispatch(self):
+        granted = False
+        while self._running[INTERACTIVE] + self._running[BULK] < self.slots:
+            if self._interactive:
+                ticket = self._interactive.popleft()
+            elif self._bulk and self._running[BULK] < self.bulk_slots:
+                ticket = self._bulk.get()
+            else:
+                break
+            ticket.granted = True
+            self._running[ticket.priority] += 1
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def _check_admission(self, priority: str):
+        if self._waiting(priority) >= self.queue_limits[priority]:
+            self._rejected[priority] += 1
+            # Seconds until the waiting work of the class is expected to be through its slots
+            hold = self._hold_seconds[priority] or 1.0
+            slots = self.slots if priority == INTERACTIVE else self.bulk_slots
+            raise Overloaded(priority, max(1, math.ceil((self._waiting(priority) + 1) * hold / slots)))
+
+    def admit(self, priority: str):
+        """
+        Raises Overloaded when the wait queue of the priority class is full.
+        Lets a batch be turned away before any of its work is done, after
+        which its chunks take slots with admit=False.
+        """
+        with self._cond:
+            self._check_admission(priority)
+
+    @contextmanager
+    def slot(self, priority: str, flow: Hashable = None, admit: bool = True):
+        """
+        Hold a scoring slot of the priority class for the duration of the block.
+        With admit, raises Overloaded instead of waiting when the class's queue is full.
+        """
+        ticket = _Ticket(priority, flow)
+        with self._cond:
+            if admit:
+                self._check_admission(priority)
+            if priority == INTERACTIVE:
+                self._interactive.append(ticket)
+            else:
+                self._bulk.put(flow, ticket)
+            self._dispatch()
+            try:
+                while not ticket.granted:
+                    self._cond.wait()
+            except BaseException:
+                # Interrupted while waiting: give the slot back or leave the queue
+                if ticket.granted:
+                    self._running[priority] -= 1
+                    self._dispatch()
+                elif priority == INTERACTIVE:
+                    self._interactive.remove(ticket)
+                else:
+                    self._bulk.remove(flow, ticket)
+                raise
+        start = time.perf_counter()
+        outer, _current.ticket = getattr(_current, 'ticket', None), ticket
+        try:
+            yield
+        finally:
+            _current.ticket = outer
+            self._release_when_done(ticket, start)
+
+    def _release_when_done(self, ticket: _Ticket, start: float):
+        lingering = [future for future in ticket.lingering if not future.done()]
+        if not lingering:
+            self._release(ticket, start)
+            return
+        remaining = [len(lingering)]
+
+        def done(_):
+            with self._cond:
+                remaining[0] -= 1
+                if remaining[0]:
+                    return
+            self._release(ticket, start)
+
+        for future in lingering:
+            future.add_done_callback(done)
+
+    def _release(self, ticket: _Ticket, start: float):
+        hold = time.perf_counter() - start
+        with self._cond:
+            self._running[ticket.priority] -= 1
+            self._served[ticket.priority] += 1
+            average = self._hold_seconds[ticket.priority]
+            self._hold_seconds[ticket.priority] = hold if average is None else \
+                (1 - HOLD_SMOOTHING) * average + HOLD_SMOOTHING * hold
+            self._dispatch()
+
+    def stats(self) -> Dict[str, object]:
+        with self._cond:
+            return {
+                'slots': self.slots,
+                'bulk_slots': self.bulk_slots,
+                'running': dict(self._running),
+                'waiting': {INTERACTIVE: len(self._interactive), BULK: len(self._bulk)},
+                'bulk_flows': {'/'.join(map(str, flow)) if isinstance(flow, tuple) else str(flow): count
+                               for flow, count in self._bulk.flows().items()},
+                'queue_limits': dict(self.queue_limits),
+                'served': dict(self._served),
+                'rejected': dict(self._rejected),
+                'hold_seconds': {priority: round(seconds, 4) if seconds is not None else None
+                                 for priority, seconds in self._hold_seconds.items()},
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> ScoringScheduler:
+    """Return the process-wide scoring scheduler, configured from the PASSER_* variables"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = ScoringScheduler()
+        return _scheduler
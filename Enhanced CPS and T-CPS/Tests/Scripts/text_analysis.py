@@ -0,0 +1,102 @@
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+
+def sentence_tokens(text: str) -> List[List[str]]:
+    """Lowercased word tokens per sentence, the training data of both n-gram models"""
+    import nltk
+    from nltk.tokenize import word_tokenize
+
+    return [list(map(str.lower, word_tokenize(sent))) for sent in nltk.sent_tokenize(text)]
+
+
+class TextAnalysis:
+    """
+    Tokenizations of one text, each computed on first use and kept.
+
+    Every lexical metric reads its tokens from here instead of splitting or
+    tokenizing the raw string itself, so within a request (and, for
+    references, across requests) each text is tokenized once per scheme:
+
+    - split: whitespace tokens (METEOR, BLEU)
+    - ngram_counts: counts of the n-grams of the whitespace tokens (BLEU)
+    - lower_counts: counts of the lowercased whitespace tokens (F1)
+    - words: word tokens of the lowercased text (Laplace perplexity)
+    - sentences: lowercased word tokens per sentence (n-gram model training
+      and the Lidstone perplexity)
+    - rouge_sentences / rouge_ngrams: the '.'-separated sentences of the
+      rouge package and the set of n-grams over all of their words
+
+    Values are computed without locking: two threads that race on the same
+    attribute compute the same value and one of them is kept.
+    """
+
+    __slots__ = ('text', '_split', '_ngram_counts', '_lower_split', '_lower_counts', '_words', '_sentences',
+                 '_rouge_sentences', '_rouge_ngrams')
+
+    def __init__(self, text: str, split: Optional[List[str]] = None,
+                 sentences: Optional[List[List[str]]] = None):
+        self.text = text
+        self._split = split
+        self._ngram_counts = {}
+        self._lower_split = None
+        self._lower_counts = None
+        self._words = None
+        self._sentences = sentences
+        self._rouge_sentences = None
+        self._rouge_ngrams = {}
+
+    @property
+    def split(self) -> List[str]:
+        if self._split is None:
+            self._split = self.text.split()
+        return self._split
+
+    def ngram_counts(self, n: int) -> Dict[Tuple[str, ...], int]:
+        counts = self._ngram_counts.get(n)
+        if counts is None:
+            tokens = self.split
+            counts = Counter(zip(*[tokens[k:] for k in range(n)]))
+            self._ngram_counts[n] = counts
+        return counts
+
+    @property
+    def lower_split(self) -> List[str]:
+        if self._lower_split is None:
+            self._lower_split = self.text.strip().lower().split()
+        return self._lower_split
+
+    @property
+    def lower_counts(self) -> Counter:
+        if self._lower_counts is None:
+            self._lower_counts = Counter(self.lower_split)
+        return self._lower_counts
+
+    @property
+    def words(self) -> List[str]:
+        if self._words is None:
+            from nltk.tokenize import word_tokenize
+
+            self._words = word_tokenize(self.text.lower())
+        return self._words
+
+    @property
+    def sentences(self) -> List[List[str]]:
+        if self._sentences is None:
+            self._sentences = sentence_tokens(self.text)
+        return self._sentences
+
+    @property
+    def rouge_sentences(self) -> List[List[str]]:
+        if self._rouge_sentences is None:
+            # Same sentence split and whitespace normalization as the rouge package
+            self._rouge_sentences = [" ".join(_.split()).split(" ") for _ in self.text.split(".") if len(_) > 0]
+        return self._rouge_sentences
+
+    def rouge_ngrams(self, n: int) -> Set[Tuple[str, ...]]:
+        ngrams = self._rouge_ngrams.get(n)
+        if ngrams is None:
+            words = [word for sentence in self.rouge_sentences for word in sentence]
+            ngrams = set(zip(*[words[k:] for k in range(n)]))
+            self._rouge_ngrams[n] = ngrams
+        return ngrams
@@ -0,0 +1,99 @@
+from typing import Dict, List
+
+import torch
+
+from dataset_cache import compiled_wordpiece_ids
+
+
+class TextEncoding:
+    """
+    BERT encoding of a single text.
+
+    The forward pass is run once and the views used by the different
+    embedding metrics (CLS, mean-pooled, token-level) are derived from the
+    same last_hidden_state, shaped (1, num_tokens, hidden_size).
+    """
+
+    def __init__(self, text: str, last_hidden_state: torch.Tensor):
+        self.text = text
+        self.last_hidden_state = last_hidden_state
+
+    @property
+    def cls(self) -> torch.Tensor:
+        """[CLS] token embedding, shape (1, hidden_size)"""
+        return self.last_hidden_state[:, 0, :]
+
+    @property
+    def mean(self) -> torch.Tensor:
+        """Mean-pooled embedding over all tokens, shape (1, hidden_size)"""
+        return self.last_hidden_state.mean(dim=1)
+
+    @property
+    def tokens(self) -> torch.Tensor:
+        """Token-level embeddings, shape (1, num_tokens, hidden_size)"""
+        return self.last_hidden_state
+
+    @property
+    def num_tokens(self) -> int:
+        return self.last_hidden_state.shape[1]
+
+
+def wordpiece_ids(text: str, tokenizer) -> List[int]:
+    """Model input IDs of text ([CLS] ... [SEP], truncated like the forward passes)"""
+    ids = compiled_wordpiece_ids(text, tokenizer.name_or_path)
+    if ids is None:
+        ids = tokenizer(text, truncation=True, max_length=512)['input_ids']
+    return ids
+
+
+def tokenize_texts(texts: List[str], tokenizer) -> Dict[str, torch.Tensor]:
+    """
+    Padded model inputs for texts. WordPiece IDs of texts held by a dataset
+    compiled with the same tokenizer are read from it instead of tokenizing;
+    the inputs are the same either way.
+    """
+    ids = [compiled_wordpiece_ids(text, tokenizer.name_or_path) for text in texts]
+    missing = [i for i, text_ids in enumerate(ids) if text_ids is None]
+    if len(missing) == len(texts):
+        return tokenizer(texts, return_tensors='pt', padding=True, truncation=True, max_length=512)
+    if missing:
+        tokenized = tokenizer([texts[i] for i in missing], truncation=True, max_length=512)['input_ids']
+        for i, text_ids in zip(missing, tokenized):
+            ids[i] = text_ids
+
+    input_ids = torch.full((len(ids), max(map(len, ids))), tokenizer.pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros_like(input_ids)
+    for row, text_ids in enumerate(ids):
+        input_ids[row, :len(text_ids)] = torch.tensor(text_ids, dtype=torch.long)
+        attention_mask[row, :len(text_ids)] = 1
+    return {'input_ids': input_ids, 'token_type_ids': torch.zeros_like(input_ids), 'attention_mask': attention_mask}
+
+
+def encode_text(text: str, tokenizer, model) -> TextEncoding:
+    """Run one BERT forward pass over text and wrap the result"""
+    inputs = tokenize_texts([text], tokenizer)
+    with torch.no_grad():
+        outputs = model(**inputs)
+    # float() so reduced-precision encoders still hand float32 states to the metrics
+    return TextEncoding(text, outputs.last_hidden_state.float())
+
+
+def encode_texts(texts: List[str], tokenizer, model, batch_size: int = 16) -> List[TextEncoding]:
+    """
+    Encode many texts with padded batch forward passes.
+
+    Texts are grouped by length to keep padding small, and every output is
+    trimmed back to its own tokens so the views match encode_text.
+    """
+    encodings = [None] * len(texts)
+    order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+    for start in range(0, len(order), batch_size):
+        chunk = order[start:start + batch_size]
+        inputs = tokenize_texts([texts[i] for i in chunk], tokenizer)
+        with torch.no_grad():
+            outputs = model(**inputs)
+        lengths = inputs['attention_mask'].sum(dim=1).tolist()
+        for row, i in enumerate(chunk):
+            # clone() so a cached encoding does not keep the whole padded batch alive
+            encodings[i] = TextEncoding(texts[i], outputs.last_hidden_state[row:row + 1, :lengths[row], :].float().clone())
+    return encodings
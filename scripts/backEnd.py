@@ -22,6 +22,47 @@ from flask_cors import CORS
 app = Flask(__name__)
 CORS(app)
 
+# Development server settings; in production run `gunicorn backEnd:app` from this
+# directory, which picks up gunicorn.conf.py (pre-forked workers, same variables)
+HOST = os.environ.get('PASSER_HOST', '127.0.0.1')
+PORT = int(os.environ.get('PASSER_PORT', 8088))
+DEBUG = os.environ.get('PASSER_DEBUG', '0') == '1'
+
+# Load the tokenizer and model for BERT once per process instead of per request
+print("Loading BERT encoder")
+bert_tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
+bert_model = BertModel.from_pretrained('bert-base-uncased')
+bert_model.eval()
+bert_model.requires_grad_(False)
+
+# Warm-up inference so the first request does not pay for lazy initialisation
+with torch.no_grad():
+    bert_model(**bert_tokenizer("Warm-up sentence for the encoder.", return_tensors='pt', padding=True, truncation=True, max_length=512))
+print("BERT encoder ready")
+
+# nltk data is read lazily by the metrics; load it before serving so a missing
+# resource shows up in /ready instead of failing the first request
+nltk_resources = {}
+for name, load in (('wordnet', nltk.corpus.wordnet.ensure_loaded),
+                   ('punkt', lambda: word_tokenize("Warm-up sentence. For the tokenizer."))):
+    try:
+        load()
+        nltk_resources[name] = True
+    except LookupError as e:
+        print(f"nltk resource {name} is not installed: {e}")
+        nltk_resources[name] = False
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    # Liveness only: the process is up and serving requests
+    return jsonify({'status': 'ok'})
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    # The encoder is loaded before the server starts listening
+    is_ready = all(nltk_resources.values())
+    return jsonify({'model': 'bert-base-uncased', 'ready': is_ready, 'nltk': nltk_resources}), (200 if is_ready else 503)
+
 @app.route('/metrics', methods=['POST'])
 def metrics():
     data = request.json
@@ -129,19 +170,8 @@ def calc_metrics (reference:str, candidate:str, userID:str, testID:str, descript
     lidstone_perplexity = model.perplexity(next(test_data))
     print(f"Lidstone Perplexity of the test text: {lidstone_perplexity}")
 
-    # Function to encode text to BERT embeddings
-    def get_bert_embedding(text, tokenizer, model):
-        # Tokenize and convert to tensor
-        inputs = tokenizer(text, return_tensors="pt", padding=True, truncation=True, max_length=512)
-        # Get embeddings
-        with torch.no_grad():
-            outputs = model(**inputs)
-        # Use the [CLS] token embedding for representing the sentence
-        return outputs.last_hidden_state[:, 0, :].numpy()
-
-    # Initialize the tokenizer and model for BERT
-    tokenizer = BertTokenizer.from_pretrained('bert-base-uncased')
-    model = BertModel.from_pretrained('bert-base-uncased')
+    # Shared tokenizer and model for BERT (loaded once at startup)
+    tokenizer, model = bert_tokenizer, bert_model
 
     # Sample text paragraphs
     text_1 = reference
@@ -163,16 +193,9 @@ def calc_metrics (reference:str, candidate:str, userID:str, testID:str, descript
     # Calculate cosine similarity between the two embeddings
     cosine_similarity = torch.nn.functional.cosine_similarity(embeddings_1, embeddings_2)
 
-    # Function to encode text to BERT embeddings
-    def get_bert_embedding_manhatan(text, tokenizer, model):
-        inputs = tokenizer(text, return_tensors="pt", padding=True, truncation=True, max_length=512)
-        with torch.no_grad():
-            outputs = model(**inputs)
-        # Aggregate embedding representation
-        return outputs.last_hidden_state.mean(dim=1).numpy()
-
-    embedding1M = get_bert_embedding_manhatan(text_1, tokenizer, model)
-    embedding2M = get_bert_embedding_manhatan(text_2, tokenizer, model)
+    # Mean-pooled embeddings derived from the same forward passes as the [CLS] embeddings
+    embedding1M = outputs_1.last_hidden_state.mean(dim=1).numpy()
+    embedding2M = outputs_2.last_hidden_state.mean(dim=1).numpy()
 
     # Calculate Pearson Correlation Coefficient
     pearson_corr, _ = pearsonr(embedding1M.flatten(), embedding2M.flatten())
@@ -264,6 +287,6 @@ def calc_metrics (reference:str, candidate:str, userID:str, testID:str, descript
     return jsonify({'message': 'Metrics calculated successfully.'})
 
 if __name__ == '__main__':
-    app.run(debug=True, host='127.0.0.1', port=8088)
+    app.run(debug=DEBUG, host=HOST, port=PORT)
 
 
@@ -0,0 +1,36 @@
+# Production serving: `gunicorn backEnd:app` (or backEndTimes:app) from this directory.
+#
+# The master imports the app, which loads the BERT encoder, and the nltk
+# resources, then forks the workers, which share the weight pages
+# copy-on-write. `kill -HUP <master pid>` replaces the workers gracefully
+# (in-flight requests get graceful_timeout seconds to finish); new code needs
+# a full restart or the USR2 binary upgrade.
+import os
+
+import torch
+
+bind = f"{os.environ.get('PASSER_HOST', '127.0.0.1')}:{os.environ.get('PASSER_PORT', 8088)}"
+workers = int(os.environ.get('PASSER_WORKERS', 2))
+worker_class = 'gthread'
+threads = int(os.environ.get('PASSER_THREADS', 4))
+preload_app = True
+timeout = int(os.environ.get('PASSER_TIMEOUT', 300))
+graceful_timeout = int(os.environ.get('PASSER_GRACEFUL_TIMEOUT', 60))
+
+# torch intra-op threads per worker; keep workers * torch threads near the core count
+TORCH_THREADS = int(os.environ.get('PASSER_TORCH_THREADS', max(1, (os.cpu_count() or 1) // workers)))
+
+
+def when_ready(server):
+    import nltk
+
+    # nltk's lazy WordNet loader is not thread-safe; load it once before the first fork
+    try:
+        nltk.corpus.wordnet.ensure_loaded()
+    except LookupError as e:
+        server.log.error(f"WordNet is not installed, METEOR will fail: {e}")
+    server.log.info(f"Serving {workers} workers x {threads} threads, {TORCH_THREADS} torch threads each")
+
+
+def post_fork(server, worker):
+    torch.set_num_threads(TORCH_THREADS)
@@ -104,10 +104,23 @@ const TestRAGbat = () => {
     }
     
     const startTest = async () => {
+        // Do not start a batch while the scoring backend is still loading its encoder
+        try {
+            await axios.get(configuration.passer.PythonScore.replace(/\/metrics$/, '/ready'));
+        } catch (error) {
+            console.error('Scoring backend is not ready', error);
+            alert('The scoring backend is still loading, please try again in a moment.');
+            return;
+        }
         setIsTesting(true);
         setTotal(QAJSON.length);
         setResults('');
         var retriever;
+        // Answers are scored in batches through /metrics/batch instead of one request per question
+        const scoreBatchSize = 8;
+        let pendingMetrics = [];
+        // Cleared when the backend has no /metrics/batch route
+        let batchSupported = true;
         for (let i = 0; i < QAJSON.length; i++) {
             console.log("QAJSON[i]", QAJSON[i], i, selectedDB);
             const question = QAJSON[i].question;
@@ -164,7 +177,40 @@ const TestRAGbat = () => {
                 description: 'question: ' + question.replace(/[^\x00-\x7F]/g, "") + ', answer: ' + res.text.replace(/[^\x00-\x7F]/g, "")
             }
             console.log("to back ----> ", metrics.description);
-            await axios.post(configuration.passer.PythonScore, metrics);
+            pendingMetrics.push(metrics);
+            if (pendingMetrics.length >= scoreBatchSize || i === QAJSON.length - 1) {
+                const batch = {
+                    userID: localStorage.getItem("wharf_user_name"),
+                    testID: testName,
+                    items: pendingMetrics
+                };
+                // The backend answers 429 while its bulk queue is full; wait as long as it asks and resend
+                for (;;) {
+                    if (!batchSupported) {
+                        // Backends without /metrics/batch (scripts/backEnd.py) score one question per request
+                        for (const metrics of pendingMetrics) {
+                            await axios.post(configuration.passer.PythonScore, metrics);
+                        }
+                        break;
+                    }
+                    try {
+                        await axios.post(configuration.passer.PythonScore + '/batch', batch);
+                        break;
+                    } catch (error) {
+                        if (error.response && error.response.status === 404) {
+                            batchSupported = false;
+                            continue;
+                        }
+                        if (!error.response || error.response.status !== 429) {
+                            throw error;
+                        }
+                        const retryAfter = Number(error.response.headers['retry-after']) || 5;
+                        console.log("scoring backend busy, retrying in", retryAfter, "s");
+                        await new Promise(resolve => setTimeout(resolve, retryAfter * 1000));
+                    }
+                }
+                pendingMetrics = [];
+            }
             setResults(prevResults => prevResults + (i+1).toString() + '-> Question: ' + question + '\n' + 'Reference: ' + QAJSON[i].answer + '\n' + 'Answer: ' + res.text + '\n\n');
             setCompleted(i + 1);
         }